@@ -6,7 +6,9 @@ import os
 import traceback
 
 import rhubarbe.main
+import rhubarbe.daemon
 from .selector import MisformedRange
+from .inventorynodes import MisformedQuery
 
 
 class Rhubarbe:
@@ -49,18 +51,28 @@ class Rhubarbe:
                 print(f"Unknown subcommand {subcommand} "
                     f"- use one among {{{','.join(supported)}}}")
                 exit(1)
-        # do it
-        entry_point = getattr(rhubarbe.main, subcommand)
-        # remove subcommand from args
-        try:
-            exit(entry_point(*args))
-        except MisformedRange as exc:
-            print("ERROR: ", exc)
-            exit(1)
-        except Exception as exc:                        # pylint: disable=broad-except
-            traceback.print_exc()
-            print(f"{command} {subcommand} : Something went badly wrong : {exc}")
-            exit(1)
+        # try the resident daemon if there is one
+        if rhubarbe.daemon.daemon_applies(subcommand, args):
+            code = rhubarbe.daemon.run_remote(subcommand, args)
+            if code is not None:
+                exit(code)
+        exit(run_subcommand(command, subcommand, args))
+
+
+def run_subcommand(command, subcommand, args):
+    """
+    run one subcommand in this process, and return its exit code
+    """
+    entry_point = getattr(rhubarbe.main, subcommand)
+    try:
+        return entry_point(*args)
+    except (MisformedRange, MisformedQuery) as exc:
+        print("ERROR: ", exc)
+        return 1
+    except Exception as exc:                            # pylint: disable=broad-except
+        traceback.print_exc()
+        print(f"{command} {subcommand} : Something went badly wrong : {exc}")
+        return 1
 
 def main():
     Rhubarbe().main()
@@ -12,6 +12,7 @@ from asynciojobs import Job, Scheduler
 
 from rhubarbe.node import Node
 from rhubarbe.display import Display
+from rhubarbe.display_json import DisplayJson
 
 
 class Action:
@@ -28,9 +29,13 @@ class Action:
         'bothoff': 'turn_both_off',
     }
 
-    def __init__(self, verb, selector):
+    def __init__(self, verb, selector, json=False, cmc_timeout=None):
         self.verb = verb
         self.selector = selector
+        self.json = json
+        # for each CMC request, None means the default for that verb
+        self.cmc_timeout = cmc_timeout
+        self.display = None
 
     async def get_and_show_verb(self, node, verb):
         assert verb in Action.verb_to_method
@@ -38,6 +43,10 @@ class Action:
         method = getattr(node, Action.verb_to_method[verb])
         # bound methods must not be passed the subject !
         result = await method()
+        if self.json:
+            self.display.emit_node(node.control_hostname(), verb, result,
+                                   cmc=node.cmc_name, ok=result is not None)
+            return
         result = result if result is not None else f"{verb} N/A"
         for line in result.split("\n"):
             if line:
@@ -51,22 +60,30 @@ class Action:
         and False otherwise - including in case of KeyboardInterrupt
         """
 
-        nodes = [Node(cmc_name, message_bus)
+        nodes = [Node(cmc_name, message_bus, cmc_timeout=self.cmc_timeout)
                  for cmc_name in self.selector.cmc_names()]
         jobs = [Job(self.get_and_show_verb(node, self.verb), critical=True)
                 for node in nodes]
-        display = Display(nodes, message_bus)
+        display_class = Display if not self.json else DisplayJson
+        display = self.display = display_class(nodes, message_bus)
         scheduler = Scheduler(Job(display.run(), forever=True, critical=True),
                               *jobs,
                               timeout=timeout,
                               critical=False)
         try:
-            if scheduler.run():
+            with display.stray_output():
+                success = scheduler.run()
+            if success:
                 return True
             else:
-                scheduler.debrief(silence_done_jobs=True)
-                print(f"rhubarbe-{self.verb} failed: {scheduler.why()}")
+                display.set_goodbye(
+                    f"rhubarbe-{self.verb} failed: {scheduler.why()}")
+                if not display.machine_readable:
+                    scheduler.debrief(silence_done_jobs=True)
                 return False
         except KeyboardInterrupt:
-            print(f"rhubarbe-{self.verb} : keyboard interrupt - exiting")
+            display.set_goodbye(
+                f"rhubarbe-{self.verb} : keyboard interrupt - exiting")
             return False
+        finally:
+            display.epilogue()
@@ -1,9 +1,15 @@
 # a fastapi based API to read relay temperatures
+import time
+
 from fastapi import FastAPI, APIRouter
 from pydantic import BaseModel
 from typing import Optional
 
+import pandas as pd
+
+from ..config import Config
 from ..inventoryrelays import InventoryRelays
+from ..relaysdb import RelaysDatabase
 
 inventory_relays = InventoryRelays.load()
 
@@ -13,6 +19,85 @@ app = FastAPI()
 api_v1 = APIRouter(prefix="/api/v1")
 
 
+class TemperaturesCache:
+    """
+    keeps the recent samples in memory, and the answers to recent queries
+
+    * the frame covers the last <window> seconds; it is extended
+      by tailing the database from the last rowid seen, which is only
+      done when the database has changed (PRAGMA data_version)
+    * answers are memoised per (duration, resample_period), until
+      new samples arrive, or after <ttl> seconds
+    * queries that go beyond the window are served by the database
+    """
+
+    def __init__(self, database, window, ttl):
+        self.database = database
+        self.window = window
+        self.ttl = ttl
+        self.frame = InventoryRelays.frame([])
+        self.last_rowid = 0
+        self.version = None
+        # (duration, resample_period) -> (time, json)
+        self.memo = {}
+
+    def refresh(self):
+        version = self.database.data_version()
+        if version == self.version:
+            return
+        self.version = version
+        now = time.time()
+        rows = self.database.tail(self.last_rowid, since=now - self.window)
+        if not rows:
+            return
+        self.last_rowid = rows[-1][0]
+        new = InventoryRelays.frame([row[1:] for row in rows])
+        threshold = pd.Timestamp(now - self.window, unit='s', tz='UTC')
+        frame = pd.concat([self.frame, new]) if len(self.frame) else new
+        self.frame = frame[frame.index >= threshold]
+        self.memo.clear()
+
+    def compute(self, duration, resample_period):
+        if duration is None:
+            return None
+        seconds = pd.Timedelta(duration).total_seconds()
+        if seconds > self.window:
+            return None
+        threshold = pd.Timestamp(time.time() - seconds, unit='s', tz='UTC')
+        df = self.frame[self.frame.index >= threshold]
+        if resample_period is not None:
+            # same buckets as the database, with no empty bucket
+            df = (df.groupby('relay')
+                  .resample(resample_period, origin='epoch')['temperature']
+                  .mean().dropna().to_frame())
+        return df
+
+    def get(self, duration, resample_period):
+        """
+        the answer to a query, as json
+        """
+        self.refresh()
+        key = (duration, resample_period)
+        now = time.time()
+        if key in self.memo and now - self.memo[key][0] < self.ttl:
+            return self.memo[key][1]
+        df = self.compute(duration, resample_period)
+        if df is None:
+            df = inventory_relays.load_past_data(
+                duration=duration, resample_period=resample_period,
+                database=self.database)
+        result = df.reset_index().to_json(orient='records', date_format='iso')
+        self.memo[key] = (now, result)
+        return result
+
+
+the_config = Config()
+temperatures_cache = TemperaturesCache(
+    RelaysDatabase(),
+    window=float(the_config.value('testbed', 'relays_api_window')),
+    ttl=float(the_config.value('testbed', 'relays_api_ttl')))
+
+
 class RelayTemperatureQuery(BaseModel):
     duration: Optional[str] = None
     resample_period: Optional[str] = None
@@ -24,11 +109,7 @@ async def get_relays_temperatures(params: RelayTemperatureQuery):
     Retrieve relay temperatures with optional filtering by duration and resample period.
     """
     # both parameters are optional and can be passed in a JSON body
-    df = inventory_relays.load_past_data(
-        duration=params.duration,
-        resample_period=params.resample_period
-    ).reset_index()
-    return df.to_json(orient='records', date_format='iso')
+    return temperatures_cache.get(params.duration, params.resample_period)
 
 app.include_router(api_v1)
 def run_relays_api_service():
@@ -13,6 +13,12 @@ import requests
 
 from .config import Config
 from .r2labapiproxy import R2labApiProxy, iso_to_epoch, epoch_to_iso
+from .leasescache import LeasesCache
+from .leasesindex import LeasesIndex
+from .leases import Lease
+
+# how far ahead to look for a free slot
+NEXT_FREE_HORIZON = 7 * 24 * 3600
 
 class Book:
 
@@ -44,6 +50,13 @@ class Book:
         api_leases.sort(key=lambda lease: lease['t_from'])
         return api_leases
 
+    def index(self, start, end) -> LeasesIndex:
+        """
+        a LeasesIndex over the leases for the given time slot
+        """
+        return LeasesIndex(Lease(api_lease)
+                           for api_lease in self.leases(start, end))
+
     def canonical_date(self, date):
         """
         return a date as a Unix epoch
@@ -100,7 +113,26 @@ class Book:
             f"-> {self.date_to_string(end)}")
         for lease in leases:
             self.verbose(f"{14*' '}{self.lease_repr(lease)}")
-        return not leases
+        # leases that merely touch the slot do not count
+        return LeasesIndex(Lease(lease) for lease in leases).is_free(start, end)
+
+    def next_free(self, start, end):
+        """
+        the first free slot with the same duration as [start, end)
+        that starts at or after start, as a (start, end) tuple
+        or None if there is none in the next NEXT_FREE_HORIZON seconds
+        """
+        duration = end - start
+        horizon = start + NEXT_FREE_HORIZON
+        free = self.index(start, horizon).next_free_slot(
+            duration, after=start, until=horizon)
+        if free is None:
+            print(f"no free slot of {duration//60} minutes"
+                  f" before {self.date_to_string(horizon)}")
+            return None
+        self.verbose(f"next free slot: {self.date_to_string(free)} "
+                     f"-> {self.date_to_string(free + duration)}")
+        return free, free + duration
 
     def book(self, slice_name, start, end) -> bool:
         """
@@ -117,6 +149,7 @@ class Book:
                 't_until': epoch_to_iso(end),
             })
             self.verbose(f"new lease id: {lease['id']}")
+            LeasesCache().invalidate()
             return True
         except requests.exceptions.HTTPError as exc:
             if exc.response.status_code == 409:
@@ -174,6 +207,7 @@ class Book:
             try:
                 self.proxy.update_lease(
                     lease_id, {'t_until': epoch_to_iso(new_end)})
+                LeasesCache().invalidate()
                 return True
             except Exception as exc:
                 print(f"exception in update_lease: {type(exc)}: {exc}")
@@ -185,6 +219,7 @@ class Book:
         self.verbose(f"deleting future lease {lease_id}")
         try:
             self.proxy.delete_lease(lease_id)
+            LeasesCache().invalidate()
             self.verbose(f"successful")
             return True
         except Exception as exc:
@@ -200,6 +235,11 @@ class Book:
         parser.add_argument(
             "-d", "--delete", action="store_true",
             help="delete the lease for the given time slot")
+        parser.add_argument(
+            "-n", "--next-free", action="store_true",
+            help="use the first free slot with the same duration,"
+                 " starting at start time or later;"
+                 " with -q, just display it")
         parser.add_argument(
             "-s", "--slice",
             help="slice name - mandatory unless using -q")
@@ -222,6 +262,15 @@ class Book:
         start = book.canonical_date(args.start)
         end = book.canonical_date(args.end)
         try:
+            if args.next_free:
+                slot = book.next_free(start, end)
+                if slot is None:
+                    return False
+                start, end = slot
+                if args.query:
+                    print(f"{book.date_to_string(start)} "
+                          f"-> {book.date_to_string(end)}")
+                    return True
             if args.query:
                 return book.query(start, end)
             elif args.delete:
@@ -0,0 +1,138 @@
+"""
+Sending requests to the CMC of the nodes
+
+a single straggling CMC should not hold a whole batch; so each
+request has its own timeout - much shorter than the global one;
+read-only requests get cmc_request_timeout, the ones that change
+the node state get cmc_default_timeout, unless the caller says
+otherwise - and failed requests get retried when that is safe:
+
+* requests that could not connect are always retried,
+  since they have not reached the CMC
+* idempotent verbs are retried on any failure; among them, the
+  read-only ones get hedged: if no answer after hedge_delay,
+  a second request is issued and the first answer wins; the delay
+  only counts from the moment the request is actually sent, and
+  there is no hedging when the fanout is already saturated
+* the number of requests in flight is capped by fanout
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation
+
+import asyncio
+import weakref
+
+import aiohttp
+
+from rhubarbe.singleton import Singleton
+from rhubarbe.config import Config
+from rhubarbe.logger import logger
+
+# sending them twice is harmless
+IDEMPOTENT_VERBS = {'status', 'info', 'usrpstatus',
+                    'on', 'off', 'usrpon', 'usrpoff'}
+# these do not change anything, so can be hedged
+HEDGED_VERBS = {'status', 'info', 'usrpstatus'}
+
+
+class CmcClient(metaclass=Singleton):
+
+    def __init__(self):
+        nodes = Config().snapshot.nodes
+        # for read-only requests
+        self.timeout = nodes.cmc_request_timeout
+        # for the other ones
+        self.action_timeout = nodes.cmc_default_timeout
+        self.retries = nodes.cmc_retries
+        self.hedge_delay = nodes.cmc_hedge_delay
+        self.fanout = nodes.cmc_fanout
+        # one per event loop, as a semaphore cannot be shared
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def __repr__(self):
+        return (f"<CmcClient timeout={self.timeout}s"
+                f"/{self.action_timeout}s retries={self.retries}"
+                f" hedge={self.hedge_delay}s fanout={self.fanout}>")
+
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.fanout)
+        return self._semaphores[loop]
+
+    def timeout_for(self, verb):
+        return self.timeout if verb in HEDGED_VERBS else self.action_timeout
+
+    async def _attempt(self, url, timeout, sent=None):
+        async with self.semaphore():
+            if sent is not None:
+                sent.set()
+            # the timeout does not include the time spent in the queue
+            http_timeout = aiohttp.ClientTimeout(total=timeout)
+            async with aiohttp.ClientSession(timeout=http_timeout) as session:
+                async with session.get(url) as response:
+                    return await response.text(encoding='utf-8')
+
+    async def _hedged(self, url, timeout):
+        sent = asyncio.Event()
+        first = asyncio.create_task(self._attempt(url, timeout, sent))
+        # time spent waiting for the semaphore does not count
+        waiting = asyncio.create_task(sent.wait())
+        pending = {first, waiting}
+        try:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            waiting.cancel()
+            pending = {first}
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if done:
+                return first.result()
+            # a hedge would just queue up behind the other requests
+            if self.semaphore().locked():
+                return await first
+            logger.info(
+                f"{url}: no answer after {self.hedge_delay}s - hedging")
+            pending.add(asyncio.create_task(self._attempt(url, timeout)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # including when we get cancelled, e.g. by a timeout
+            for task in pending:
+                task.cancel()
+
+    async def get(self, cmc_name, verb, timeout=None):
+        """
+        returns the CMC answer as a str
+        raises the last error if all attempts fail
+
+        timeout applies to each attempt, and defaults
+        to timeout_for(verb)
+        """
+        url = f"http://{cmc_name}/{verb}"
+        timeout = timeout or self.timeout_for(verb)
+        hedged = verb in HEDGED_VERBS and self.hedge_delay > 0
+        for attempt in range(self.retries + 1):
+            try:
+                if hedged:
+                    return await self._hedged(url, timeout)
+                return await self._attempt(url, timeout)
+            except aiohttp.ClientConnectorError as exc:
+                error = exc
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if verb not in IDEMPOTENT_VERBS:
+                    raise
+                error = exc
+            if attempt < self.retries:
+                logger.info(f"{url}: attempt {attempt+1} failed"
+                            f" ({type(error).__name__}) - retrying")
+        raise error
@@ -1,10 +1,20 @@
 """
 Utility for loading the config
 as a layered cake based on several locations
+
+the hostname-specific values are resolved once, and the result is
+cached on disk - keyed on the mtimes of the config files - so that
+most runs do not need to parse the config files at all
+
+hot code paths should use Config().snapshot, that exposes
+the resolved values as typed, read-only attributes, e.g.
+Config().snapshot.nodes.cmc_default_timeout
 """
 
 import os
+import json
 import socket
+import tempfile
 import configparser
 from pathlib import Path
 
@@ -37,34 +47,218 @@ LOCATIONS = [
 ]
 
 
+# set RHUBARBE_CONFIG_CACHE to an empty string to disable the cache
+CACHE_LOCATION = "~/.cache/rhubarbe/config.json"
+
+
 class ConfigException(Exception):
     pass
 
 
+def typed(value):
+    """
+    the config only has strings; numbers get converted
+    """
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+class ConfigSection:
+    """
+    the resolved values of one section, as read-only attributes
+    """
+
+    def __init__(self, name, values):
+        # plain instance attributes, the fastest to read
+        self.__dict__.update(
+            {flag: typed(value) for flag, value in values.items()})
+        self.__dict__['_name'] = name
+
+    def __repr__(self):
+        return f"<ConfigSection {self._name}>"
+
+    # only called when the attribute is not found
+    def __getattr__(self, flag):
+        if flag.startswith('__'):
+            raise AttributeError(flag)
+        raise ConfigException(
+            f"rhubarbe config: missing entry section={self._name}"
+            f" key={flag}")
+
+    def __getitem__(self, flag):
+        return getattr(self, flag)
+
+    def __setattr__(self, flag, value):
+        raise AttributeError(f"config section {self._name} is read-only")
+
+    def __delattr__(self, flag):
+        raise AttributeError(f"config section {self._name} is read-only")
+
+
+class ConfigSnapshot:
+    """
+    the resolved config, with sections as read-only attributes
+    """
+
+    def __init__(self, resolved):
+        self.__dict__.update({
+            name: ConfigSection(name, values)
+            for name, values in resolved.items()})
+
+    def __getattr__(self, section):
+        if section.startswith('__'):
+            raise AttributeError(section)
+        raise ConfigException(f"No such section {section} in config")
+
+    def __getitem__(self, section):
+        return getattr(self, section)
+
+    def __setattr__(self, section, value):
+        raise AttributeError("config snapshot is read-only")
+
+    def __delattr__(self, section):
+        raise AttributeError("config snapshot is read-only")
+
+
 class Config(metaclass=Singleton):
 
     def __init__(self):
-        self.parser = configparser.ConfigParser()
-        self.files = []
-        # load all configurations when they exist
-        for location, exists, mandatory in LOCATIONS:
-            if exists is None:
-                exists = Path(location).exists()
-            if exists:
-                self.files.append(location)
-                self.parser.read(location)
-                logger.info(f"Loaded config from {location}")
-            elif mandatory:
-                raise ConfigException(
-                    f"Missing mandatory config file {location}")
-        #
         self._hostname = None
+        self._parser = None
+        self._snapshot = None
+        self._local_control_ip = None
+        self.files = []
+        # section -> flag -> value, with hostname-specific values applied
+        self.resolved = None
+        stamp = self.stamp()
+        cached = self.load_cache(stamp)
+        if cached:
+            self.files = cached['files']
+            self.resolved = cached['resolved']
+            logger.info(f"Loaded config from cache {self.cache_path()}")
+        else:
+            self.resolved = self.resolve(self.parser)
+            self.store_cache(stamp)
+
+    @property
+    def parser(self):
+        """
+        the raw configparser object, only built when needed
+        """
+        if self._parser is None:
+            self._parser = configparser.ConfigParser()
+            self.files = []
+            # load all configurations when they exist
+            for location, exists, mandatory in LOCATIONS:
+                if exists is None:
+                    exists = Path(location).exists()
+                if exists:
+                    self.files.append(str(location))
+                    self._parser.read(location)
+                    logger.info(f"Loaded config from {location}")
+                elif mandatory:
+                    raise ConfigException(
+                        f"Missing mandatory config file {location}")
+        return self._parser
 
     def local_hostname(self):
         if not self._hostname:
             self._hostname = socket.gethostname().split('.')[0]
         return self._hostname
 
+    def resolve(self, parser):
+        """
+        apply the hostname-specific values, i.e. foo.myhostname
+        takes precedence over foo if set and not empty
+        """
+        # configparser has lowercased all keys
+        suffix = f".{parser.optionxform(self.local_hostname())}"
+        resolved = {}
+        for name, config_section in parser.items():
+            values = {}
+            for flag in config_section.keys():
+                try:
+                    values[flag] = config_section[flag]
+                except configparser.InterpolationError as exc:
+                    logger.warning(f"config: ignoring {name}.{flag}: {exc}")
+            for flag, value in list(values.items()):
+                if flag.endswith(suffix) and value:
+                    values[flag[:-len(suffix)]] = value
+            resolved[name] = values
+        return resolved
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = ConfigSnapshot(self.resolved)
+        return self._snapshot
+
+    # the on-disk cache
+    @staticmethod
+    def cache_path():
+        """
+        the cache is shared by all directories, so it is not used
+        when there is a config file in the current directory
+        """
+        location = os.environ.get("RHUBARBE_CONFIG_CACHE", CACHE_LOCATION)
+        if not location:
+            return None
+        if any(Path(local).exists() for local, *_ in LOCATIONS
+               if not Path(local).is_absolute()):
+            return None
+        return Path(location).expanduser()
+
+    def stamp(self):
+        """
+        what the resolved config depends on, except
+        for the files in the current directory
+        """
+        files = []
+        for location, *_ in LOCATIONS:
+            path = Path(location)
+            if not path.is_absolute():
+                continue
+            try:
+                stat = path.stat()
+                files.append([str(path), stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                files.append([str(path), None, None])
+        return {'hostname': self.local_hostname(), 'files': files}
+
+    def load_cache(self, stamp):
+        path = self.cache_path()
+        if path is None:
+            return None
+        try:
+            with path.open(encoding='utf-8') as reader:
+                cached = json.load(reader)
+        except (OSError, ValueError):
+            return None
+        if cached.get('stamp') != stamp:
+            return None
+        return cached
+
+    def store_cache(self, stamp):
+        path = self.cache_path()
+        if path is None:
+            return
+        entry = {'stamp': stamp, 'files': self.files,
+                 'resolved': self.resolved}
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # mkstemp creates the file as 0600, the config may hold secrets
+            fd, temporary = tempfile.mkstemp(
+                dir=path.parent, prefix=f".{path.name}.")
+            with os.fdopen(fd, 'w', encoding='utf-8') as writer:
+                json.dump(entry, writer)
+            os.replace(temporary, path)
+        except OSError as exc:
+            logger.warning(f"could not store config cache {path}: {exc}")
+
     @staticmethod
     def get_or_raise(dictobj, section, key):
         res = dictobj.get(key, None)
@@ -75,13 +269,9 @@ class Config(metaclass=Singleton):
                 f"rhubarbe config: missing entry section={section} key={key}")
 
     def value(self, section, flag):
-        if section not in self.parser:
+        if section not in self.resolved:
             raise ConfigException(f"No such section {section} in config")
-        config_section = self.parser[section]
-        hostname = self.local_hostname()
-        key = f"{flag}.{hostname}"
-        return config_section.get(key, None) \
-            or self.get_or_raise(config_section, section, flag)
+        return self.get_or_raise(self.resolved[section], section, flag)
 
     def full_section(self, section) -> dict:
         if section not in self.parser:
@@ -98,25 +288,28 @@ class Config(metaclass=Singleton):
     # maybe this one too
     def local_control_ip(self):
         # if specified in the config file, then use that
-        if ('networking' in self.parser and
-                'local_control_ip' in self.parser['networking']):
-            return self.parser['networking']['local_control_ip']
-        # but otherwise guess it
-        # do not import at toplevel to avoid import loop
-        from rhubarbe.inventorynodes import InventoryNodes
-        the_inventory = InventoryNodes()
-        from rhubarbe.guessip import local_ip_on_same_network_as
-        ipaddr, _ = local_ip_on_same_network_as(
-            the_inventory.one_control_interface())
-        return ipaddr
+        networking = self.resolved.get('networking', {})
+        if 'local_control_ip' in networking:
+            return networking['local_control_ip']
+        # but otherwise guess it, once per process
+        if self._local_control_ip is None:
+            # do not import at toplevel to avoid import loop
+            from rhubarbe.inventorynodes import InventoryNodes
+            the_inventory = InventoryNodes()
+            from rhubarbe.guessip import cached_local_ip_on_same_network_as
+            self._local_control_ip, _ = cached_local_ip_on_same_network_as(
+                the_inventory.one_control_interface(),
+                networking.get('local_control_ip_cache'))
+        return self._local_control_ip
 
     def display(self, sections):
+        parser = self.parser
         for i, file in enumerate(self.files):
             print(f"{i+1}-th config file = {file}")
 
         def match(section, sections):
             return not sections or section in sections
-        for sname, section in sorted(self.parser.items()):
+        for sname, section in sorted(parser.items()):
             if match(sname, sections) and section:
                 print(10*'=', f" section {sname}")
                 for fname, value in sorted(section.items()):
@@ -0,0 +1,397 @@
+"""
+An optional resident rhubarbe process, and its thin client
+
+the daemon listens on a unix socket, and runs the (whitelisted)
+subcommands that it receives in-process; so that config, inventory,
+and all the python modules are loaded once and for all
+
+when a rhubarbe-* command starts, it tries the daemon first,
+and falls back to running in-process if
+* RHUBARBE_NO_DAEMON is set,
+* there is a ./rhubarbe.conf or ./rhubarbe.conf.local
+  (the daemon would not see it),
+* the daemon is not running, or is busy with another command
+
+the daemon runs one command at a time, because commands use
+process-wide state (current directory, environment, singletons);
+while a command runs, others just run in-process
+
+when the client goes away - e.g. on Ctrl-C - the command gets
+interrupted, as if Ctrl-C had been hit in-process
+
+protocol: the client sends one json line with argv, env and cwd;
+the daemon answers with json lines {"stdout": text}, {"stderr": text}
+and eventually {"exit": code}, or {"busy": true}
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation, import-outside-toplevel
+
+# keep this module light, it is imported by all the rhubarbe-* commands
+
+import os
+import sys
+import json
+import ctypes
+import socket
+import threading
+import traceback
+from pathlib import Path
+
+DEFAULT_SOCKET = "~/.rhubarbe-daemon.sock"
+
+# the subcommands that make sense in the daemon: non-interactive,
+# not tied to a terminal, and not meant to run forever
+DAEMON_COMMANDS = {
+    'nodes', 'status', 'on', 'off', 'reset', 'info',
+    'usrpstatus', 'usrpon', 'usrpoff', 'wait', 'inventory', 'resolve',
+}
+
+
+def socket_path():
+    return Path(os.environ.get("RHUBARBE_DAEMON_SOCKET",
+                               DEFAULT_SOCKET)).expanduser()
+
+
+def daemon_applies(subcommand, args):
+    if subcommand not in DAEMON_COMMANDS:
+        return False
+    if os.environ.get("RHUBARBE_NO_DAEMON"):
+        return False
+    # the daemon would not see local config files
+    if Path("rhubarbe.conf").exists() or Path("rhubarbe.conf.local").exists():
+        return False
+    # curses needs the terminal
+    if '-c' in args or '--curses' in args:
+        return False
+    return True
+
+
+# client side
+def run_remote(subcommand, args):
+    """
+    returns the exit code of the command as run by the daemon,
+    or None if the daemon could not run it
+    """
+    path = socket_path()
+    if not path.exists():
+        return None
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(str(path))
+    except OSError:
+        return None
+    request = dict(argv=[subcommand] + list(args),
+                   env=dict(os.environ), cwd=os.getcwd())
+    started = False
+    try:
+        with client, client.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if 'busy' in message:
+                    return None
+                started = True
+                if 'stdout' in message:
+                    sys.stdout.write(message['stdout'])
+                elif 'stderr' in message:
+                    sys.stderr.write(message['stderr'])
+                elif 'exit' in message:
+                    return message['exit']
+    except (OSError, ValueError) as exc:
+        if not started:
+            return None
+        print(f"lost connection to rhubarbe daemon: {exc}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        # the connection is closed by now, this interrupts the command
+        print("keyboard interrupt - exiting", file=sys.stderr)
+        return 1
+    # connection closed without an exit code
+    return None if not started else 1
+
+
+# server side
+class ThreadLocalStream:
+    """
+    to be installed as sys.stdout / sys.stderr; writes go to the
+    stream attached to the current thread, or to the default one
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def attach(self, stream):
+        self.local.stream = stream
+
+    def detach(self):
+        self.local.stream = None
+
+    def current(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def write(self, text):
+        return self.current().write(text)
+
+    def flush(self):
+        return self.current().flush()
+
+    def __getattr__(self, attribute):
+        return getattr(self.current(), attribute)
+
+
+def interrupt(thread_id):
+    """
+    raise KeyboardInterrupt in that thread, as soon as it runs python code
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(KeyboardInterrupt))
+
+
+class Cancellation:
+    """
+    stops the command run by a thread when its client goes away;
+    this is detected either by a failed write, or by watch()
+    that waits for the client to close the connection
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.thread_id = threading.get_ident()
+        self.lock = threading.Lock()
+        self.running = True
+        self.cancelled = False
+
+    def cancel(self):
+        with self.lock:
+            if not self.running or self.cancelled:
+                return
+            self.cancelled = True
+            if threading.get_ident() == self.thread_id:
+                raise KeyboardInterrupt
+            interrupt(self.thread_id)
+
+    def done(self):
+        with self.lock:
+            self.running = False
+
+    def watch(self):
+        # the client sends nothing after its request
+        try:
+            while self.connection.recv(1024):
+                pass
+        except OSError:
+            pass
+        self.cancel()
+
+
+class SocketStream:
+    """
+    a text stream that sends what is written as json lines
+    """
+
+    def __init__(self, writer, key, cancellation):
+        self.writer = writer
+        self.key = key
+        self.cancellation = cancellation
+
+    def write(self, text):
+        if text and not self.cancellation.cancelled:
+            try:
+                self.writer.write(
+                    json.dumps({self.key: text}).encode() + b"\n")
+                self.writer.flush()
+            except OSError:
+                # the client has gone away
+                self.cancellation.cancel()
+        return len(text)
+
+    def flush(self):
+        if not self.cancellation.cancelled:
+            try:
+                self.writer.flush()
+            except OSError:
+                self.cancellation.cancel()
+
+    @staticmethod
+    def isatty():
+        return False
+
+
+class RhubarbeDaemon:
+
+    def __init__(self, path=None):
+        self.path = Path(path).expanduser() if path else socket_path()
+        self.lock = threading.Lock()
+        self.stdout = ThreadLocalStream(sys.stdout)
+        self.stderr = ThreadLocalStream(sys.stderr)
+        # config gets (re)loaded from there
+        self.home = os.getcwd()
+        # path -> mtime of the files that the singletons were built from
+        self.sources = {}
+
+    def __repr__(self):
+        return f"<RhubarbeDaemon {self.path}>"
+
+    @staticmethod
+    def source_files():
+        """
+        all the places where config may come from, including the ones
+        that do not exist yet; made absolute as commands run elsewhere
+        """
+        from .config import Config, LOCATIONS
+        files = [str(Path(location).absolute())
+                 for location, *_ in LOCATIONS]
+        files.append(Config().value('testbed', 'inventory_nodes_path'))
+        return files
+
+    @staticmethod
+    def mtimes(files):
+        result = {}
+        for file in files:
+            try:
+                result[file] = os.stat(file).st_mtime
+            except OSError:
+                result[file] = None
+        return result
+
+    def warm_up(self):
+        """
+        load config, inventory, and the modules used by the commands
+        """
+        from .singleton import Singleton
+        from .config import Config
+        from .inventorynodes import InventoryNodes
+        from . import main                              # pylint: disable=w0611
+        from . import action, ssh, leases               # pylint: disable=w0611
+        Singleton._instances.clear()                    # pylint: disable=w0212
+        Config()
+        InventoryNodes()
+        self.sources = self.mtimes(self.source_files())
+
+    def refresh(self):
+        # start over if config or inventory have changed
+        if self.mtimes(self.sources) != self.sources:
+            from .logger import logger
+            logger.info("daemon: config or inventory changed - reloading")
+            self.warm_up()
+
+    @staticmethod
+    def exit_code(code):
+        """
+        same as what sys.exit(code) would do
+        """
+        if code is None:
+            return 0
+        if isinstance(code, int):
+            return code
+        print(code, file=sys.stderr)
+        return 1
+
+    def run_request(self, request, cancellation=None):
+        from .__main__ import run_subcommand
+        from .timing import Timings
+        argv = request['argv']
+        previous_env = dict(os.environ)
+        self.refresh()
+        try:
+            os.chdir(request.get('cwd', self.home))
+            os.environ.clear()
+            os.environ.update(request.get('env', previous_env))
+            Timings().reset()
+            command = f"rhubarbe-{argv[0]}"
+            sys.argv = [command] + argv[1:]
+            try:
+                try:
+                    return self.exit_code(
+                        run_subcommand(command, argv[0], argv[1:]))
+                finally:
+                    # not to be interrupted past this point
+                    if cancellation is not None:
+                        cancellation.done()
+            except SystemExit as exc:
+                # e.g. argparse errors or --help
+                return self.exit_code(exc.code)
+            except KeyboardInterrupt:
+                return 1
+        finally:
+            os.chdir(self.home)
+            os.environ.clear()
+            os.environ.update(previous_env)
+
+    def handle(self, connection):
+        from .logger import logger
+        with connection, connection.makefile('rwb') as stream:
+            try:
+                request = json.loads(stream.readline())
+                subcommand = request['argv'][0]
+            except (ValueError, KeyError, IndexError):
+                return
+            if (subcommand not in DAEMON_COMMANDS
+                    or not self.lock.acquire(blocking=False)):
+                stream.write(b'{"busy": true}\n')
+                stream.flush()
+                return
+            cancellation = Cancellation(connection)
+            try:
+                logger.info(f"daemon: running {' '.join(request['argv'])}")
+                self.stdout.attach(SocketStream(stream, 'stdout',
+                                                cancellation))
+                self.stderr.attach(SocketStream(stream, 'stderr',
+                                                cancellation))
+                threading.Thread(target=cancellation.watch,
+                                 daemon=True).start()
+                try:
+                    code = self.run_request(request, cancellation)
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+                finally:
+                    self.stdout.detach()
+                    self.stderr.detach()
+                if cancellation.cancelled:
+                    logger.warning(
+                        f"daemon: client went away, interrupted"
+                        f" {' '.join(request['argv'])}")
+                else:
+                    stream.write(
+                        json.dumps({'exit': code}).encode() + b"\n")
+                    stream.flush()
+            except OSError as exc:
+                logger.warning(f"daemon: client went away: {exc}")
+            finally:
+                # wake up the watcher
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.lock.release()
+
+    def serve_forever(self):
+        from .logger import logger
+        self.warm_up()
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        if self.path.exists():
+            self.path.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(self.path))
+        os.chmod(self.path, 0o600)
+        server.listen()
+        logger.info(f"daemon: listening on {self.path}")
+        try:
+            while True:
+                connection, _ = server.accept()
+                threading.Thread(target=self.handle, args=(connection,),
+                                 daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            self.path.unlink(missing_ok=True)
+        return 0
@@ -4,6 +4,7 @@ rhubarbe load
 """
 
 import time
+from contextlib import nullcontext
 
 # pip3 install progressbar33
 import progressbar
@@ -36,6 +37,10 @@ class DisplayNode:                                      # pylint: disable=r0903
 
 
 class Display:                                          # pylint: disable=r0902
+
+    # when set, nothing but the display should write on stdout
+    machine_readable = False
+
     def __init__(self, nodes, message_bus):
         self.message_bus = message_bus
         self.nodes = nodes
@@ -110,9 +115,10 @@ class Display:                                          # pylint: disable=r0902
                 delta = node_current_percent - node_previous_percent
                 node.percent = node_current_percent
                 self.total_percent += delta
-                logger.info(f"{node.name} percent: {node_current_percent}/100 "
-                            f"(was {node_previous_percent}), "
-                            f"total {self.total_percent}/{100*len(self.nodes)}")
+                # one per percent and per node, so keep this out of the way
+                logger.debug(f"{node.name} percent: {node_current_percent}/100 "
+                             f"(was {node_previous_percent}), "
+                             f"total {self.total_percent}/{100*len(self.nodes)}")
                 self.dispatch_ip_percent_hook(ipaddr, node, message,
                                               timestamp, duration)
             else:
@@ -166,6 +172,13 @@ class Display:                                          # pylint: disable=r0902
     def set_goodbye(self, message):
         self.goodbye_message = message
 
+    def stray_output(self):
+        """
+        a context manager for where to send the output
+        that does not come from the display
+        """
+        return nullcontext()
+
     ####################
     # specifics of the basic display
     def start_hook(self):
@@ -1,8 +1,13 @@
 """
 display class when using curses, like in
 rhubarbe load --curses
+
+messages only update a model of the screen - what text goes where;
+the screen gets redrawn at most fps times per second, and only
+for the parts that have changed since the previous frame
 """
 
+import asyncio
 import curses
 
 from rhubarbe.display import Display
@@ -20,6 +25,47 @@ class DisplayCurses(Display):
     # extra room on top and on the left
     offsetl = 3
     offsetc = 25
+    # max number of redraws per second
+    fps = 10
+
+    def __init__(self, nodes, message_bus):
+        super().__init__(nodes, message_bus)
+        # the model: (window, line, column) -> text
+        self.cells = {}
+        # the cells changed since the last redraw
+        self.dirty = set()
+
+    def put(self, window, line, column, text):
+        key = (window, line, column)
+        if self.cells.get(key) != text:
+            self.cells[key] = text
+            self.dirty.add(key)
+
+    def redraw(self):
+        if not self.dirty:
+            return
+        for key in self.dirty:
+            window, line, column = key
+            target = self.screen if window == 'screen' else self.subwin
+            target.addstr(line, column, self.cells[key])
+        self.dirty.clear()
+        self.screen.noutrefresh()
+        self.subwin.noutrefresh()
+        curses.doupdate()
+
+    async def redraw_forever(self):
+        while True:
+            await asyncio.sleep(1 / self.fps)
+            self.redraw()
+
+    async def run(self):
+        redrawer = asyncio.ensure_future(self.redraw_forever())
+        try:
+            await super().run()
+        finally:
+            redrawer.cancel()
+            # the last messages
+            self.redraw()
 
     def start_hook(self):
         self.screen = curses.initscr()
@@ -42,6 +88,7 @@ class DisplayCurses(Display):
     # this is guaranteed to run once the event loop has returned
     # and all the messages have been displayed
     def epilogue(self):
+        self.redraw()
         prompt = "Press any key to exit"
         if self.goodbye_message:
             prompt = self.goodbye_message + " " + prompt
@@ -56,9 +103,8 @@ class DisplayCurses(Display):
     def dispatch_hook(self, message, timestamp, duration):
         timemsg = f"{timestamp} {duration}"
         text = self.message_to_text(message)
-        self.screen.addstr(1, 1, timemsg)
-        self.screen.addstr(1, self.offsetc+1, self.pad(text))
-        self.screen.refresh()
+        self.put('screen', 1, 1, timemsg)
+        self.put('screen', 1, self.offsetc+1, self.pad(text))
 
     def dispatch_ip_hook(self, _, node,            # pylint:disable=w0221,r0913
                          message, timestamp, duration):
@@ -66,26 +112,22 @@ class DisplayCurses(Display):
         text = self.message_to_text_ip(message, node, mention_node=False)
         text = str(text)
         line = (node.rank % self.usable_l) + 1
-        self.screen.addstr(line+self.offsetl, 1, timemsg)
-        self.subwin.addstr(line, 1, self.pad(text))
-        self.screen.refresh()
-        self.subwin.refresh()
+        self.put('screen', line+self.offsetl, 1, timemsg)
+        self.put('subwin', line, 1, self.pad(text))
 
     def dispatch_ip_percent_hook(self, _, node,    # pylint:disable=w0221,r0913
                                  message, timestamp, duration):
         # global area
         timemsg = f"{timestamp} {duration}"
         text = self.node_percent_bar(int((self.total_percent)/len(self.nodes)))
-        self.screen.addstr(2, 1, timemsg)
-        self.screen.addstr(2, self.offsetc+1, self.pad(text))
+        self.put('screen', 2, 1, timemsg)
+        self.put('screen', 2, self.offsetc+1, self.pad(text))
         # node area
         timemsg = f"{timestamp} {duration} {node.name}"
         barsize = self.node_percent_bar(node.percent)
         line = (node.rank % self.usable_l) + 1
-        self.screen.addstr(line+self.offsetl, 1, timemsg)
-        self.subwin.addstr(line, 1, barsize)
-        self.screen.refresh()
-        self.subwin.refresh()
+        self.put('screen', line+self.offsetl, 1, timemsg)
+        self.put('subwin', line, 1, barsize)
 
     def node_percent_bar(self, percent):
         # 2 is for the 2 borders left and right; 4 is the size for '|10%'
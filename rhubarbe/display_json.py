@@ -0,0 +1,78 @@
+"""
+display class for machine-readable output, like in
+rhubarbe load --json
+
+one JSON record per line, printed as soon as the event happens;
+records about a node have a 'node' key, all records have
+'event', 'time' (epoch) and 'elapsed' (since the display was created)
+"""
+
+import sys
+import json
+import time
+from contextlib import redirect_stdout
+
+from rhubarbe.display import Display
+
+# c0111 no docstrings yet
+# w0201 attributes defined outside of __init__
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111,w0201,r1705
+
+
+class DisplayJson(Display):
+
+    machine_readable = True
+
+    def __init__(self, nodes, message_bus):
+        super().__init__(nodes, message_bus)
+        # where the records go, even when stdout gets redirected
+        self.output = sys.stdout
+        self.created = time.time()
+
+    def stray_output(self):
+        # the rest - e.g. asynciojobs messages - goes to stderr
+        return redirect_stdout(sys.stderr)
+
+    def emit(self, record):
+        now = time.time()
+        record['time'] = round(now, 3)
+        record['elapsed'] = round(now - self.created, 3)
+        print(json.dumps(record, default=str), file=self.output, flush=True)
+
+    def emit_node(self, node_name, event, value, **extras):
+        self.emit(dict(node=node_name, event=event, value=value, **extras))
+
+    def epilogue(self):
+        if self.goodbye_message:
+            self.emit(dict(event='goodbye', value=self.goodbye_message))
+
+    def dispatch_hook(self, message, timestamp, duration):
+        if isinstance(message, dict) and 'selected_nodes' in message:
+            self.emit(dict(event='selected_nodes',
+                           value=list(message['selected_nodes'].node_names())))
+        elif isinstance(message, dict):
+            for key, value in message.items():
+                self.emit(dict(event=key, value=value))
+        else:
+            self.emit(dict(event='info', value=str(message)))
+
+    def dispatch_ip_hook(self, ipaddr, node,            # pylint: disable=w0613
+                         message, timestamp, duration):
+        for key, value in message.items():
+            if key != 'ip':
+                self.emit_node(node.name, key, value)
+
+    def dispatch_ip_percent_hook(self, ipaddr, node,    # pylint: disable=w0613
+                                 message, timestamp,    # pylint: disable=w0613
+                                 duration):             # pylint: disable=w0613
+        self.emit_node(node.name, 'percent', message['percent'])
+
+    def dispatch_ip_tick_hook(self, ipaddr, node,       # pylint: disable=w0613
+                              message, timestamp,       # pylint: disable=w0613
+                              duration):                # pylint: disable=w0613
+        # ticks carry no information except for the last one
+        if message['tick'] == 'END':
+            self.emit_node(node.name, 'tick', 'END')
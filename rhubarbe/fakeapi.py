@@ -0,0 +1,117 @@
+"""
+A local stand-in for the r2labapi service, for exercising
+the accounts manager without the real API
+
+it serves synthetic slices, keys and leases, and exposes the same
+(synchroneous) methods as R2labApiProxy; it is selected by using
+an url of the form
+
+    fake://<nb_slices>[?latency=<seconds>&keys=<keys_per_slice>]
+"""
+
+# c0111 no docstrings yet
+# pylint: disable=c0111
+
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+
+from .r2labapiproxy import epoch_to_iso
+
+
+class FakeR2labApi:                                     # pylint: disable=r0902
+    """
+    nb_slices slices named slice_0000, slice_0001, ...
+    each with keys_per_slice keys
+
+    latency is the time spent in each request, to mimick a remote server
+
+    there is one lease per hour on the current day, held in turn
+    by the first slices; so slice_0000 or so holds the current one
+    """
+
+    def __init__(self, nb_slices, keys_per_slice=2, latency=0.):
+        self.url = f"fake://{nb_slices}"
+        self.latency = latency
+        self.slicenames = [f"slice_{i:04d}" for i in range(nb_slices)]
+        self.keys = {
+            slicename: [f"ssh-ed25519 AAAA{slicename}{k:02d} {slicename}-{k}"
+                        for k in range(keys_per_slice)]
+            for slicename in self.slicenames}
+        day = int(time.time()) // 86400 * 86400
+        self.leases = [
+            {'id': hour,
+             'slice_name': self.slicenames[hour % nb_slices],
+             't_from': epoch_to_iso(day + hour * 3600),
+             't_until': epoch_to_iso(day + (hour + 1) * 3600)}
+            for hour in range(24)] if nb_slices else []
+        # stats
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+
+    def __repr__(self):
+        return f"<FakeR2labApi {self.url} latency={self.latency}s>"
+
+    @staticmethod
+    def from_url(url):
+        parsed = urlparse(url)
+        params = {key: values[-1]
+                  for key, values in parse_qs(parsed.query).items()}
+        return FakeR2labApi(int(parsed.netloc or 0),
+                            keys_per_slice=int(params.get('keys', 2)),
+                            latency=float(params.get('latency', 0.)))
+
+    def _request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _conditional(self, data, etag):
+        """
+        mimick an ETag-enabled GET
+        """
+        new_etag = '"' + hashlib.sha1(repr(data).encode()).hexdigest() + '"'
+        if etag == new_etag:
+            with self.lock:
+                self.not_modified += 1
+            return None, etag, None
+        return data, new_etag, None
+
+    # changing the data
+    def set_keys(self, slicename, keys):
+        self.keys[slicename] = list(keys)
+
+    # the R2labApiProxy interface
+    def get_slices(self):
+        self._request()
+        return [{'id': i, 'name': slicename}
+                for i, slicename in enumerate(self.slicenames)]
+
+    def get_slice_keys(self, slicename):
+        self._request()
+        return [{'id': k, 'key': key}
+                for k, key in enumerate(self.keys.get(slicename, []))]
+
+    def get_slice_keys_conditional(self, slicename,
+                                   etag=None, last_modified=None):
+        # pylint: disable=w0613
+        return self._conditional(self.get_slice_keys(slicename), etag)
+
+    def get_leases(self, **params):
+        # pylint: disable=w0613
+        self._request()
+        return list(self.leases)
+
+    def get_leases_conditional(self, etag=None, last_modified=None,
+                               **params):
+        # pylint: disable=w0613
+        return self._conditional(self.get_leases(), etag)
+
+    def get_current_leases(self):
+        self._request()
+        now = epoch_to_iso(time.time())
+        return [lease for lease in self.leases
+                if lease['t_from'] <= now <= lease['t_until']]
@@ -14,6 +14,7 @@ import re
 from rhubarbe.logger import logger
 from rhubarbe.telnet import TelnetProxy
 from rhubarbe.config import Config
+from rhubarbe.timing import Timings
 
 
 class FrisbeeParser:
@@ -110,7 +111,9 @@ class Frisbee(TelnetProxy):
         logger.info(f"on {self.control_ip} : running command {self.command}")
         await self.feedback('frisbee_status', "starting frisbee client")
 
-        retcod = await self.session([self.command])
+        with Timings().phase('frisbee', self.control_ip) as record:
+            retcod = await self.session([self.command])
+            record.ok = retcod
 
         logger.info(f"frisbee on {self.control_ip} returned {retcod}")
 
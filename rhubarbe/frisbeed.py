@@ -16,6 +16,7 @@ import asyncio
 
 from rhubarbe.logger import logger
 from rhubarbe.config import Config
+from rhubarbe.timing import Timings
 
 
 class Frisbeed:
@@ -63,40 +64,54 @@ class Frisbeed:
         # add configured extra options
         command_common += server_options.split()
 
-        nb_attempts = int(the_config.value('networking', 'pattern_size'))
-        pat_ip = the_config.value('networking', 'pattern_multicast')
-        pat_port = the_config.value('networking', 'pattern_port')
-        for i in range(1, nb_attempts+1):
-            pat = str(i)
-            multicast_group = pat_ip.replace('*', pat)
-            multicast_port = str(eval(                  # pylint: disable=w0123
-                pat_port.replace('*', pat)))
-            command = command_common + [
-                "-m", multicast_group, "-p", multicast_port,
-                ]
-            self.subprocess = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.STDOUT
-                )
-            await asyncio.sleep(1)
-            # after such a short time, frisbeed should not have returned yet
-            # if it has, we try our luck on another couple (ip, port)
-            command_line = " ".join(command)
-            if self.subprocess.returncode is None:
-                self.multicast_group = multicast_group
-                self.multicast_port = multicast_port
-                await self.feedback('info', f"started {self}")
-                return multicast_group, multicast_port
-            else:
-                logger.warning(f"failed to start frisbeed with `{command_line}`"
-                               f" -> {self.subprocess.returncode}")
-        logger.critical(f"could not start frisbee server !!! on {self.image}")
-        raise Exception(f"could not start frisbee server !!! on {self.image}")
+        with Timings().phase('frisbeed_start'):
+            nb_attempts = int(the_config.value('networking', 'pattern_size'))
+            pat_ip = the_config.value('networking', 'pattern_multicast')
+            pat_port = the_config.value('networking', 'pattern_port')
+            for i in range(1, nb_attempts+1):
+                pat = str(i)
+                multicast_group = pat_ip.replace('*', pat)
+                multicast_port = str(eval(      # pylint: disable=w0123
+                    pat_port.replace('*', pat)))
+                command = command_common + [
+                    "-m", multicast_group, "-p", multicast_port,
+                    ]
+                self.subprocess = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT
+                    )
+                await asyncio.sleep(1)
+                # after such a short time, frisbeed should not have
+                # returned yet; if it has, we try our luck on another
+                # couple (ip, port)
+                command_line = " ".join(command)
+                if self.subprocess.returncode is None:
+                    self.multicast_group = multicast_group
+                    self.multicast_port = multicast_port
+                    await self.feedback('info', f"started {self}")
+                    return multicast_group, multicast_port
+                else:
+                    logger.warning(
+                        f"failed to start frisbeed with `{command_line}`"
+                        f" -> {self.subprocess.returncode}")
+            logger.critical(
+                f"could not start frisbee server !!! on {self.image}")
+            raise Exception(
+                f"could not start frisbee server !!! on {self.image}")
+
+    def is_running(self):
+        return (self.subprocess is not None
+                and self.subprocess.returncode is None)
 
     def stop_nowait(self):
         # make it idempotent
         if self.subprocess:
-            self.subprocess.kill()
+            # killing a process that has exited raises ProcessLookupError
+            if self.subprocess.returncode is None:
+                try:
+                    self.subprocess.kill()
+                except ProcessLookupError:
+                    pass
             self.subprocess = None
             self.feedback_nowait('info', f"stopped {self}")
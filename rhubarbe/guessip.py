@@ -2,6 +2,13 @@
 
 """
 determine local IP address to use for frisbeed
+
+interfaces are enumerated with ioctls on a socket, which is much cheaper
+than running 'ip address show'; but the ioctls only return the primary
+address of each interface, so the latter remains as a fallback when
+none of these is on the right network, or when ioctls are not available
+
+the result can be persisted, see cached_local_ip_on_same_network_as()
 """
 
 # c0111 no docstrings yet
@@ -11,36 +18,105 @@ determine local IP address to use for frisbeed
 # r1705 else after return
 # pylint: disable=c0111
 
-import subprocess
+import os
 import re
+import json
+import socket
+import struct
+import tempfile
 import ipaddress
+import subprocess
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 MATCHER = re.compile(r"inet (?P<address>([0-9]+\.){3}[0-9]+)/(?P<mask>[0-9]+)")
 
-_LOCAL_INTERFACES = None
+# from linux/sockios.h
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+# complete -> list of interfaces
+_LOCAL_INTERFACES = {}
+
+
+def _ioctl_ipv4(sock, request, name):
+    # a struct ifreq: the interface name, then a struct sockaddr_in
+    ifreq = struct.pack('256s', name.encode()[:15])
+    result = fcntl.ioctl(sock.fileno(), request, ifreq)
+    return socket.inet_ntoa(result[20:24])
+
+
+def _socket_interfaces():
+    """
+    one (the primary) IPv4 address per interface
+    """
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            try:
+                address = _ioctl_ipv4(sock, SIOCGIFADDR, name)
+                netmask = _ioctl_ipv4(sock, SIOCGIFNETMASK, name)
+            except OSError:
+                # typically no IPv4 address on that one
+                continue
+            interfaces.append(ipaddress.ip_interface(f"{address}/{netmask}"))
+    return interfaces
 
 
-def local_interfaces():
-    global _LOCAL_INTERFACES                            # pylint: disable=w0603
-    if _LOCAL_INTERFACES is not None:
-        return _LOCAL_INTERFACES
+def _ip_address_interfaces():
     ip_links = subprocess.Popen(
         ['ip', 'address', 'show'],
         stdout=subprocess.PIPE,
         stderr=subprocess.DEVNULL,
         universal_newlines=True
     )
-    _LOCAL_INTERFACES = []
+    interfaces = []
     out, _ = ip_links.communicate()
     for line in out.split("\n"):
         line = line.strip()
         match = MATCHER.match(line)
         if match:
-            interface = ipaddress.ip_interface(
-                f"{match.group('address')}/{match.group('mask')}")
-            if not interface.is_loopback:
-                _LOCAL_INTERFACES.append(interface)
-    return _LOCAL_INTERFACES
+            interfaces.append(ipaddress.ip_interface(
+                f"{match.group('address')}/{match.group('mask')}"))
+    return interfaces
+
+
+def local_interfaces(complete=True):
+    """
+    the non-loopback IPv4 interfaces; if complete is false, this may
+    only contain the primary address of each interface
+    """
+    if complete in _LOCAL_INTERFACES:
+        return _LOCAL_INTERFACES[complete]
+    interfaces = []
+    if not complete and fcntl is not None:
+        try:
+            interfaces = _socket_interfaces()
+        except OSError:
+            interfaces = []
+    if not interfaces:
+        complete = True
+        interfaces = _ip_address_interfaces()
+    interfaces = [interface for interface in interfaces
+                  if not interface.is_loopback]
+    _LOCAL_INTERFACES[complete] = interfaces
+    return interfaces
+
+
+def is_local_address(address):
+    """
+    can we still bind that address, i.e. is it still configured here
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind((address, 0))
+        return True
+    except OSError:
+        return False
 
 
 def local_ip_on_same_network_as(peer):
@@ -48,14 +124,47 @@ def local_ip_on_same_network_as(peer):
     Typically if peer is 192.168.3.1 and we have an interface 192.168.3.200/24
     then this will return a tuple of strings 192.168.3.200, 24
     """
-    for interface in local_interfaces():
-        length = interface.network.prefixlen
-        peer_interface = ipaddress.ip_interface(f"{peer}/{length}")
-        if peer_interface.network == interface.network:
-            return str(interface.ip), str(length)
+    # try the primary addresses first, they are cheaper to get
+    for complete in (False, True):
+        for interface in local_interfaces(complete):
+            length = interface.network.prefixlen
+            peer_interface = ipaddress.ip_interface(f"{peer}/{length}")
+            if peer_interface.network == interface.network:
+                return str(interface.ip), str(length)
     return None
 
 
+def cached_local_ip_on_same_network_as(peer, cache=None):
+    """
+    same as local_ip_on_same_network_as, but the result gets stored
+    in the cache file if provided, and reused as long as the address
+    is still a local one
+    """
+    path = Path(cache).expanduser() if cache else None
+    if path is not None:
+        try:
+            with path.open(encoding='utf-8') as reader:
+                entry = json.load(reader)
+            if (entry['peer'] == peer
+                    and is_local_address(entry['address'])):
+                return entry['address'], entry['mask']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    result = local_ip_on_same_network_as(peer)
+    if path is not None and result is not None:
+        address, mask = result
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(
+                dir=path.parent, prefix=f".{path.name}.")
+            with os.fdopen(fd, 'w', encoding='utf-8') as writer:
+                json.dump(dict(peer=peer, address=address, mask=mask), writer)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+    return result
+
+
 if __name__ == '__main__':
     LOCAL_IP, MASK = local_ip_on_same_network_as("192.168.3.1")
     print(f"found {LOCAL_IP}/{MASK}")
@@ -16,6 +16,10 @@ from asynciojobs import Scheduler, Job
 from rhubarbe.frisbeed import Frisbeed
 from rhubarbe.leases import Leases
 from rhubarbe.config import Config
+from rhubarbe.pxeboot import PxeBootManager
+from rhubarbe.timing import Timings
+from rhubarbe.stats import StatsDatabase
+from rhubarbe.logger import logger
 
 
 class ImageLoader:
@@ -29,6 +33,12 @@ class ImageLoader:
         self.message_bus = message_bus
         #
         self.frisbeed = None
+        # serializes the restarts of frisbeed
+        self._frisbeed_lock = asyncio.Lock()
+        # per-node success map, hostname -> bool
+        self.results = {}
+        # set at the end of main()
+        self.success = None
 
 
     async def feedback(self, field, msg):
@@ -38,8 +48,12 @@ class ImageLoader:
     async def stage1(self):
         the_config = Config()
         idle = int(the_config.value('nodes', 'idle_after_reset'))
-        await asyncio.gather(*[node.reboot_on_frisbee(idle)
-                               for node in self.nodes])
+        with Timings().phase('stage1'):
+            # set all the symlinks in one pass
+            PxeBootManager().set_frisbee(self.nodes)
+            await asyncio.gather(*[node.reboot_on_frisbee(idle,
+                                                          set_nextboot=False)
+                                   for node in self.nodes])
 
 
     async def start_frisbeed(self):
@@ -48,23 +62,81 @@ class ImageLoader:
         return ip_port
 
 
+    async def frisbeed_address(self):
+        """
+        the ip+port of a running frisbeed; restart it if it has died
+        """
+        async with self._frisbeed_lock:
+            if not self.frisbeed.is_running():
+                await self.feedback('info', f"restarting {self.frisbeed}")
+                self.frisbeed.stop_nowait()
+                return await self.start_frisbeed()
+            return (self.frisbeed.multicast_group,
+                    self.frisbeed.multicast_port)
+
+
+    async def load_node(self, node, reset, retries):
+        """
+        write the image on one node, with up to <retries> extra attempts,
+        each one starting with a fresh stage1 (when reset is set)
+        then reset the node unless told otherwise
+
+        failures are confined to that node; returns a bool
+        """
+        the_config = Config()
+        idle = int(the_config.value('nodes', 'idle_after_reset'))
+        # only bound the wait for telnet if we can do something about it
+        telnet_timeout = (float(the_config.value('nodes',
+                                                 'timeout_before_telnet'))
+                          if retries else None)
+        attempt = 0
+        while True:
+            try:
+                ipaddr, port = await self.frisbeed_address()
+                result = await node.write_image(ipaddr, port, telnet_timeout)
+            except Exception as exc:                    # pylint: disable=w0703
+                logger.exception(f"{node} could not write image: {exc}")
+                result = False
+            if result or attempt >= retries:
+                break
+            attempt += 1
+            await node.feedback(
+                'frisbee_status',
+                f"failed to write image - retrying ({attempt}/{retries})")
+            if reset:
+                await node.reboot_on_frisbee(idle)
+        self.results[node.control_hostname()] = bool(result)
+        await node.final_reset(reset)
+        return bool(result)
+
+
     async def stage2(self, reset):
         """
         wait for all nodes to be telnet-friendly
         then run frisbee in all of them
         and reset the nodes afterwards, unless told otherwise
+
+        a node that fails is retried on its own, while the other nodes
+        proceed; the outcome for each node ends up in self.results
         """
+        retries = int(Config().value('nodes', 'load_retries'))
         # start_frisbeed will return the ip+port to use
-        ipaddr, port = await self.start_frisbeed()
-        results = await asyncio.gather(*[node.run_frisbee(ipaddr, port, reset)
-                                         for node in self.nodes])
+        await self.start_frisbeed()
+        with Timings().phase('stage2') as record:
+            results = await asyncio.gather(
+                *[self.load_node(node, reset, retries)
+                  for node in self.nodes])
+            record.ok = all(results)
         # we can now kill the server
         self.frisbeed.stop_nowait()
         result = all(results)
         if not result:
+            failed = [hostname for hostname, success in self.results.items()
+                      if not success]
             await self.feedback(
                 'info',
-                "at least one node failed to write that image on disk")
+                f"{len(failed)}/{len(self.nodes)} node(s) failed to write"
+                f" that image on disk: {' '.join(failed)}")
         return result
 
 
@@ -74,14 +146,16 @@ class ImageLoader:
         Remove nextboot symlinks for all nodes in this selection
         so next boot will be off the harddrive
         """
-        for node in self.nodes:
-            node.manage_nextboot_symlink('harddrive')
+        PxeBootManager().clear(self.nodes)
 
 
     async def run(self, reset):
         leases = Leases(self.message_bus)
         await self.feedback('authorization', 'checking for a valid lease')
-        valid = await leases.booked_now_by_me()
+        try:
+            valid = await leases.booked_now_by_me()
+        finally:
+            await leases.close()
         if not valid:
             await self.feedback('authorization',
                                 "Access refused : you have no lease "
@@ -94,11 +168,33 @@ class ImageLoader:
         return await self.stage2(reset)
 
 
+    def report(self):
+        """
+        write the run report and print the per-phase summary
+        """
+        timings = Timings()
+        timings.write_report(
+            'load', image=str(self.image), bandwidth=self.bandwidth,
+            nodes=[node.control_hostname() for node in self.nodes],
+            results=self.results, success=self.success)
+        try:
+            StatsDatabase().record_run(
+                'load', image=self.image,
+                image_size=getattr(self.image, 'size', None),
+                nb_nodes=len(self.nodes), bandwidth=self.bandwidth,
+                success=self.success, timings=timings)
+        except Exception as exc:                        # pylint: disable=w0703
+            logger.error(f"could not record load in stats database: {exc}")
+        if not self.display.machine_readable:
+            timings.print_summary()
+
+
     def cleanup(self):
         if self.frisbeed:
             self.frisbeed.stop_nowait()
         self.nextboot_cleanup()
         self.display.epilogue()
+        self.report()
 
 
     def main(self, reset, timeout):
@@ -110,16 +206,21 @@ class ImageLoader:
                               critical=False)
 
         try:
-            is_ok = scheduler.run()
+            with self.display.stray_output():
+                is_ok = scheduler.run()
             if not is_ok:
-                scheduler.debrief(silence_done_jobs=True)
+                if not self.display.machine_readable:
+                    scheduler.debrief(silence_done_jobs=True)
                 self.display.set_goodbye(
                     f"rhubarbe-load failed: {scheduler.why()}")
+                self.success = False
                 return 1
-            return 0 if mainjob.result() else 1
+            self.success = bool(mainjob.result())
+            return 0 if self.success else 1
         except KeyboardInterrupt:
             self.display.set_goodbye(
                 "rhubarbe-load : keyboard interrupt - exiting")
+            self.success = False
             return 1
         finally:
             self.cleanup()
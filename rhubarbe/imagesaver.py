@@ -16,6 +16,9 @@ from asynciojobs import Scheduler, Job
 from rhubarbe.collector import Collector
 from rhubarbe.leases import Leases
 from rhubarbe.config import Config
+from rhubarbe.timing import Timings
+from rhubarbe.stats import StatsDatabase
+from rhubarbe.logger import logger
 
 
 class ImageSaver:
@@ -30,6 +33,8 @@ class ImageSaver:
         self.comment = comment
         #
         self.collector = None
+        # set at the end of main()
+        self.success = None
 
 
     async def feedback(self, field, msg):
@@ -80,7 +85,10 @@ class ImageSaver:
     async def run(self, reset):
         leases = Leases(self.message_bus)
         await self.feedback('authorization', 'checking for a valid lease')
-        valid = await leases.booked_now_by_me()
+        try:
+            valid = await leases.booked_now_by_me()
+        finally:
+            await leases.close()
         if not valid:
             await self.feedback('authorization',
                                 "Access refused : you have no lease"
@@ -101,11 +109,35 @@ class ImageSaver:
             pass
 
 
+    def report(self):
+        """
+        write the run report and print the per-phase summary
+        """
+        timings = Timings()
+        timings.write_report(
+            'save', image=str(self.image), radical=self.radical,
+            nodes=[self.node.control_hostname()],
+            success=self.success)
+        try:
+            image_size = os.path.getsize(self.image)
+        except OSError:
+            image_size = None
+        try:
+            StatsDatabase().record_run(
+                'save', image=self.image, image_size=image_size,
+                nb_nodes=1, success=self.success, timings=timings)
+        except Exception as exc:                        # pylint: disable=w0703
+            logger.error(f"could not record save in stats database: {exc}")
+        if not self.display.machine_readable:
+            timings.print_summary()
+
+
     def cleanup(self):
         if self.collector:
             self.collector.stop_nowait()
         self.nextboot_cleanup()
         self.display.epilogue()
+        self.report()
 
 
     def main(self, reset, timeout):
@@ -117,15 +149,20 @@ class ImageSaver:
                               critical=False)
 
         try:
-            is_ok = scheduler.run()
+            with self.display.stray_output():
+                is_ok = scheduler.run()
             if not is_ok:
-                scheduler.debrief(silence_done_jobs=True)
+                if not self.display.machine_readable:
+                    scheduler.debrief(silence_done_jobs=True)
                 self.display.set_goodbye(
                     f"rhubarbe-save failed: {scheduler.why()}")
+                self.success = False
                 return 1
-            return 0 if mainjob.result() else 1
+            self.success = bool(mainjob.result())
+            return 0 if self.success else 1
         except KeyboardInterrupt:
             self.display.set_goodbye("rhubarbe-save : keyboard interrupt, bye")
+            self.success = False
             return 1
         finally:
             self.cleanup()
@@ -17,6 +17,7 @@ import asyncio
 from rhubarbe.logger import logger
 from rhubarbe.config import Config
 from rhubarbe.telnet import TelnetProxy
+from rhubarbe.timing import Timings
 
 
 class ImageZip(TelnetProxy):
@@ -81,10 +82,12 @@ class ImageZip(TelnetProxy):
                             f"starting imagezip on {self.control_ip}")
 
         # print out exit status so the parser can catch it and expose it
-        retcod, _ = await asyncio.gather(
-            self.session(commands),
-            self.ticker(),
-        )
+        with Timings().phase('imagezip', self.control_ip) as record:
+            retcod, _ = await asyncio.gather(
+                self.session(commands),
+                self.ticker(),
+            )
+            record.ok = retcod
         logger.info(f"imagezip on {self.control_ip} returned {retcod}")
 
         return retcod
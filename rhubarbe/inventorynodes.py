@@ -1,5 +1,10 @@
 """
 Parse inventory json about nodes
+
+nodes can also be looked up by attribute, see where(); attributes
+are the inventory fields, flattened like in control.mac, plus
+the last known state as written by monitornodes, like
+os_release, usrp_on_off or image_radical
 """
 
 # c0111 no docstrings yet
@@ -9,18 +14,70 @@ Parse inventory json about nodes
 # r1705 else after return
 # pylint: disable=c0111, r1705
 
+import os
+import re
+import sys
 import json
+from pathlib import Path
 
 from rhubarbe.singleton import Singleton
 from rhubarbe.config import Config
 
 
+# key=value, key!=value, key~regexp, key!~regexp
+QUERY_PATTERN = re.compile(
+    r"\A(?P<key>[\w.-]+)(?P<op>!=|=|!~|~)(?P<value>.*)\Z")
+# a comma only separates clauses if followed by a key and an operator,
+# so that regexps like a{1,3} remain in one piece
+CLAUSE_SEPARATOR = re.compile(r",(?=\s*[\w.-]+(?:!=|=|!~|~))")
+
+# the attributes that come from the monitor state,
+# see rhubarbe/monitor/nodes.py
+STATE_ATTRIBUTES = {
+    'id', 'cmc_on_off', 'control_ping', 'control_ssh', 'usrp_on_off',
+    'os_release', 'gnuradio_release', 'uname', 'image_radical',
+    'docker_version', 'container_running', 'container_image',
+}
+
+
+class MisformedQuery(Exception):
+
+    def __init__(self, query, reason=None):
+        self.query = query
+        self.reason = reason
+        super().__init__(self)
+
+    def __str__(self):
+        reason = (self.reason or "expecting key=value, key!=value,"
+                  " key~regexp or key!~regexp")
+        return f"Misformed query '{self.query}' - {reason}"
+
+
+def flatten(entry, prefix=""):
+    """
+    {'control': {'ip': ...}} -> {'control.ip': ...}
+    """
+    result = {}
+    for key, value in entry.items():
+        if isinstance(value, dict):
+            result.update(flatten(value, f"{prefix}{key}."))
+        else:
+            result[f"{prefix}{key}"] = value
+    return result
+
+
 class InventoryNodes(metaclass=Singleton):
 
     def __init__(self):
         the_config = Config()
         with open(the_config.value('testbed', 'inventory_nodes_path')) as feed:
             self._nodes = json.load(feed)
+        state_path = the_config.value('monitor', 'state_path')
+        self._state_path = Path(state_path).expanduser() if state_path else None
+        # attribute -> value (as a str) -> bits, built on first query
+        self._index = None
+        self._state_mtime = None
+        self._has_state = False
 
     def _locate_entry_from_key(self, key, value):
         """
@@ -55,6 +112,12 @@ class InventoryNodes(metaclass=Singleton):
             return host['control']['ip']
         return None
 
+    def control_hostname_from_any_ip(self, ipaddr):
+        host, _ = self._locate_entry_from_key('ip', ipaddr)
+        if host:
+            return host['control']['hostname']
+        return None
+
     def display(self, verbose=False):
         def cell_repr(key, value, verbose):
             if not verbose:
@@ -72,3 +135,105 @@ class InventoryNodes(metaclass=Singleton):
 
     def all_control_hostnames(self):
         return (node['control']['hostname'] for node in self._nodes)
+
+    # attribute queries
+    @staticmethod
+    def node_index(node):
+        # same as rhubarbe.node.Node.id
+        return int("".join(x for x in node['cmc']['hostname']
+                           if x in "0123456789"))
+
+    def load_state(self):
+        """
+        the last known state of each node, as written by monitornodes
+        returns a dict node index -> info, or None if not available
+        """
+        if self._state_path is None:
+            return None
+        try:
+            with self._state_path.open(encoding='utf-8') as reader:
+                return {int(index): info
+                        for index, info in json.load(reader).items()}
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def state_mtime(self):
+        try:
+            return os.stat(self._state_path).st_mtime
+        except (OSError, TypeError):
+            return None
+
+    def index(self):
+        """
+        the attributes index, i.e. attribute -> value -> bits
+        where bit i stands for node i, like in Selector
+        rebuilt when the monitor state has changed
+        """
+        mtime = self.state_mtime()
+        if self._index is None or mtime != self._state_mtime:
+            state = self.load_state()
+            self._has_state = state is not None
+            state = state or {}
+            index = {}
+            for node in self._nodes:
+                node_index = self.node_index(node)
+                attributes = flatten(node)
+                attributes.update(state.get(node_index, {}))
+                for key, value in attributes.items():
+                    values = index.setdefault(key, {})
+                    value = str(value)
+                    values[value] = values.get(value, 0) | (1 << node_index)
+            self._index = index
+            self._state_mtime = mtime
+        return self._index
+
+    def all_bits(self):
+        bits = 0
+        for node in self._nodes:
+            bits |= 1 << self.node_index(node)
+        return bits
+
+    def where(self, *queries):
+        """
+        the bits for the nodes that match all queries; each query
+        can itself be a comma-separated list of
+        key=value, key!=value, key~regexp or key!~regexp
+        where key is an attribute in the index, e.g.
+        where('usrp_on_off=on', 'os_release~ubuntu-2[24]')
+        nodes that do not have the attribute match != and !~
+        a regexp cannot contain a comma followed by something
+        like key= or key~, as that would start a new clause
+        """
+        index = self.index()
+        bits = self.all_bits()
+        for query in queries:
+            for clause in CLAUSE_SEPARATOR.split(query):
+                match = QUERY_PATTERN.match(clause.strip())
+                if not match:
+                    raise MisformedQuery(clause)
+                key, operator, value = match.group('key', 'op', 'value')
+                if key in STATE_ATTRIBUTES and not self._has_state:
+                    print(f"WARNING: no monitor state found in"
+                          f" {self._state_path} - is monitornodes running ?"
+                          f" '{clause}' evaluated with no state",
+                          file=sys.stderr)
+                elif key not in index and key not in STATE_ATTRIBUTES:
+                    raise MisformedQuery(clause,
+                                         f"unknown attribute '{key}'")
+                values = index.get(key, {})
+                if operator.endswith('='):
+                    found = values.get(value, 0)
+                else:
+                    try:
+                        regexp = re.compile(value)
+                    except re.error:
+                        raise MisformedQuery(clause) from None
+                    found = 0
+                    for candidate, candidate_bits in values.items():
+                        if regexp.search(candidate):
+                            found |= candidate_bits
+                if operator.startswith('!'):
+                    bits &= ~found
+                else:
+                    bits &= found
+        return bits
@@ -7,7 +7,9 @@ the entry point for acquiring temperatures
 
 from math import nan
 from dataclasses import dataclass
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import time
+import signal
 import asyncio
 
 import pandas as pd
@@ -18,10 +20,13 @@ import asyncssh
 
 from .config import Config
 from .logger import logger
+from .relaysdb import RelaysDatabase
 
 VERBOSE = False
 # VERBOSE = True
 
+TEMPERATURE_COMMAND = '/usr/bin/vcgencmd measure_temp'
+
 # pylint: disable=missing-function-docstring, missing-class-docstring
 def verbose(*args, **kwds):
     if not VERBOSE:
@@ -36,29 +41,29 @@ class Relay:
     host: str
     # IP: str                                     # pylint: disable=invalid-name
 
-    async def get_temperature(self):
-        async with asyncssh.connect(self.host) as conn:
-            result = await conn.run('/usr/bin/vcgencmd measure_temp', check=True)
-        raw1 = result.stdout
-        raw2 = raw1.split('=')[1]
+    async def get_temperature(self, connection=None):
+        """
+        uses the provided ssh connection if any,
+        otherwise opens a fresh one for that single reading
+        """
+        if connection is not None:
+            result = await connection.run(TEMPERATURE_COMMAND, check=True)
+        else:
+            async with asyncssh.connect(self.host) as conn:
+                result = await conn.run(TEMPERATURE_COMMAND, check=True)
+        return self.parse_temperature(result.stdout)
+
+    @staticmethod
+    def parse_temperature(stdout):
+        # e.g. temp=48.3'C
+        raw2 = stdout.split('=')[1]
         raw3 = raw2.split("'")[0]
         return float(raw3)
 
 
-    def store_current_temperature(self, temperature):
-        now = (
-            pd.Timestamp.utcnow()
-            .replace(microsecond=0)
-            .isoformat()
-            .replace("+00:00","Z")
-        )
-        # temperature = asyncio.run(self.get_temperature())
-        folder = Path(Config().value('testbed', 'relays_database_folder'))
-        if not folder.is_dir():
-            print(f"Creating folder {folder}")
-            folder.mkdir(parents=True, exist_ok=True)
-        with (folder / "temperatures.csv").open('a') as writer:
-            print(f"{now},{self.host},{temperature}", file=writer)
+    def store_current_temperature(self, temperature, database=None):
+        database = database or RelaysDatabase()
+        database.insert([(time.time(), self.host, temperature)])
 
 
 @dataclass
@@ -97,26 +102,169 @@ class InventoryRelays(YAMLWizard):
                 for relay, temperature in zip(self.relays, temperatures):
                     print(f"{relay} has temperature {temperature:.2f}C")
             case 'store':
-                for relay, temperature in zip(self.relays, temperatures):
-                    relay.store_current_temperature(temperature)
+                # one transaction for all relays
+                now = time.time()
+                database = RelaysDatabase()
+                database.insert(
+                    (now, relay.host, temperature)
+                    for relay, temperature in zip(self.relays, temperatures))
+                database.prune(now)
 
     def __iter__(self):
         return iter(self.relays)
     def __len__(self):
         return len(self.relays)
 
-    def load_past_data(self, *, duration=None, resample_period=None):
-        folder = Path(Config().value('testbed', 'relays_database_folder'))
-        df = pd.read_csv(
-            folder / "temperatures.csv",
-            names=["timestamp", "relay", "temperature"])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], format="ISO8601")
+    @staticmethod
+    def frame(rows):
+        """
+        a dataframe indexed on timestamp, from (epoch, relay, temperature)
+        """
+        df = pd.DataFrame(rows, columns=["timestamp", "relay", "temperature"])
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True)
         df.set_index('timestamp', inplace=True)
+        return df
+
+    def load_past_data(self, *, duration=None, resample_period=None,
+                       database=None):
+        """
+        only the requested window is read from the database
+        periods that are a fixed number of seconds are computed
+        by the database, others (like '1M') are left to pandas
+        """
+        database = database or RelaysDatabase()
+        since = None
         if duration is not None:
-            duration = pd.Timedelta(duration)
-            time_threshold = pd.to_datetime(pd.Timestamp.utcnow()) - duration
-            df = df[df.index >= time_threshold]
+            since = time.time() - pd.Timedelta(duration).total_seconds()
+        period = None
+        if resample_period is not None:
+            try:
+                period = pd.Timedelta(resample_period).total_seconds()
+            except ValueError:
+                period = None
+        if resample_period is not None and period:
+            df = self.frame(database.query(since=since, period=period))
+            return df.reset_index().set_index(['relay', 'timestamp'])
+        df = self.frame(database.query(since=since))
         if resample_period is not None:
             # resample already has string builtin conversion
             df = df.groupby('relay').resample(resample_period).mean()
         return df
+
+
+class RelaysCollector:
+    """
+    a long-running loop that samples all relays every <period> seconds
+
+    * one ssh connection is kept open to each relay, and re-opened
+      only after a failure
+    * all relays are sampled concurrently, on a fixed schedule
+      (a late tick does not shift the next ones)
+    * readings are written in batches, every <flush_period> seconds,
+      in a separate thread so that sampling is never held up
+    * if the database cannot be written, readings are kept for the next
+      flush, but only the most recent <pending_window> seconds worth
+    * pending readings are flushed on exit, including on SIGTERM
+    """
+
+    def __init__(self, relays, period,                  # pylint: disable=r0913
+                 flush_period, database=None, pending_window=86400):
+        self.relays = list(relays)
+        self.period = period
+        self.flush_period = flush_period
+        self.database = database or RelaysDatabase()
+        # host -> asyncssh connection
+        self.connections = {}
+        self.pending = []
+        self.max_pending = (len(self.relays)
+                            * max(1, int(pending_window // period)))
+        # sqlite objects are bound to the thread that creates them
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
+    def __repr__(self):
+        return (f"<RelaysCollector {len(self.relays)} relays"
+                f" every {self.period}s>")
+
+    async def connection(self, relay):
+        if relay.host not in self.connections:
+            self.connections[relay.host] = await asyncio.wait_for(
+                asyncssh.connect(relay.host), timeout=self.period)
+        return self.connections[relay.host]
+
+    def drop_connection(self, relay):
+        connection = self.connections.pop(relay.host, None)
+        if connection is not None:
+            connection.close()
+
+    async def sample(self, relay):
+        try:
+            connection = await self.connection(relay)
+            return await asyncio.wait_for(
+                relay.get_temperature(connection), timeout=self.period)
+        except (OSError, asyncssh.Error, asyncio.TimeoutError,
+                IndexError, ValueError) as exc:
+            logger.warning(f"could not sample relay {relay.host}: {exc!r}")
+            self.drop_connection(relay)
+            return None
+
+    async def flush(self):
+        if not self.pending:
+            return
+        readings, self.pending = self.pending, []
+        def write():
+            self.database.insert(readings)
+            self.database.prune()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.writer, write)
+            verbose(f"flushed {len(readings)} readings")
+        except Exception as exc:                        # pylint: disable=w0718
+            logger.error(f"could not store {len(readings)} readings: {exc}")
+            # keep them for next time
+            self.pending = readings + self.pending
+
+    def trim_pending(self):
+        excess = len(self.pending) - self.max_pending
+        if excess > 0:
+            logger.warning(f"dropping {excess} unstored readings")
+            del self.pending[:excess]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # systemctl stop sends SIGTERM; cancelling gets the finally
+        # clause to run, so pending readings do not get lost
+        loop.add_signal_handler(signal.SIGTERM,
+                                asyncio.current_task().cancel)
+        start = loop.time()
+        last_flush = start
+        tick = 0
+        try:
+            while True:
+                now = time.time()
+                temperatures = await asyncio.gather(
+                    *(self.sample(relay) for relay in self.relays))
+                self.pending.extend(
+                    (now, relay.host, temperature)
+                    for relay, temperature in zip(self.relays, temperatures)
+                    if temperature is not None)
+                self.trim_pending()
+                if loop.time() - last_flush >= self.flush_period:
+                    await self.flush()
+                    last_flush = loop.time()
+                # next tick on the schedule, skipping the ones we missed
+                tick = max(tick + 1,
+                           int((loop.time() - start) // self.period) + 1)
+                await asyncio.sleep(max(0, start + tick * self.period
+                                        - loop.time()))
+        finally:
+            await self.flush()
+            for relay in self.relays:
+                self.drop_connection(relay)
+            self.writer.shutdown(wait=True)
+
+    def main(self):
+        try:
+            asyncio.run(self.run())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        return 0
@@ -12,19 +12,24 @@ and minimal verifications
 # pylint: disable=c0111, w1202, r1705, w0703
 
 import os
+import sys
 import pwd
 import time
 import traceback
 from datetime import datetime, timezone
 
-import requests
+import asyncio
+
+import aiohttp
 
 from .logger import logger
 from .config import Config
-from .r2labapiproxy import R2labApiProxy, iso_to_epoch, epoch_to_iso
+from .r2labapiproxy import AsyncR2labApiProxy, iso_to_epoch, epoch_to_iso
+from .leasescache import LeasesCache
+from .leasesindex import LeasesIndex
 
 DEBUG = False
-DEBUG = True
+# DEBUG = True
 
 
 class Lease:
@@ -138,12 +143,17 @@ class Leases:                                           # pylint: disable=r0902
         api_url = the_config.value('r2labapi', 'url')
         self.resource_name = the_config.value('r2labapi', 'resource_name')
         # no token: reads are public, writes will prompt for credentials
-        self.proxy = R2labApiProxy(api_url)
+        # the http session is created lazily, call close() when done
+        self.proxy = AsyncR2labApiProxy(api_url)
+        # shared across invocations
+        self.cache = LeasesCache()
         # computed later
         # a list of Lease objects
         self.leases = None
         # the raw API response
         self.api_leases = None
+        # a LeasesIndex, built lazily from self.leases
+        self._index = None
         # xxx this is still used by monitornodes
         # should be cleaned up
         self.resources = None
@@ -155,6 +165,13 @@ class Leases:                                           # pylint: disable=r0902
             return (f"<Leases from {self.proxy}"
                     f" - {len(self.leases)} lease(s)>")
 
+    async def close(self):
+        """
+        release the http session; the object remains usable,
+        a new session gets created if needed
+        """
+        await self.proxy.close()
+
     async def feedback(self, field, msg):
         """
         send feedback, for displaying or monitoring
@@ -202,16 +219,22 @@ class Leases:                                           # pylint: disable=r0902
             await self.feedback('info', f"Could not fetch leases : {exc}")
             return False
 
-    # the following 2 methods assume the leases have been fetched
+    # the following methods assume the leases have been fetched
+    @property
+    def index(self):
+        # rebuild whenever self.leases gets replaced
+        if self._index is None or self._index[0] is not self.leases:
+            self._index = (self.leases, LeasesIndex(self.leases))
+        return self._index[1]
+
     def _booked_now_by_login(self, login):
         # must have run fetch_all() before calling this
-        return any([lease.booked_now_by(login)
-                    for lease in self.leases])
+        return any(lease.owner == login
+                   for lease in self.index.at(time.time()))
 
     def _booked_now_by_anyone(self):
         # must have run fetch_all() before calling this
-        return any([lease.booked_now_by(login=None)
-                    for lease in self.leases])
+        return bool(self.index.at(time.time()))
 
     async def fetch_all(self):
         """
@@ -222,6 +245,7 @@ class Leases:                                           # pylint: disable=r0902
 
     async def refresh(self):
         self.leases = None
+        self.cache.invalidate()
         await self.fetch_all()
 
     def sort_leases(self):
@@ -255,8 +279,8 @@ class Leases:                                           # pylint: disable=r0902
             # fetch leases from today onwards
             today = datetime.now(tz=timezone.utc).replace(
                 hour=0, minute=0, second=0, microsecond=0)
-            self.api_leases = self.proxy.get_leases(
-                after=today.isoformat())
+            self.api_leases = await self.cache.get_leases_async(
+                self.proxy, after=today.isoformat())
             logger.info(f"{len(self.api_leases)} leases received")
             # decoded as a list of Lease objects
             self.leases = [Lease(entry) for entry in self.api_leases]
@@ -266,14 +290,15 @@ class Leases:                                           # pylint: disable=r0902
                 for api_lease in self.api_leases
             ]
 
-        except requests.exceptions.RequestException as exc:
-            if hasattr(exc, 'response') and exc.response is not None:
-                message = (f"HTTP error ({exc.response.status_code})"
-                           f" from {self.proxy}")
-            else:
-                message = f"cannot reach r2lab API at {self.proxy}: {exc}"
+        except aiohttp.ClientResponseError as exc:
+            message = f"HTTP error ({exc.status}) from {self.proxy}"
+            logger.error(message)
+            print(message, file=sys.stderr)
+            await self.feedback('leases_error', message)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            message = f"cannot reach r2lab API at {self.proxy}: {exc!r}"
             logger.error(message)
-            print(message)
+            print(message, file=sys.stderr)
             await self.feedback('leases_error', message)
         except Exception as exc:
             if DEBUG:
@@ -346,7 +371,7 @@ class Leases:                                           # pylint: disable=r0902
             print(f"invalid time until: {input_until}")
             return
         try:
-            self.proxy.create_lease({
+            await self.proxy.create_lease({
                 'resource_name': self.resource_name,
                 'slice_name': owner,
                 't_from': epoch_to_iso(t_from),
@@ -355,6 +380,7 @@ class Leases:                                           # pylint: disable=r0902
             print("OK")
             # force next reload
             self.leases = None
+            self.cache.invalidate()
         except Exception as exc:
             print('Error', f"Cannot add lease {type(exc)}: {exc}")
             traceback.print_exc()
@@ -389,10 +415,11 @@ class Leases:                                           # pylint: disable=r0902
             print(f"Cannot find lease with rank {lease_rank}")
             return
         try:
-            self.proxy.update_lease(the_lease.lease_id, update_fields)
+            await self.proxy.update_lease(the_lease.lease_id, update_fields)
             print("OK")
             # force next reload
             self.leases = None
+            self.cache.invalidate()
         except Exception as exc:
             print(f"error: {exc}")
 
@@ -403,24 +430,27 @@ class Leases:                                           # pylint: disable=r0902
             print(f"Cannot find lease with rank {lease_rank}")
             return
         try:
-            self.proxy.delete_lease(the_lease.lease_id)
+            await self.proxy.delete_lease(the_lease.lease_id)
             print("OK")
             # force next reload
             self.leases = None
+            self.cache.invalidate()
         except Exception as exc:
             print(f"not deleted: {exc}")
 
     async def main(self, interactive):
-        await self.fetch_all()
-        self.print()
-        if not interactive:
-            return 0
         try:
+            await self.fetch_all()
+            self.print()
+            if not interactive:
+                return 0
             result = await self.interactive()
             return result
         except (KeyboardInterrupt, EOFError):
             print("Bye")
             return 1
+        finally:
+            await self.close()
 
     async def interactive(self):
         help_message = """
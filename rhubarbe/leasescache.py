@@ -0,0 +1,141 @@
+"""
+An on-disk cache of the leases, shared across rhubarbe invocations
+
+Scripts that chain many rhubarbe commands would otherwise pay one
+API round-trip per command just to check for a lease; instead
+
+* a fresh cache entry (younger than the TTL) is used as is
+* a stale entry is revalidated with ETag / If-Modified-Since
+* the entry is invalidated explicitly after a lease gets
+  created, updated or deleted
+
+The cache file is updated atomically, so concurrent invocations
+never read a partial file
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import json
+import time
+import tempfile
+from pathlib import Path
+
+from rhubarbe.logger import logger
+from rhubarbe.config import Config
+
+
+class LeasesCache:
+
+    def __init__(self, path=None, ttl=None):
+        the_config = Config()
+        if path is None:
+            path = the_config.value('r2labapi', 'leases_cache')
+        if ttl is None:
+            ttl = the_config.value('r2labapi', 'leases_cache_ttl')
+        self.path = Path(path).expanduser()
+        self.ttl = float(ttl)
+
+    def __repr__(self):
+        return f"<LeasesCache {self.path} ttl={self.ttl}s>"
+
+    def load(self):
+        """
+        the cache entry as a dict, or None
+        """
+        try:
+            with self.path.open(encoding='utf-8') as reader:
+                return json.load(reader)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, entry):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # write a temporary file in the same directory and rename it
+            fd, temporary = tempfile.mkstemp(
+                dir=self.path.parent, prefix=f".{self.path.name}.")
+            with os.fdopen(fd, 'w', encoding='utf-8') as writer:
+                json.dump(entry, writer)
+            os.replace(temporary, self.path)
+        except OSError as exc:
+            logger.warning(f"could not store leases cache {self.path}: {exc}")
+
+    def invalidate(self):
+        try:
+            self.path.unlink()
+            logger.info(f"leases cache {self.path} invalidated")
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning(f"could not invalidate {self.path}: {exc}")
+
+    def _lookup(self, proxy, after):
+        """
+        returns a tuple (leases, entry)
+        leases is not None only if the cache is fresh
+        """
+        entry = self.load()
+        # the cache is only valid for the same query
+        if (entry is None
+                or entry.get('url') != proxy.url
+                or entry.get('after') != after):
+            return None, None
+        if self.ttl > 0 and time.time() - entry['fetched'] < self.ttl:
+            logger.info("Leases served from cache")
+            return entry['leases'], entry
+        return None, entry
+
+    @staticmethod
+    def _validators(entry):
+        if entry is None:
+            return {}
+        return dict(etag=entry.get('etag'),
+                    last_modified=entry.get('last_modified'))
+
+    def _update(self, proxy, after, entry,              # pylint: disable=r0913
+                fetched, answer):
+        leases, etag, last_modified = answer
+        if leases is None:
+            logger.info("Leases revalidated - not modified")
+            leases = entry['leases']
+        if self.ttl > 0:
+            self.store({
+                'url': proxy.url,
+                'after': after,
+                'fetched': fetched,
+                'etag': etag,
+                'last_modified': last_modified,
+                'leases': leases,
+            })
+        return leases
+
+    def get_leases(self, proxy, after):
+        """
+        the list of leases from <after> onwards, as returned by the API
+        served from the cache whenever possible
+        """
+        leases, entry = self._lookup(proxy, after)
+        if leases is not None:
+            return leases
+        fetched = time.time()
+        answer = proxy.get_leases_conditional(
+            after=after, **self._validators(entry))
+        return self._update(proxy, after, entry, fetched, answer)
+
+    async def get_leases_async(self, proxy, after):
+        """
+        same as get_leases, for use with an AsyncR2labApiProxy
+        """
+        leases, entry = self._lookup(proxy, after)
+        if leases is not None:
+            return leases
+        fetched = time.time()
+        answer = await proxy.get_leases_conditional(
+            after=after, **self._validators(entry))
+        return self._update(proxy, after, entry, fetched, answer)
@@ -0,0 +1,108 @@
+"""
+A sorted index over a set of leases, for answering time-based queries
+without scanning the whole list
+
+leases are sorted on their start time, and each position also stores
+the largest end time seen so far - the max-end augmentation; this
+allows to stop scanning backwards as soon as no earlier lease can
+possibly extend far enough
+
+since the API does not let leases overlap, all queries below
+run in O(log n), plus the size of the answer
+"""
+
+# c0111 no docstrings yet
+# pylint: disable=c0111
+
+import time
+from bisect import bisect_left, bisect_right
+
+
+class LeasesIndex:
+    """
+    leases can be any object with an ifrom and an iuntil attribute
+    (epochs); broken leases are ignored
+    """
+
+    def __init__(self, leases):
+        self.leases = sorted(
+            (lease for lease in leases if not getattr(lease, 'broken', False)),
+            key=lambda lease: lease.ifrom)
+        self.starts = [lease.ifrom for lease in self.leases]
+        self.max_untils = []
+        max_until = float('-inf')
+        for lease in self.leases:
+            max_until = max(max_until, lease.iuntil)
+            self.max_untils.append(max_until)
+
+    def __len__(self):
+        return len(self.leases)
+
+    def __repr__(self):
+        return f"<LeasesIndex with {len(self)} lease(s)>"
+
+    def _scan_back(self, index, predicate, bound):
+        """
+        walk leases[index-1], leases[index-2], ...
+        as long as some lease may end after bound
+        """
+        result = []
+        index -= 1
+        while index >= 0 and self.max_untils[index] >= bound:
+            lease = self.leases[index]
+            if predicate(lease):
+                result.append(lease)
+            index -= 1
+        result.reverse()
+        return result
+
+    def at(self, instant=None):
+        """
+        the leases that hold the testbed at that time (default is now)
+        bounds are included, like in Lease.booked_at_by
+        """
+        if instant is None:
+            instant = time.time()
+        index = bisect_right(self.starts, instant)
+        return self._scan_back(
+            index, lambda lease: lease.iuntil >= instant, instant)
+
+    def next_boundary(self, instant=None):
+        """
+        the first time strictly after instant where a lease
+        starts or ends - i.e. where the answer of at() may change
+        returns None if there is none
+        """
+        if instant is None:
+            instant = time.time()
+        candidates = [lease.iuntil for lease in self.at(instant)
+                      if lease.iuntil > instant]
+        index = bisect_right(self.starts, instant)
+        if index < len(self.starts):
+            candidates.append(self.starts[index])
+        return min(candidates, default=None)
+
+    def overlapping(self, start, end):
+        """
+        the leases that overlap with [start, end)
+        """
+        index = bisect_left(self.starts, end)
+        return self._scan_back(
+            index, lambda lease: lease.iuntil > start, start)
+
+    def is_free(self, start, end):
+        return not self.overlapping(start, end)
+
+    def next_free_slot(self, duration, after=None, until=None):
+        """
+        the start of the first free slot of that duration,
+        at or after <after> (default is now)
+        returns None if there is no such slot before <until>
+        """
+        start = time.time() if after is None else after
+        while until is None or start + duration <= until:
+            busy = self.overlapping(start, start + duration)
+            if not busy:
+                return start
+            start = max(lease.iuntil for lease in busy)
+        return None
@@ -45,6 +45,8 @@ rhubarbe_logging_config = {
             'class': 'logging.FileHandler',
             'formatter': 'standard',
             'filename': f'{str(Path.home())}/rhubarbe.log',
+            # do not open the file until something gets logged
+            'delay': True,
         },
         'monitor': {
             'level': 'DEBUG',
@@ -25,34 +25,16 @@ import asyncio
 # pkg_resources is deprecated in favor of importlib.resources
 from importlib import resources
 
-from asynciojobs import Scheduler, Job
-
-from asyncssh.logging import set_log_level as asyncssh_set_log_level
-
 # apparently using relative imports is - at least that's what pylint says
 # defining global variables like 'config'
 # pylint: disable = redefined-outer-name
+# only lightweight modules are imported here; each subcommand imports
+# what it needs when it runs, so that e.g. rhubarbe-nodes does not
+# pay for loading asyncssh, aiohttp or pandas
 from .config import Config
-from .imagesrepo import ImagesRepo
 from .selector import Selector, add_selector_arguments, selected_selector
-from .action import Action
-from .display import Display
-from .display_curses import DisplayCurses
-from .node import Node
-from .imageloader import ImageLoader
-from .imagesaver import ImageSaver
-from .monitor.loop import MonitorLoop
-from .monitor.nodes import MonitorNodes
-from .monitor.phones import MonitorPhones
-from .monitor.pdus import MonitorPdus
-from .monitor.accountsmanager import AccountsManager
-from .ssh import SshProxy
-from .leases import Leases
-from .book import Book
 from .inventorynodes import InventoryNodes
-from .inventoryphones import InventoryPhones
-from .inventorypdus import InventoryPdus
-from .inventoryrelays import InventoryRelays
+from .timing import Timings
 
 from .logger import monitor_logger
 
@@ -77,6 +59,15 @@ def turn_off_ssh_debug_messages():
 RESERVATION_REQUIRED = "This function requires a valid reservation - "\
                        "or to be root or a privileged user"
 
+JSON_HELP = "stream the results as JSON lines, " \
+            "one record per node and per event, as they happen"
+
+
+def add_json_argument(parser):
+    parser.add_argument("-j", "--json", "--jsonl", dest='json',
+                        action='store_true', default=False,
+                        help=JSON_HELP)
+
 
 ####################
 # exposed to the outside world (typically r2lab's nightly)
@@ -103,8 +94,12 @@ def check_reservation(leases, *,                        # pylint: disable=w0621
         actual_login = login or leases.login
         if verbose:
             print(f"Checking current reservation for {actual_login} : ", end="")
-        is_fine = await leases.booked_now_by(login=actual_login,
-                                             root_allowed=root_allowed)
+        try:
+            is_fine = await leases.booked_now_by(login=actual_login,
+                                                 root_allowed=root_allowed)
+        finally:
+            # the http session is bound to this event loop
+            await leases.close()
         if is_fine:
             if verbose:
                 print("OK")
@@ -124,10 +119,22 @@ def no_reservation(leases):                             # pylint: disable=w0621
     returns True if nobody currently has a lease
     """
     async def check_leases():
-        return not await leases.booked_now_by_anyone()
+        try:
+            return not await leases.booked_now_by_anyone()
+        finally:
+            await leases.close()
     return asyncio.new_event_loop().run_until_complete(check_leases())
 
 
+def float_or_auto(text):
+    """
+    argparse type for timeouts that can be computed from past runs
+    """
+    if text == 'auto':
+        return text
+    return float(text)
+
+
 ####################
 # NOTE: when adding a new command, please update setup.py as well
 supported_subcommands = []                              # pylint: disable=c0103
@@ -162,6 +169,9 @@ def cmc_verb(verb, resa_policy, *argv):
     (*) 'warn': issue a warning when the lease is not there
     (*) 'none' - or anything else really: does not check the leases
     """
+    from .action import Action
+    from .leases import Leases
+    from .display_json import DisplayJson
     usage = f"""
     Send verb '{verb}' to the CMC interface of selected nodes"""
     if resa_policy == 'enforce':
@@ -174,6 +184,7 @@ def cmc_verb(verb, resa_policy, *argv):
     parser.add_argument("-t", "--timeout", action='store',
                         default=default_timeout, type=float,
                         help="Specify global timeout for the whole process")
+    add_json_argument(parser)
     add_selector_arguments(parser)
     args = parser.parse_args(argv)
 
@@ -181,13 +192,17 @@ def cmc_verb(verb, resa_policy, *argv):
     leases = Leases(message_bus)                        # pylint: disable=w0621
 
     if resa_policy in ('warn', 'enforce'):
-        reserved = check_reservation(leases, verbose=False)
+        reserved = check_reservation(
+            leases, verbose=None if args.json else False)
         if not reserved:
+            if args.json:
+                DisplayJson([], message_bus).emit(
+                    dict(event='authorization', value='access denied'))
             if resa_policy == 'enforce':
                 return 1
 
     selector = selected_selector(args)
-    action = Action(verb, selector)
+    action = Action(verb, selector, json=args.json)
 
     return 0 if action.run(message_bus, args.timeout) else 1
 
@@ -247,6 +262,9 @@ def bye(*argv):
     An alternative implementation of the previous 'all-off' utility
     Switch the lights off when you leave
     """
+    from .action import Action
+    from .inventoryphones import InventoryPhones
+    from .inventorypdus import InventoryPdus
 
     usage = """
     Turn off whole testbed
@@ -270,7 +288,9 @@ def bye(*argv):
 
         message_bus = asyncio.Queue()
         print(f"{20*'='} bothoff {20*'='} (timeout={args.timeout})")
-        Action('bothoff', selector).run(message_bus, args.timeout)
+        # each CMC request gets the safe timeout as well
+        Action('bothoff', selector, cmc_timeout=args.timeout).run(
+            message_bus, args.timeout)
 
         # keep it simple for now
         time.sleep(1)
@@ -307,6 +327,13 @@ def bye(*argv):
 
 @subcommand
 def load(*argv):
+    from .imagesrepo import ImagesRepo
+    from .display import Display
+    from .display_curses import DisplayCurses
+    from .display_json import DisplayJson
+    from .node import Node
+    from .imageloader import ImageLoader
+    from .stats import StatsDatabase
     usage = f"""
     Load an image on selected nodes in parallel
     {RESERVATION_REQUIRED}
@@ -323,14 +350,16 @@ def load(*argv):
     parser.add_argument("-t", "--timeout", action='store',
                         default=config.value('nodes',
                                                  'load_default_timeout'),
-                        type=float,
-                        help="Specify global timeout for the whole process")
+                        type=float_or_auto,
+                        help="Specify global timeout for the whole process;"
+                        " 'auto' means to predict it from past loads")
     parser.add_argument("-b", "--bandwidth", action='store',
                         default=config.value('networking', 'bandwidth'),
                         type=int,
                         help="Set bandwidth in Mibps for frisbee uploading")
     parser.add_argument("-c", "--curses", action='store_true', default=False,
                         help="Use curses to provide term-based animation")
+    add_json_argument(parser)
     # this is more for debugging
     parser.add_argument("-n", "--no-reset", dest='reset',
                         action='store_false', default=True,
@@ -352,17 +381,24 @@ def load(*argv):
     # send feedback
     message_bus.put_nowait({'selected_nodes': selector})
     from rhubarbe.logger import logger
-    logger.info(f"timeout is {args.timeout}s")
-    logger.info(f"bandwidth is {args.bandwidth} Mibps")
 
     actual_image = imagesrepo.locate_image(args.image, look_in_global=True)
     if not actual_image:
         print(f"Image file {args.image} not found - emergency exit")
         exit(1)
 
+    if args.timeout == 'auto':
+        fallback = float(config.value('nodes', 'load_fallback_timeout'))
+        args.timeout = StatsDatabase().load_timeout(
+            actual_image.size, args.bandwidth, fallback)
+    logger.info(f"timeout is {args.timeout}s")
+    logger.info(f"bandwidth is {args.bandwidth} Mibps")
+
     # send feedback
     message_bus.put_nowait({'loading_image': actual_image})
-    display_class = Display if not args.curses else DisplayCurses
+    display_class = (DisplayJson if args.json
+                     else DisplayCurses if args.curses
+                     else Display)
     display = display_class(nodes, message_bus)
     loader = ImageLoader(nodes, image=actual_image, bandwidth=args.bandwidth,
                          message_bus=message_bus, display=display)
@@ -373,6 +409,11 @@ def load(*argv):
 
 @subcommand
 def save(*argv):
+    from .imagesrepo import ImagesRepo
+    from .display import Display
+    from .display_json import DisplayJson
+    from .node import Node
+    from .imagesaver import ImageSaver
     usage = f"""
     Save an image from a node
     Mandatory radical needs to be provided with --output
@@ -397,6 +438,7 @@ def save(*argv):
     parser.add_argument("-c", "--comment", dest='comment', default=None,
                         help="one-liner comment to insert in "
                         "/etc/rhubarbe-image")
+    add_json_argument(parser)
     parser.add_argument("-n", "--no-reset", dest='reset',
                         action='store_false', default=True,
                         help="""use this with a node that is already
@@ -420,7 +462,7 @@ def save(*argv):
     actual_image = imagesrepo.where_to_save(nodename, args.radical)
     message_bus.put_nowait({'info': f"Saving image {actual_image}"})
     # curses has no interest here since we focus on one node
-    display_class = Display
+    display_class = Display if not args.json else DisplayJson
     display = display_class([node], message_bus)
     saver = ImageSaver(node, image=actual_image, radical=args.radical,
                        message_bus=message_bus, display=display,
@@ -432,9 +474,19 @@ def save(*argv):
 
 @subcommand
 def wait(*argv):                                        # pylint: disable=r0914
+    from asynciojobs import Scheduler, Job
+    from asyncssh.logging import set_log_level as asyncssh_set_log_level
+    from .display import Display
+    from .display_curses import DisplayCurses
+    from .display_json import DisplayJson
+    from .node import Node
+    from .ssh import SshProxy
     usage = """
     Wait for selected nodes to be reachable by ssh
     Returns 0 if all nodes indeed are reachable
+    With --command, run that command on each node as soon as it is
+    reachable, and then return 0 only if all the commands succeed;
+    note that the global timeout also applies to the commands
     """
     # suppress info log messages from asyncssh
     asyncssh_set_log_level(logging.WARNING)
@@ -459,12 +511,16 @@ def wait(*argv):                                        # pylint: disable=r0914
     # really dont' write anything
     parser.add_argument("-s", "--silent", action='store_true', default=False)
     parser.add_argument("-v", "--verbose", action='store_true', default=False)
+    parser.add_argument("-e", "--command", default=None,
+                        help="command to run on each node, through the"
+                        " ssh connection that found it reachable")
+    add_json_argument(parser)
 
     add_selector_arguments(parser)
     args = parser.parse_args(argv)
 
     # --curses implies --verbose otherwise nothing shows up
-    if args.curses:
+    if args.curses and not args.json:
         args.verbose = True
 
     selector = selected_selector(args)
@@ -480,39 +536,152 @@ def wait(*argv):                                        # pylint: disable=r0914
              for cmc_name in selector.cmc_names()]
     sshs = [SshProxy(node, username=args.user, verbose=args.verbose)
             for node in nodes]
-    jobs = [Job(ssh.wait_for(args.backoff), critical=True) for ssh in sshs]
 
-    display_class = Display if not args.curses else DisplayCurses
+    display_class = (DisplayJson if args.json
+                     else DisplayCurses if args.curses
+                     else Display)
     display = display_class(nodes, message_bus)
 
+    # hostname -> bool, for the nodes where the command has completed
+    command_results = {}
+
+    async def run_command(ssh):
+        with Timings().phase('command',
+                             ssh.node.control_ip_address()) as record:
+            try:
+                output = await ssh.run(args.command)
+            finally:
+                await ssh.close()
+            record.ok = ssh.exit_status == 0
+            record.details['exit_status'] = ssh.exit_status
+        command_results[ssh.hostname] = record.ok
+        if args.json:
+            display.emit_node(ssh.hostname, 'command', output,
+                              exit_status=ssh.exit_status, ok=record.ok)
+        elif args.curses:
+            await ssh.node.feedback(
+                'ssh_status', f"command exit status {ssh.exit_status}")
+        elif not args.silent:
+            for line in (output or "").splitlines():
+                print(f"{ssh.node}:{line}")
+            print(f"{ssh.node}:exit {ssh.exit_status}")
+
+    async def wait_and_report(ssh):
+        status = await ssh.wait_for(args.backoff,
+                                    keep_open=args.command is not None)
+        # report each node as soon as it is reachable
+        if args.json:
+            display.emit_node(ssh.hostname, 'ssh', 'OK', ok=True)
+        # and kick off the command right away
+        if args.command is not None:
+            await run_command(ssh)
+        return status
+
+    jobs = [Job(wait_and_report(ssh), critical=True) for ssh in sshs]
+
     # have the display class run forever until the other ones are done
     scheduler = Scheduler(Job(display.run(), forever=True, critical=True),
                           *jobs,
                           timeout=args.timeout,
                           critical=False)
     try:
-        orchestration = scheduler.run()
+        with display.stray_output():
+            orchestration = scheduler.run()
         if orchestration:
+            if args.command is not None:
+                return 0 if all(command_results.values()) else 1
             return 0
         else:
-            if args.verbose:
+            if args.verbose and not args.json:
                 scheduler.debrief(silence_done_jobs=True)
             return 1
     except KeyboardInterrupt:
-        print("rhubarbe-wait : keyboard interrupt - exiting")
-        # xxx
+        # through the display, so it does not end up in a json stream
+        display.set_goodbye("rhubarbe-wait : keyboard interrupt - exiting")
         return 1
     finally:
         display.epilogue()
-        if not args.silent:
+        timings = Timings()
+        timings.write_report(
+            'wait', nodes=[ssh.hostname for ssh in sshs],
+            remote_command=args.command, command_results=command_results,
+            success=all(ssh.status for ssh in sshs))
+        if args.json:
+            # the ones that made it have been reported already
+            for ssh in sshs:
+                if not ssh.status:
+                    display.emit_node(ssh.hostname, 'ssh', 'KO', ok=False)
+                elif (args.command is not None
+                      and ssh.hostname not in command_results):
+                    display.emit_node(ssh.hostname, 'command', None,
+                                      exit_status=None, ok=False)
+        elif not args.silent:
             for ssh in sshs:
                 print(f"{ssh.node}:ssh {'OK' if ssh.status else 'KO'}")
+            if args.verbose:
+                timings.print_summary()
+
+####################
+
+
+@subcommand
+def stats(*argv):
+    from .imagesrepo import ImagesRepo
+    from .stats import StatsDatabase
+    usage = """
+    Report on past loads and saves, as recorded in the stats database:
+    throughput trends, slowest nodes and regressions
+    With --image, also show the predicted duration for loading that image
+    """
+    config = Config()
+    parser = ArgumentParser(usage=usage,
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-s", "--save", dest='command',
+                        action='store_const', const='save', default='load',
+                        help="report on saves instead of loads")
+    parser.add_argument("-d", "--days", default=90, type=int,
+                        help="how far back in time to look")
+    parser.add_argument("-l", "--limit", default=10, type=int,
+                        help="how many slow nodes to show")
+    parser.add_argument("-w", "--window", default=10, type=int,
+                        help="number of runs to compare for regressions")
+    parser.add_argument("-r", "--ratio", default=1.25, type=float,
+                        help="slowdown ratio above which"
+                        " a phase is deemed to have regressed")
+    parser.add_argument("-i", "--image", default=None,
+                        help="predict the duration for loading that image")
+    parser.add_argument("-b", "--bandwidth", action='store',
+                        default=config.value('networking', 'bandwidth'),
+                        type=int,
+                        help="bandwidth in Mibps used for the prediction")
+    args = parser.parse_args(argv)
+
+    database = StatsDatabase()
+    database.display(args.command, days=args.days, limit=args.limit,
+                     window=args.window, threshold=args.ratio)
+    if args.image:
+        imagesrepo = ImagesRepo()
+        actual_image = imagesrepo.locate_image(args.image,
+                                               look_in_global=True)
+        if not actual_image:
+            print(f"Image file {args.image} not found")
+            return 1
+        predicted = database.predict_load(actual_image.size, args.bandwidth)
+        print(10*'=', f"prediction for {actual_image}")
+        if predicted is None:
+            print("not enough history to predict a load duration")
+        else:
+            margin = float(config.value('reports', 'timeout_margin'))
+            print(f"predicted load duration {predicted:.1f}s"
+                  f" - suggested timeout {predicted*margin:.1f}s")
+    return 0
 
 ####################
 
 
 @subcommand
 def images(*argv):
+    from .imagesrepo import ImagesRepo
     usage = """
     Display available images
     """
@@ -564,6 +733,7 @@ def images(*argv):
 
 @subcommand
 def resolve(*argv):
+    from .imagesrepo import ImagesRepo
     usage = """for each input, find out and display
     what file exactly would be used if used with load
     and possible siblings if verbose mode is selected
@@ -587,6 +757,7 @@ def resolve(*argv):
 
 @subcommand
 def share(*argv):
+    from .imagesrepo import ImagesRepo
     usage = """
     Install privately-stored images into the global images repo
     Destination name is derived from the radical provided at save-time
@@ -630,6 +801,7 @@ def share(*argv):
 
 @subcommand
 def leases(*argv):
+    from .leases import Leases
     usage = """
     Unless otherwise specified, displays current leases, from today onwards
     """
@@ -659,6 +831,7 @@ def leases(*argv):
 
 @subcommand
 def book(*argv):
+    from .book import Book
     exit(0 if Book.main(argv) else 1)
 
 ####################
@@ -682,6 +855,9 @@ def set_loggers_level(verbose, debug):
 @subcommand
 def monitornodes(*argv):                                # pylint: disable=r0914
 
+    from .display import Display
+    from .monitor.loop import MonitorLoop
+    from .monitor.nodes import MonitorNodes
     usage = """
     Cyclic probe all selected nodes, and reports
     real-time status at a sidecar service over websockets
@@ -736,6 +912,8 @@ def monitornodes(*argv):                                # pylint: disable=r0914
 @subcommand
 def monitorphones(*argv):
 
+    from .monitor.loop import MonitorLoop
+    from .monitor.phones import MonitorPhones
     usage = """
     Cyclic probe all known phones, and reports real-time status
     at a sidecar service over websockets
@@ -774,6 +952,8 @@ def monitorphones(*argv):
 @subcommand
 def monitorpdus(*argv):
 
+    from .monitor.loop import MonitorLoop
+    from .monitor.pdus import MonitorPdus
     usage = """
     Cyclic probe all known pdus, and reports real-time status
     at a sidecar service over websockets
@@ -816,6 +996,8 @@ def monitorpdus(*argv):
 @subcommand
 def accountsmanager(*argv):
 
+    from .monitor.accountsmanager import AccountsManager
+    from .r2labapiproxy import r2labapi_proxy
     usage = "The core of the accounts manager; reserved to root"
 
     parser = ArgumentParser(usage=usage,
@@ -825,10 +1007,33 @@ def accountsmanager(*argv):
                              " default from config file.",
                         default=None)
     parser.add_argument("-d", "--debug", action='store_true')
+    parser.add_argument("-p", "--plan", action='store_true', default=False,
+                        help="Do not change anything, just print"
+                             " what one cycle would do")
+    parser.add_argument("-r", "--root", default=None,
+                        help="Manage accounts under that filesystem root;"
+                             " default from config file")
+    parser.add_argument("-a", "--api", default=None,
+                        help="Use that API url instead of the configured one;"
+                             " use e.g. fake://100 for a fake API"
+                             " with 100 slices")
+    parser.add_argument("-b", "--benchmark", action='store_true',
+                        default=False,
+                        help="Time cycles with 10, 100 and 1000 slices"
+                             " against a fake API, in a throwaway root")
+    parser.add_argument("-l", "--latency", type=float, default=0.,
+                        help="With --benchmark, the simulated time"
+                             " for one API request")
     args = parser.parse_args(argv)
 
-    accounts_manager = AccountsManager()
-    return accounts_manager.main(args.cycle, args.debug)
+    if args.benchmark:
+        # do not import at toplevel, not needed in production
+        from .monitor.accountsbench import benchmark
+        return benchmark(latency=args.latency)
+
+    proxy = r2labapi_proxy(args.api) if args.api else None
+    accounts_manager = AccountsManager(root=args.root, proxy=proxy)
+    return accounts_manager.main(args.cycle, args.debug, plan=args.plan)
 
 ####################
 
@@ -914,6 +1119,7 @@ def template(*argv):
 
 @subcommand
 def pdu(*argv):
+    from .inventorypdus import InventoryPdus
     usage = """
     manage PDUs; examples:
 
@@ -1018,21 +1224,35 @@ def pdu(*argv):
 
 @subcommand
 def relay(*argv):
+    from .inventoryrelays import InventoryRelays, RelaysCollector
+    from .relaysdb import RelaysDatabase
     usage = """
     perform temperature acquisition on the known relays
 
     one mandatory argument: mode must be either 'print' or 'store'; the former
     means printing current temperatures on stdout, the latter means create an entry
     in the temperatures database.
+    'import' loads the legacy temperatures.csv into the database
+    'collect' runs forever, and stores the temperatures every --period seconds
     """
     parser = ArgumentParser(
         usage=usage,
         formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         'mode',
-        choices=['store-temperatures', 'store', 'print-temperatures', 'print'],
+        choices=['store-temperatures', 'store', 'print-temperatures', 'print',
+                 'import', 'collect'],
         default='print',
     )
+    the_config = Config()
+    parser.add_argument(
+        '-p', '--period', type=float,
+        default=float(the_config.value('testbed', 'relays_collect_period')),
+        help="with collect, the sampling period in seconds")
+    parser.add_argument(
+        '-f', '--flush-period', type=float,
+        default=float(the_config.value('testbed', 'relays_flush_period')),
+        help="with collect, how often readings get written, in seconds")
     args = parser.parse_args(argv)
 
     inventory_relays = InventoryRelays.load()
@@ -1041,6 +1261,13 @@ def relay(*argv):
             inventory_relays.get_temperatures(mode='print')
         case 'store' | 'store-temperatures':
             inventory_relays.get_temperatures(mode='store')
+        case 'collect':
+            collector = RelaysCollector(
+                inventory_relays, args.period, args.flush_period)
+            return collector.main()
+        case 'import':
+            database = RelaysDatabase()
+            database.import_csv(database.folder / "temperatures.csv")
 
 ####################
 
@@ -1059,6 +1286,26 @@ def relaysapi(*argv):
 
 ####################
 
+@subcommand
+def daemon(*argv):
+    from .daemon import RhubarbeDaemon, DAEMON_COMMANDS, DEFAULT_SOCKET
+    usage = f"""
+    run a resident rhubarbe process, that the rhubarbe commands
+    then use instead of starting from scratch; applies to
+    {', '.join(sorted(DAEMON_COMMANDS))}
+    set RHUBARBE_NO_DAEMON to bypass it
+    """
+    parser = ArgumentParser(
+        usage=usage,
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-s", "--socket", default=None,
+                        help=f"unix socket to listen on; default is"
+                        f" $RHUBARBE_DAEMON_SOCKET or {DEFAULT_SOCKET}")
+    args = parser.parse_args(argv)
+    return RhubarbeDaemon(args.socket).serve_forever()
+
+####################
+
 @subcommand
 def version(*_):
     from rhubarbe.version import __version__
@@ -0,0 +1,69 @@
+"""
+Measures the cost of the accounts manager cycles
+
+each run uses a FakeR2labApi and a throwaway filesystem root, and
+times 3 cycles with the 'open' policy:
+* cold: all accounts get created
+* warm: nothing has changed
+* one change: the keys of one slice have changed
+"""
+
+# c0111 no docstrings yet
+# pylint: disable=c0111
+
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+from rhubarbe.logger import accounts_logger
+from rhubarbe.fakeapi import FakeR2labApi
+from rhubarbe.monitor.accountsmanager import AccountsManager
+
+SIZES = (10, 100, 1000)
+
+ACCESS_CONF_TEMPLATE = """# access.conf for benchmarking
+# END local
+-:ALL:ALL
+"""
+
+
+def run_cycle(manager, policy):
+    beg = time.perf_counter()
+    actions = manager.manage_accounts(policy)
+    return time.perf_counter() - beg, len(actions)
+
+
+def benchmark_one(nb_slices, policy, latency):
+    api = FakeR2labApi(nb_slices, latency=latency)
+    with tempfile.TemporaryDirectory(prefix="rhubarbe-bench-") as root:
+        access_conf = Path(root) / "etc/security/access.conf"
+        access_conf.parent.mkdir(parents=True)
+        access_conf.write_text(ACCESS_CONF_TEMPLATE)
+        (Path(root) / "home").mkdir()
+        manager = AccountsManager(root=root, proxy=api)
+        results = []
+        for step in ('cold', 'warm', 'one change'):
+            if step == 'one change':
+                slicename = api.slicenames[0]
+                api.set_keys(slicename, [f"ssh-ed25519 CHANGED {slicename}"])
+            requests = api.requests
+            duration, nb_actions = run_cycle(manager, policy)
+            results.append((step, duration, nb_actions,
+                            api.requests - requests))
+        return results
+
+
+def benchmark(sizes=SIZES, policy='open', latency=0.):
+    print(f"accounts manager cycles - policy={policy}"
+          f" - simulated API latency={latency}s")
+    print(f"{'slices':>7} {'cycle':>11} {'duration':>10}"
+          f" {'actions':>8} {'requests':>9}")
+    # keep the per-account messages out of the way
+    accounts_logger.setLevel(logging.WARNING)
+    for nb_slices in sizes:
+        for step, duration, nb_actions, requests in benchmark_one(
+                nb_slices, policy, latency):
+            print(f"{nb_slices:>7} {step:>11} {duration:>9.3f}s"
+                  f" {nb_actions:>8} {requests:>9}")
+    return 0
@@ -25,23 +25,69 @@ think of it as a dedicated nodemanager
 import time
 import os
 import pwd
+import grp
+import hashlib
+import tempfile
 import logging
 import subprocess
 import shlex
 
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from rhubarbe.logger import accounts_logger as logger
 from rhubarbe.config import Config
-from rhubarbe.r2labapiproxy import R2labApiProxy
+from rhubarbe.r2labapiproxy import r2labapi_proxy
+from rhubarbe.monitor.leasewatcher import LeaseWatcher
 
 # accounts that the manager should leave alone
 # xxx could be configurable
 LEGIT_ACCOUNTS = {'faraday'}
 
+# where to authorize slices, like netsop-accessctl would do
+ACCESS_CONF = "/etc/security/access.conf"
+
+# the magic sequence for both fit* and data*
+SSH_CONFIG_BASES = ['fit', 'data']
+SSH_CONFIG_PATTERN = """Host {base}*
+StrictHostKeyChecking no
+UserKnownHostsFile=/dev/null
+CheckHostIP=no
+"""
+SSH_CONFIG = "\n".join(
+    SSH_CONFIG_PATTERN.format(base=base) for base in SSH_CONFIG_BASES)
+
+
 def legal_name(name):
     return ('_' in name or '-' in name)
 
+
+def owner_ids(owner):
+    """
+    owner is either 'user' or 'user:group'
+    returns a (uid, gid) tuple
+    """
+    user, _, group = owner.partition(':')
+    record = pwd.getpwnam(user)
+    gid = grp.getgrnam(group).gr_gid if group else record.pw_gid
+    return record.pw_uid, gid
+
+
+def chown_tree(root, uid, gid):
+    """
+    the equivalent of chown -R, without forking
+    only touches the entries that need it
+    """
+    def chown(path):
+        stat = os.lstat(path)
+        if (stat.st_uid, stat.st_gid) != (uid, gid):
+            os.lchown(path, uid, gid)
+    chown(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            chown(os.path.join(dirpath, name))
+
+
 def run_command(command):
     """
     Run a shell command via subprocess.
@@ -104,31 +150,145 @@ def replace_file_with_string(destination_path, new_contents,
         if chmod:
             destination_path.chmod(chmod)
         if owner:
-            run_command(f"chown {owner} {destination_path}")
+            os.chown(destination_path, *owner_ids(owner))
         return True
-    except IOError as exc:
+    except (IOError, KeyError) as exc:
         logger.error(f"Cannot create {destination_path}, {exc}")
         return None
 
 ####################
 
 
+class AccessConf:
+    """
+    the slices allowed in /etc/security/access.conf
+
+    the file is parsed only when it has changed on disk,
+    and additions are accumulated and written in a single pass
+    """
+
+    def __init__(self, path=ACCESS_CONF):
+        self.path = Path(path)
+        # (mtime, size) when last parsed
+        self.stamp = None
+        self.lines = []
+        self.logins = set()
+        self.pending = []
+
+    def load(self):
+        stat = self.path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return
+        with self.path.open(encoding="utf-8") as reader:
+            self.lines = reader.readlines()
+        self.logins = {line.split(':')[1] for line in self.lines
+                       if line.startswith("+:") and line.count(':') >= 2}
+        self.stamp = stamp
+
+    def add(self, slicename):
+        if slicename not in self.logins and slicename not in self.pending:
+            self.pending.append(slicename)
+
+    def save(self):
+        """
+        insert the pending slices before the first "END local"
+        """
+        if not self.pending:
+            return
+        # in case the file was changed behind our back
+        self.load()
+        self.pending = [slicename for slicename in self.pending
+                        if slicename not in self.logins]
+        if not self.pending:
+            return
+        new_lines = [f"+:{slicename}:ALL\n" for slicename in self.pending]
+        lines = []
+        for line in self.lines:
+            if new_lines and "END local" in line:
+                lines.extend(new_lines)
+                new_lines = []
+            lines.append(line)
+        # no marker found
+        lines.extend(new_lines)
+        logger.info(f"adding {len(self.pending)} slice(s) in {self.path}")
+        fd, temporary = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}.")
+        with os.fdopen(fd, 'w', encoding="utf-8") as writer:
+            writer.writelines(lines)
+        os.chmod(temporary, 0o444)
+        os.replace(temporary, self.path)
+        self.lines = lines
+        self.logins.update(self.pending)
+        self.pending = []
+        stat = self.path.stat()
+        self.stamp = (stat.st_mtime_ns, stat.st_size)
+
+
 class AccountsManager:
 
-    def __init__(self):
+    def __init__(self, root=None, proxy=None):
+        """
+        root is the filesystem root where accounts are managed
+        (default from config); anything else than / is a sandbox,
+        where accounts are only simulated in root/etc/passwd
+
+        proxy can be used to provide an API backend, e.g. a FakeR2labApi
+        """
         the_config = Config()
         self.api_url = the_config.value('r2labapi', 'url')
-        self.admin_token = the_config.value('r2labapi', 'admin_token')
-
-        self._proxy = None
+        # how many keys requests can be in flight at the same time
+        self.fetch_workers = int(the_config.value('accounts', 'fetch_workers'))
+        if root is None:
+            root = the_config.value('accounts', 'root')
+        self.root = Path(root)
+        self.system = self.root == Path('/')
+
+        self._proxy = proxy
+        # slicename -> (etag, last_modified, authorized_keys)
+        self.keys_cache = {}
+        # slicename -> hash of the state last applied to that account
+        self.applied = {}
+        # the snapshot is dropped every so often, so that all
+        # accounts get checked and repaired if needed
+        self.resync_period = float(
+            the_config.value('accounts', 'resync_period'))
+        self.last_resync = 0
+        self.access_conf = AccessConf(
+            self.root / ACCESS_CONF.lstrip('/'))
+        # with the leased policy, tracks the leases in between cycles
+        self.watcher = None
 
     def proxy(self):
         if self._proxy is None:
-            self._proxy = R2labApiProxy(self.api_url, self.admin_token)
+            # only needed with a real API, not e.g. with fake://
+            admin_token = Config().value('r2labapi', 'admin_token')
+            self._proxy = r2labapi_proxy(self.api_url, admin_token,
+                                         pool_size=self.fetch_workers)
         return self._proxy
 
-    @staticmethod
-    def is_slice_account(record):
+    def home(self, slicename=None):
+        home = self.root / "home"
+        return home / slicename if slicename else home
+
+    def owner(self, slicename):
+        # no ownership in a sandbox
+        return f"{slicename}:{slicename}" if self.system else None
+
+    def passwd_records(self):
+        if self.system:
+            return pwd.getpwall()
+        try:
+            with (self.root / "etc/passwd").open(encoding='utf-8') as reader:
+                fields = [line.rstrip("\n").split(':') for line in reader]
+        except FileNotFoundError:
+            return []
+        return [pwd.struct_passwd((name, password, int(uid), int(gid),
+                                   gecos, homedir, shell))
+                for name, password, uid, gid, gecos, homedir, shell
+                in fields]
+
+    def is_slice_account(self, record):
         """
         A slice account has uid >= 1001 and shell /bin/bash
         This filters out system accounts (systemd-network, etc.)
@@ -139,18 +299,16 @@ class AccountsManager:
                 and legal_name(record.pw_name)
                 and record.pw_uid >= 1001
                 and record.pw_shell == '/bin/bash'
-                and Path(record.pw_dir).exists())
+                and (self.root / record.pw_dir.lstrip('/')).exists())
 
-    @classmethod
-    def slices_from_passwd(cls):
+    def slices_from_passwd(self):
         """
         Inspect /etc/passwd and return all slice logins
         """
-        return [record.pw_name for record in pwd.getpwall()
-                if cls.is_slice_account(record)]
+        return [record.pw_name for record in self.passwd_records()
+                if self.is_slice_account(record)]
 
-    @staticmethod
-    def slices_with_authorized():
+    def slices_with_authorized(self):
         """
         Iterator:
 
@@ -159,7 +317,7 @@ class AccountsManager:
         Focus on the ones that have a '_' in them, so that we leave
         alone custom accounts like 'guest' or similar.
         """
-        homeroot = Path('/home')
+        homeroot = self.home()
         for authorized in homeroot.glob('*/.ssh/authorized_keys'):
             # need to move 2 steps up
             basename = authorized.parts[-3]
@@ -169,24 +327,39 @@ class AccountsManager:
                 continue
             yield basename
 
-    @staticmethod
-    def create_account(slicename):
+    def useradd(self, slicename):
+        """
+        returns True if the account could be created
+        """
+        if self.system:
+            command = (f"useradd --create-home --user-group"
+                       f" {slicename} --shell /bin/bash")
+            logger.info(f"Running {command}")
+            return run_command(command)
+        # sandbox: just record it in root/etc/passwd
+        records = self.passwd_records()
+        uid = max([1000] + [record.pw_uid for record in records]) + 1
+        passwd = self.root / "etc/passwd"
+        passwd.parent.mkdir(parents=True, exist_ok=True)
+        with passwd.open('a', encoding='utf-8') as writer:
+            writer.write(f"{slicename}:x:{uid}:{uid}::/home/{slicename}"
+                         f":/bin/bash\n")
+        self.home(slicename).mkdir(parents=True, exist_ok=True)
+        return True
+
+    def create_account(self, slicename):
         """
         Does useradd with the right options
         Plus, creates .ssh dir with proper permissions
         Idempotent: skips steps already done, only logs real errors
         """
-        homedir = Path(f"/home/{slicename}")
+        homedir = self.home(slicename)
         sshdir = homedir / ".ssh"
 
         # create user only if it doesn't exist yet
-        try:
-            pwd.getpwnam(slicename)
-        except KeyError:
-            command = (f"useradd --create-home --user-group"
-                       f" {slicename} --shell /bin/bash")
-            logger.info(f"Running {command}")
-            if not run_command(command):
+        known = {record.pw_name for record in self.passwd_records()}
+        if slicename not in known:
+            if not self.useradd(slicename):
                 return
 
         # create .ssh dir if needed, ensure permissions
@@ -197,64 +370,54 @@ class AccountsManager:
             sshdir.chmod(0o700)
 
         # ensure correct ownership (silent unless it fails)
-        run_command(
-            f"chown -R {slicename}:{slicename} {homedir}")
-
-
-    # for #23
-    @staticmethod
-    def add_in_access_conf(slicename):
-        # do the job of netsop-accessctl by hand
-        # to get rid of the dependency
-        lines = []
-        with open("/etc/security/access.conf", encoding="utf-8") as f:
-            for line in f:
-                # nothing to do
-                if line.startswith(f"+:{slicename}:"):
-                    return
-                # insert before the first "END local"
-                if "END local" in line:
-                    lines.append(f"+:{slicename}:ALL\n")
-                lines.append(line)
-        with open("/etc/security/access.conf", "w", encoding="utf-8") as f:
-            f.writelines(lines)
-        run_command("chmod 444 /etc/security/access.conf")
+        if self.system:
+            try:
+                chown_tree(homedir, *owner_ids(self.owner(slicename)))
+            except (OSError, KeyError) as exc:
+                logger.error(f"Could not chown {homedir}: {exc}")
 
 
-    @staticmethod
-    def create_ssh_config(slicename):
+    def create_ssh_config(self, slicename):
         """
         Initialize slice's .ssh/config that keeps ssh from
         being too picky with host keys and similar
 
         Performed only if not yet existing
         """
-        ssh_config_file = Path("/home") / slicename / ".ssh/config"
-
-        # define the magic sequence for both fit* and data*
-        config_bases = ['fit', 'data']
-        #
-        config_pattern = """Host {base}*
-StrictHostKeyChecking no
-UserKnownHostsFile=/dev/null
-CheckHostIP=no
-"""
-
-        ssh_config = "\n".join(
-            [config_pattern.format(base=base) for base in config_bases])
-        replace_file_with_string(ssh_config_file,
-                                 ssh_config,
-                                 chmod=0o600,
-                                 owner=f"{slicename}:{slicename}")
+        ssh_config_file = self.home(slicename) / ".ssh/config"
+        return replace_file_with_string(ssh_config_file,
+                                        SSH_CONFIG,
+                                        chmod=0o600,
+                                        owner=self.owner(slicename))
+
+    def apply_keys(self, slicename, keys_string):
+        auth_path = self.home(slicename) / ".ssh/authorized_keys"
+        return replace_file_with_string(auth_path,
+                                        keys_string,
+                                        chmod=0o600,
+                                        owner=self.owner(slicename),
+                                        remove_if_empty=True)
 
     @staticmethod
-    def apply_keys(slicename, keys_string):
-        auth_path = Path("/home") / slicename / ".ssh/authorized_keys"
-        replace_file_with_string(auth_path,
-                                 keys_string,
-                                 chmod=0o600,
-                                 owner=f"{slicename}:{slicename}",
-                                 remove_if_empty=True)
+    def state_hash(keys_string, ssh_config=SSH_CONFIG):
+        """
+        a digest of what an account should look like
+        """
+        return hashlib.sha256(
+            (ssh_config + keys_string).encode()).hexdigest()
+
+    def disk_state(self, slicename):
+        """
+        the digest of what an account currently looks like on disk
+        """
+        sshdir = self.home(slicename) / ".ssh"
+        contents = []
+        for name in ("config", "authorized_keys"):
+            try:
+                contents.append((sshdir / name).read_text())
+            except OSError:
+                contents.append("")
+        return self.state_hash(contents[1], ssh_config=contents[0])
 
     ##########
     def fetch_authorized_keys(self, slicename):
@@ -262,37 +425,82 @@ CheckHostIP=no
         Fetch all SSH keys for all members of the given slice,
         using the /slices/by-name/{name}/keys endpoint.
         Returns a canonical authorized_keys string.
+
+        The previous answer is kept per slice, and revalidated
+        with a conditional request; it is also what gets returned
+        if the API cannot be reached, so that a transient failure
+        does not revoke the keys
         """
+        etag, last_modified, cached = self.keys_cache.get(
+            slicename, (None, None, None))
         try:
-            ssh_keys = self.proxy().get_slice_keys(slicename)
+            ssh_keys, etag, last_modified = \
+                self.proxy().get_slice_keys_conditional(
+                    slicename, etag=etag, last_modified=last_modified)
         except Exception as exc:
+            if cached is not None:
+                logger.error(
+                    f"Could not fetch keys for slice {slicename}: {exc}"
+                    f" - using the previous answer")
+                return cached
             logger.error(
                 f"Could not fetch keys for slice {slicename}: {exc}")
             return ""
+        if ssh_keys is None:
+            return cached
         key_lines = [(k['key'].replace("\n", "") + "\n")
                      for k in ssh_keys]
         key_lines.sort()
-        return "".join(key_lines)
+        keys = "".join(key_lines)
+        if keys != cached:
+            logger.debug(f"keys for slice {slicename} have changed")
+        self.keys_cache[slicename] = (etag, last_modified, keys)
+        return keys
 
-    ##########
-    def manage_accounts(self, policy):             # pylint: disable=r0914
+    def fetch_all_authorized_keys(self, slicenames):
+        """
+        same as fetch_authorized_keys, on several slices at once
+        with at most fetch_workers requests in parallel
+        returns a dict slicename -> authorized_keys string
+        """
+        slicenames = list(slicenames)
+        # forget about slices that are gone
+        for slicename in set(self.keys_cache) - set(slicenames):
+            del self.keys_cache[slicename]
+        if not slicenames:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            return dict(zip(
+                slicenames,
+                executor.map(self.fetch_authorized_keys, slicenames)))
 
+    ##########
+    def desired_state(self, policy):
+        """
+        returns a tuple (logins, auths_by_login) where
+        * logins are the existing slice accounts
+        * auths_by_login maps each account to its authorized_keys contents
+        or None if the API cannot be reached
+        """
         try:
             slices = self.proxy().get_slices()
         except Exception as exc:
             logger.info(f"r2labapi unreachable ({exc}) - back to sleep")
-            return
+            return None
 
         current_slicenames = []
         if policy == 'leased':
             try:
-                current_leases = self.proxy().get_current_leases()
-                current_slicenames = [
-                    lease['slice_name'] for lease in current_leases]
+                if self.watcher is not None:
+                    current_slicenames = self.watcher.current_slicenames()
+                else:
+                    current_leases = self.proxy().get_current_leases()
+                    current_slicenames = [
+                        lease['slice_name'] for lease in current_leases]
             except Exception as exc:
                 logger.info(
                     f"r2labapi: cannot get leases ({exc}) - back to sleep")
-                return
+                return None
 
         # initialize with the slice names that are in /etc/passwd
         logins = self.slices_from_passwd()
@@ -303,41 +511,112 @@ CheckHostIP=no
         # will effectively have their authorized_keys voided
         auths_by_login = {login: "" for login in logins}
 
-        for sliceobj in slices:
-            slicename = sliceobj['name']
-            # policy-dependant
-            if policy == 'closed':
-                authorized_keys = ""
-
-            elif policy == 'leased':
-                authorized_keys = ""
-                if slicename in current_slicenames:
-                    authorized_keys = self.fetch_authorized_keys(slicename)
+        slicenames = [sliceobj['name'] for sliceobj in slices]
+        # policy-dependant
+        if policy == 'closed':
+            to_fetch = []
+        elif policy == 'leased':
+            to_fetch = [slicename for slicename in slicenames
+                        if slicename in current_slicenames]
+        # policy == 'open'
+        else:
+            to_fetch = slicenames
+        fetched = self.fetch_all_authorized_keys(to_fetch)
 
-            # policy == 'open'
-            else:
-                authorized_keys = self.fetch_authorized_keys(slicename)
+        for slicename in slicenames:
+            auths_by_login[slicename] = fetched.get(slicename, "")
+        return logins, auths_by_login
 
-            auths_by_login[slicename] = authorized_keys
+    def plan(self, logins, auths_by_login):
+        """
+        compute the actions needed to reach the desired state
+        returns a list of tuples (verb, slicename, keys) with verb in
+        * 'create': create the account
+        * 'keys': write ssh config and authorized_keys
+        * 'authorize': add in access.conf
+        """
+        # start over from scratch every once in a while
+        # which allows to repair broken accounts
+        if time.time() - self.last_resync >= self.resync_period:
+            logger.info("resync: checking all accounts")
+            self.applied.clear()
+            self.last_resync = time.time()
+        try:
+            self.access_conf.load()
+        except OSError as exc:
+            logger.error(f"Cannot read {self.access_conf.path}: {exc}")
 
-        # implement it
-        managed = 0
+        actions = []
         for slicename, keys in auths_by_login.items():
+            state = self.state_hash(keys)
+            if slicename not in logins:
+                actions.append(('create', slicename, None))
+                self.applied.pop(slicename, None)
+            elif slicename not in self.applied:
+                # no snapshot yet, compare with what is on disk
+                self.applied[slicename] = self.disk_state(slicename)
+            if self.applied.get(slicename) != state:
+                actions.append(('keys', slicename, keys))
+            if slicename not in self.access_conf.logins:
+                actions.append(('authorize', slicename, None))
+        # forget about accounts that are gone
+        for slicename in set(self.applied) - set(auths_by_login):
+            del self.applied[slicename]
+        return actions
+
+    @staticmethod
+    def print_plan(actions):
+        for verb, slicename, keys in actions:
+            if verb == 'keys':
+                details = (f"{keys.count(chr(10))} key(s)" if keys
+                           else "revoke all keys")
+                print(f"{verb:>10} {slicename} - {details}")
+            else:
+                print(f"{verb:>10} {slicename}")
+        print(f"{len(actions)} action(s)")
+
+    def apply(self, actions):
+        for verb, slicename, keys in actions:
             try:
-                logger.debug(f"managing account {slicename} with {keys.count(chr(10))} keys")
-                if slicename not in logins:
+                if verb == 'create':
                     self.create_account(slicename)
-                # do this always, allows to propagate later changes
-                self.create_ssh_config(slicename)
-                self.apply_keys(slicename, keys)
-                # do this always too, allows to repair broken accounts
-                self.add_in_access_conf(slicename)
-                managed += 1
+                elif verb == 'keys':
+                    logger.debug(f"managing account {slicename}"
+                                 f" with {keys.count(chr(10))} keys")
+                    # None means the file could not be written
+                    if (self.create_ssh_config(slicename) is not None
+                            and self.apply_keys(slicename, keys) is not None):
+                        self.applied[slicename] = self.state_hash(keys)
+                elif verb == 'authorize':
+                    self.access_conf.add(slicename)
             except Exception:
                 logger.exception(f"Could not deal with slice {slicename}")
-        logger.debug(f"managed {managed} accounts")
+        # at most one write per cycle
+        try:
+            self.access_conf.save()
+        except OSError as exc:
+            logger.error(f"Cannot update {self.access_conf.path}: {exc}")
+
+    def manage_accounts(self, policy, dry_run=False):
+        """
+        one cycle; with dry_run, only print the actions
+        returns the list of actions
+        """
+        desired = self.desired_state(policy)
+        if desired is None:
+            return []
+        actions = self.plan(*desired)
+        if dry_run:
+            self.print_plan(actions)
+        else:
+            self.apply(actions)
+            logger.debug(f"managed accounts: {len(actions)} action(s)")
+        return actions
 
     def run_forever(self, cycle, policy):
+        if policy == 'leased':
+            poll = Config().value('accounts', 'lease_poll')
+            self.watcher = LeaseWatcher(self.proxy(), poll)
         while True:
             beg = time.time()
             logger.info("accounts manager "
@@ -346,7 +625,11 @@ CheckHostIP=no
             now = time.time()
             duration = now - beg
             towait = cycle - duration
-            if towait > 0:
+            if self.watcher is not None:
+                # wake up early when a lease starts or ends
+                reason = self.watcher.wait(beg + cycle)
+                logger.info(f"----- accounts manager - woken up by {reason}")
+            elif towait > 0:
                 logger.info(f"----- accounts manager - "
                             f"sleeping for {towait:.2f}s")
                 time.sleep(towait)
@@ -354,13 +637,14 @@ CheckHostIP=no
                 logger.info(f"duration {duration}s exceeded cycle {cycle}s - "
                             f"skipping sleep")
 
-    def main(self, cycle, debug):
+    def main(self, cycle, debug, plan=False):
         """
         cycle is the duration in seconds of one cycle
 
         Corner cases:
         * cycle = None : fetch value from config_bases
         * cycle = 0 : run just once (for debug mostly)
+        * plan = True : just print what one cycle would do
         """
 
         if debug:
@@ -372,6 +656,9 @@ CheckHostIP=no
         if policy not in ('open', 'leased', 'closed'):
             logger.error(f"Unknown policy {policy} - using 'closed'")
             policy = 'closed'
+        if plan:
+            self.manage_accounts(policy, dry_run=True)
+            return
         # trick is
         if cycle != 0:
             self.run_forever(cycle, policy)
@@ -0,0 +1,104 @@
+"""
+Keeps track of the leases on behalf of the accounts manager
+
+instead of fetching the current leases once per cycle, the watcher
+* keeps the leases of the day in a LeasesIndex,
+* sleeps until the next lease boundary - a lease starting or ending -
+  so that the change can be applied right away,
+* and in between, polls the API with a conditional GET (ETag),
+  which is cheap when nothing has changed
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111,w0703,w1202
+# pylint: disable=logging-fstring-interpolation
+
+import time
+from datetime import datetime, timezone
+
+from rhubarbe.logger import accounts_logger as logger
+from rhubarbe.leases import Lease
+from rhubarbe.leasesindex import LeasesIndex
+
+# wake up that long after a boundary, so that at() reflects the change
+# (bounds are included in leases)
+GRACE = 1.
+
+
+class LeaseWatcher:
+
+    def __init__(self, proxy, poll):
+        """
+        proxy is a (synchroneous) R2labApiProxy
+        poll is the period, in seconds, for checking for lease changes
+        """
+        self.proxy = proxy
+        self.poll = float(poll)
+        self.etag = None
+        self.last_modified = None
+        self.api_leases = None
+        self.index = None
+
+    def __repr__(self):
+        return f"<LeaseWatcher poll={self.poll}s {self.index}>"
+
+    def refresh(self):
+        """
+        fetch the leases if they have changed
+        returns True if they have, False otherwise
+        raises an exception if the API cannot be reached
+        """
+        today = datetime.now(tz=timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        api_leases, self.etag, self.last_modified = \
+            self.proxy.get_leases_conditional(
+                etag=self.etag, last_modified=self.last_modified,
+                after=today.isoformat())
+        # not modified, or no ETag support but same contents
+        if api_leases is None or api_leases == self.api_leases:
+            return False
+        self.api_leases = api_leases
+        self.index = LeasesIndex(Lease(api_lease) for api_lease in api_leases)
+        logger.info(f"leases changed - {len(self.index)} lease(s)")
+        return True
+
+    def current_slicenames(self, instant=None):
+        """
+        the names of the slices that hold a lease right now
+        """
+        if self.index is None:
+            self.refresh()
+        return [lease.owner for lease in self.index.at(instant)]
+
+    def wait(self, deadline):
+        """
+        sleep until deadline (an epoch), or until the current
+        slices might have changed, whichever comes first
+
+        returns the reason for waking up, one of
+        'deadline', 'boundary', or 'change'
+        """
+        # compute this once, it is no longer visible in at()
+        # once the boundary has passed
+        boundary = (self.index.next_boundary(time.time())
+                    if self.index is not None else None)
+        while True:
+            now = time.time()
+            if boundary is not None and now >= boundary + GRACE:
+                logger.info("lease boundary reached")
+                return 'boundary'
+            if now >= deadline:
+                return 'deadline'
+            wake = min(deadline, now + self.poll)
+            if boundary is not None:
+                wake = min(wake, boundary + GRACE)
+            logger.debug(f"lease watcher sleeping for {wake - now:.2f}s")
+            time.sleep(wake - now)
+            try:
+                if self.refresh():
+                    return 'change'
+            except Exception as exc:
+                logger.info(f"r2labapi: cannot poll leases ({exc})")
@@ -10,8 +10,12 @@ and reports it to the sidecar service
 
 # pylint: disable=fixme,logging-fstring-interpolation,missing-function-docstring
 
+import os
 import re
+import json
 import asyncio
+import tempfile
+from pathlib import Path
 
 from rhubarbe.config import Config
 from rhubarbe.node import Node
@@ -282,6 +286,8 @@ class MonitorNodes:
         self.ping_timeout = float(Config().value('networking', 'ping_timeout'))
         self.ssh_timeout = float(Config().value('networking', 'ssh_timeout'))
         self.log_period = float(Config().value('monitor', 'log_period'))
+        state_path = Config().value('monitor', 'state_path')
+        self.state_path = Path(state_path).expanduser() if state_path else None
 
         # websockets
         self.reconnectable = \
@@ -304,8 +310,28 @@ class MonitorNodes:
             line += f" {current} emits ({delta})"
             previous = current
             logger.warning(line)
+            self.store_state()
             await asyncio.sleep(self.log_period)
 
+    def store_state(self):
+        """
+        write the last known state of all nodes, for --where queries
+        """
+        if self.state_path is None:
+            return
+        state = {mnode.node.id: mnode.info for mnode in self.monitor_nodes}
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(
+                dir=self.state_path.parent, prefix=f".{self.state_path.name}.")
+            with os.fdopen(fd, 'w', encoding='utf-8') as writer:
+                json.dump(state, writer, default=str)
+            # readers may not be root
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, self.state_path)
+        except OSError as exc:
+            logger.error(f"could not store state in {self.state_path}: {exc}")
+
     async def run_forever(self):
         logger.info(f"Starting nodes on {len(self.monitor_nodes)} nodes")
         return asyncio.gather(
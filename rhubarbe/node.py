@@ -10,17 +10,18 @@ querying status, turning on or off, and similar
 # pylint: disable=c0111, w0703, w1202
 # pylint: disable=logging-fstring-interpolation
 
-import os.path
 import traceback
 
 import asyncio
 import aiohttp
 
 from rhubarbe.logger import logger
-from rhubarbe.config import Config
+from rhubarbe.cmc import CmcClient
 from rhubarbe.inventorynodes import InventoryNodes
 from rhubarbe.frisbee import Frisbee
 from rhubarbe.imagezip import ImageZip
+from rhubarbe.timing import Timings
+from rhubarbe.pxeboot import PxeBootManager
 
 
 class Node:                                             # pylint: disable=r0902
@@ -30,9 +31,11 @@ class Node:                                             # pylint: disable=r0902
     created from the cmc hostname for convenience
     the inventory lets us spot the other parts (control, essentially)
     """
-    def __init__(self, cmc_name, message_bus):
+    def __init__(self, cmc_name, message_bus, cmc_timeout=None):
         self.cmc_name = cmc_name
         self.message_bus = message_bus
+        # None means CmcClient's default for each verb
+        self.cmc_timeout = cmc_timeout
         self.status = None
         self.action = None
         self.mac = None
@@ -137,19 +140,20 @@ class Node:                                             # pylint: disable=r0902
         verb typically is 'status', 'on', 'off' or 'info'
         """
         url = f"http://{self.cmc_name}/{verb}"
-        cmc_timeout = float(Config().value('nodes', 'cmc_default_timeout'))
-        http_timeout = aiohttp.ClientTimeout(connect=cmc_timeout, total=cmc_timeout)
         try:
-            async with aiohttp.ClientSession(timeout=http_timeout) as session:
-                async with session.get(url) as response:
-                    text = await response.text(encoding='utf-8')
-                    if strip_result:
-                        text = text.strip()
-                    setattr(self, verb, text)
+            text = await CmcClient().get(self.cmc_name, verb,
+                                         timeout=self.cmc_timeout)
+            if strip_result:
+                text = text.strip()
+            setattr(self, verb, text)
         except aiohttp.client_exceptions.ClientConnectorError:
             logger.info(f"cannot connect to {url}")
             setattr(self, verb, None)
             return None
+        except asyncio.TimeoutError:
+            logger.info(f"no answer from {url}")
+            setattr(self, verb, None)
+            return None
         except Exception:
             traceback.print_exc()
             setattr(self, verb, None)
@@ -186,13 +190,9 @@ class Node:                                             # pylint: disable=r0902
           * False to indicate that the node is 'off' after checking
           * None if something goes wrong
         """
-        url = f"http://{self.cmc_name}/{message}"
-        cmc_timeout = float(Config().value('nodes', 'cmc_default_timeout'))
-        http_timeout = aiohttp.ClientTimeout(connect=cmc_timeout, total=cmc_timeout)
         try:
-            async with aiohttp.ClientSession(timeout=http_timeout) as session:
-                async with session.get(url) as response:
-                    text = await response.text(encoding='utf-8')
+            text = await CmcClient().get(self.cmc_name, message,
+                                         timeout=self.cmc_timeout)
         except Exception:
             self.action = None
             return self
@@ -214,21 +214,27 @@ class Node:                                             # pylint: disable=r0902
         await self.message_bus.put(
             {'ip': self.control_ip_address(), field: message})
 
-    async def ensure_reset(self):
-        if self.status is None:
-            await self.get_status()
-        # still no status: means the CMC does not answer
-        if self.status not in self.message_to_reset_map:
-            await self.feedback(
-                'reboot', f"Cannot get status at {self.cmc_name} (status={self.status})")
-            return
-        message_to_send = self.message_to_reset_map[self.status]
-        await self.feedback(
-            'reboot', f"Sending message '{message_to_send}' to CMC {self.cmc_name}")
-        await self.send_action(message_to_send, check=True)
-        if not self.action:
+    async def ensure_reset(self, phase='cmc_reset'):
+        """
+        phase is the name under which this gets recorded in the timings
+        """
+        with Timings().phase(phase, self.control_ip_address()) as record:
+            if self.status is None:
+                await self.get_status()
+            # still no status: means the CMC does not answer
+            if self.status not in self.message_to_reset_map:
+                record.ok = False
+                await self.feedback(
+                    'reboot', f"Cannot get status at {self.cmc_name} (status={self.status})")
+                return
+            message_to_send = self.message_to_reset_map[self.status]
             await self.feedback(
-                'reboot', f"Failed to send message {message_to_send} to CMC {self.cmc_name}")
+                'reboot', f"Sending message '{message_to_send}' to CMC {self.cmc_name}")
+            await self.send_action(message_to_send, check=True)
+            if not self.action:
+                record.ok = False
+                await self.feedback(
+                    'reboot', f"Failed to send message {message_to_send} to CMC {self.cmc_name}")
 
     # used to be a coroutine, but since we need this
     # when dealing by KeybordInterrupt, it appears much safer
@@ -242,28 +248,10 @@ class Node:                                             # pylint: disable=r0902
         * 'frisbee' : define a symlink so that next boot
           will run the frisbee image
         see rhubarbe.conf for configurable options
-        """
 
-        the_config = Config()
-        root = the_config.value('pxelinux', 'config_dir')
-        frisbee = the_config.value('pxelinux', 'frisbee_image')
-
-        # of the form 01-00-03-1d-0e-03-53
-        mylink = "01-" + self.control_mac_address().replace(':', '-')
-        source = os.path.join(root, mylink)
-
-        if action in ('cleanup', 'harddrive'):
-            if os.path.exists(source):
-                logger.info(f"Removing {source}")
-                os.remove(source)
-        elif action in ('frisbee', ):
-            if os.path.exists(source):
-                os.remove(source)
-            logger.info(f"Creating {source}")
-            os.symlink(frisbee, source)
-        else:
-            logger.critical(
-                f"manage_nextboot_symlink : unknown action {action}")
+        when dealing with several nodes, use PxeBootManager directly
+        """
+        PxeBootManager().apply([(self, action)])
 
 
     ##########
@@ -276,22 +264,48 @@ class Node:                                             # pylint: disable=r0902
             self.imagezip = ImageZip(ipaddr, self.message_bus)
             await self.imagezip.wait_until_connect()
 
-    async def reboot_on_frisbee(self, idle):
-        self.manage_nextboot_symlink('frisbee')
+    async def reboot_on_frisbee(self, idle, set_nextboot=True):
+        """
+        set_nextboot can be turned off when the caller
+        has already set the symlinks for a whole selection
+        """
+        if set_nextboot:
+            self.manage_nextboot_symlink('frisbee')
         await self.ensure_reset()
         await self.feedback('reboot', f"idling for {idle}s")
-        await asyncio.sleep(idle)
+        with Timings().phase('idle', self.control_ip_address()):
+            await asyncio.sleep(idle)
 
-    async def run_frisbee(self, ipaddr, port, reset):
-        await self.wait_for_telnet('frisbee')
+    async def write_image(self, ipaddr, port, telnet_timeout=None):
+        """
+        wait for the frisbee image to be telnet-friendly - for at most
+        telnet_timeout seconds if not None - then run frisbee
+
+        returns True if the image was written successfully
+        """
+        try:
+            await asyncio.wait_for(self.wait_for_telnet('frisbee'),
+                                   timeout=telnet_timeout)
+        except asyncio.TimeoutError:
+            await self.feedback(
+                'frisbee_status',
+                f"telnet still not up after {telnet_timeout}s")
+            return False
         self.manage_nextboot_symlink('cleanup')
         result = await self.frisbee.run(ipaddr, port)
-        #logger.info(f"run_frisbee -> {result}")
+        #logger.info(f"write_image -> {result}")
+        return result
+
+    async def final_reset(self, reset):
         if reset:
-            await self.ensure_reset()
+            await self.ensure_reset(phase='final_reset')
         else:
             await self.feedback('reboot',
                                 'skipping final reset')
+
+    async def run_frisbee(self, ipaddr, port, reset):
+        result = await self.write_image(ipaddr, port)
+        await self.final_reset(reset)
         return result
 
     async def run_imagezip(self, port, reset, radical, comment):
@@ -301,7 +315,7 @@ class Node:                                             # pylint: disable=r0902
                                          radical, comment)
         #logger.info(f"run_imagezip -> {result}")
         if reset:
-            await self.ensure_reset()
+            await self.ensure_reset(phase='final_reset')
         else:
             await self.feedback('reboot',
                                 'skipping final reset')
@@ -0,0 +1,122 @@
+"""
+Management of the per-node symlinks in /tftpboot/pxelinux.cfg/
+that decide what a node boots on next
+
+A node with a symlink boots on the frisbee image, a node without
+boots off its hard drive
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation
+
+import os
+from pathlib import Path
+
+from rhubarbe.logger import logger
+from rhubarbe.config import Config
+from rhubarbe.singleton import Singleton
+
+
+class PxeBootManager(metaclass=Singleton):
+    """
+    owns the pxelinux config directory
+
+    link names are computed once per node, and the current contents
+    of the directory is scanned once per call to apply(), so that
+    redundant operations in a batch get skipped; it is not cached
+    any longer, as other processes - e.g. another rhubarbe-load -
+    may change the directory in the meantime
+
+    symlinks are created under a temporary name and renamed in place,
+    so that a crash never leaves a half-written link behind
+    """
+
+    def __init__(self):
+        the_config = Config()
+        self.root = Path(the_config.value('pxelinux', 'config_dir'))
+        self.frisbee_image = the_config.value('pxelinux', 'frisbee_image')
+        # cmc_name -> link name
+        self._link_names = {}
+        # link name -> target, for the node links currently in root
+        # as of the last scan
+        self._links = None
+
+    def link_name(self, node):
+        """
+        of the form 01-00-03-1d-0e-03-53
+        """
+        if node.cmc_name not in self._link_names:
+            self._link_names[node.cmc_name] = \
+                "01-" + node.control_mac_address().replace(':', '-')
+        return self._link_names[node.cmc_name]
+
+    def links(self):
+        if self._links is None:
+            self._links = {}
+            try:
+                with os.scandir(self.root) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("01-"):
+                            self._links[entry.name] = (
+                                os.readlink(entry.path)
+                                if entry.is_symlink() else None)
+            except FileNotFoundError:
+                logger.error(f"pxelinux config_dir {self.root} not found")
+        return self._links
+
+    def _set_frisbee(self, name):
+        links = self.links()
+        if links.get(name) == self.frisbee_image:
+            return
+        source = self.root / name
+        temporary = self.root / f".{name}.{os.getpid()}"
+        logger.info(f"Creating {source}")
+        try:
+            os.remove(temporary)
+        except FileNotFoundError:
+            pass
+        os.symlink(self.frisbee_image, temporary)
+        os.replace(temporary, source)
+        links[name] = self.frisbee_image
+
+    def _clear(self, name):
+        links = self.links()
+        if name not in links:
+            return
+        source = self.root / name
+        logger.info(f"Removing {source}")
+        try:
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+        del links[name]
+
+    def apply(self, node_actions):
+        """
+        node_actions is an iterable of (node, action) tuples,
+        with action being
+        * 'cleanup' or 'harddrive' : clear the symlink for that node
+        * 'frisbee' : define a symlink so that next boot
+          will run the frisbee image
+        """
+        # rescan, the directory may have changed since last time
+        self._links = None
+        for node, action in node_actions:
+            name = self.link_name(node)
+            if action in ('cleanup', 'harddrive'):
+                self._clear(name)
+            elif action in ('frisbee', ):
+                self._set_frisbee(name)
+            else:
+                logger.critical(
+                    f"PxeBootManager.apply : unknown action {action}")
+
+    def set_frisbee(self, nodes):
+        self.apply((node, 'frisbee') for node in nodes)
+
+    def clear(self, nodes):
+        self.apply((node, 'harddrive') for node in nodes)
@@ -1,6 +1,10 @@
 """
 REST client for the r2labapi service.
 Replaces the XMLRPC-based PlcApiProxy.
+
+R2labApiProxy is blocking, and meant for synchroneous code
+(Book, AccountsManager); AsyncR2labApiProxy is its counterpart
+for use from coroutines, so that no API call blocks the event loop
 """
 
 # c0111 no docstrings yet
@@ -8,10 +12,13 @@ Replaces the XMLRPC-based PlcApiProxy.
 # pylint: disable=c0111, w1202
 
 import os
+import time
 import getpass
+import asyncio
 from datetime import datetime, timezone
 
 import requests
+import aiohttp
 
 from .logger import logger
 
@@ -38,11 +45,19 @@ class R2labApiProxy:
     - interactive login: R2labApiProxy(url) then write operations
       will prompt for email/password (or read R2LABAPI_EMAIL /
       R2LABAPI_PASSWORD env vars)
+
+    pool_size is the number of connections kept open to the server;
+    set it to the number of threads that share the proxy
     """
 
-    def __init__(self, url, admin_token=None):
+    def __init__(self, url, admin_token=None, pool_size=None):
         self.url = url.rstrip('/')
         self.session = requests.Session()
+        if pool_size:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=int(pool_size))
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
         self.session.headers['Accept'] = 'application/json'
         if admin_token:
             self.session.headers['Authorization'] = \
@@ -80,6 +95,26 @@ class R2labApiProxy:
         response.raise_for_status()
         return response.json()
 
+    def _get_conditional(self, path, params=None,
+                         etag=None, last_modified=None):
+        """
+        a GET that revalidates a previous answer
+        returns a tuple (data, etag, last_modified)
+        where data is None if the server answered 304 Not Modified
+        """
+        url = f'{self.url}{path}'
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        response = self.session.get(url, params=params, headers=headers)
+        response.raise_for_status()
+        data = None if response.status_code == 304 else response.json()
+        return (data,
+                response.headers.get('ETag', etag),
+                response.headers.get('Last-Modified', last_modified))
+
     def _post(self, path, json=None):
         self.ensure_authenticated()
         url = f'{self.url}{path}'
@@ -120,6 +155,16 @@ class R2labApiProxy:
         """
         return self._get(f'/slices/by-name/{slicename}/keys')
 
+    def get_slice_keys_conditional(self, slicename,
+                                   etag=None, last_modified=None):
+        """
+        same as get_slice_keys, but revalidates a previous answer
+        returns a tuple (keys, etag, last_modified)
+        with keys set to None if nothing has changed
+        """
+        return self._get_conditional(f'/slices/by-name/{slicename}/keys',
+                                     etag=etag, last_modified=last_modified)
+
     # ---- leases ----
 
     def get_leases(self, **params):
@@ -132,9 +177,18 @@ class R2labApiProxy:
         """
         return self._get('/leases', params=params or None)
 
+    def get_leases_conditional(self, etag=None, last_modified=None,
+                               **params):
+        """
+        same as get_leases, but revalidates a previous answer
+        returns a tuple (leases, etag, last_modified)
+        with leases set to None if nothing has changed
+        """
+        return self._get_conditional('/leases', params=params or None,
+                                     etag=etag, last_modified=last_modified)
+
     def get_current_leases(self):
         """Convenience: get leases alive right now."""
-        import time
         now = int(time.time())
         return self._get('/leases', params={'alive': now})
 
@@ -169,3 +223,201 @@ class R2labApiProxy:
 
     def __str__(self):
         return f"R2labApiProxy@{self.url}"
+
+
+class AsyncR2labApiProxy:
+    """
+    The asyncio counterpart of R2labApiProxy, on top of aiohttp
+
+    * one pooled ClientSession is created lazily, and must be
+      released with close() - or by using the object as an
+      asynchroneous context manager
+    * all requests are subject to a total timeout
+    * idempotent requests are retried on connection errors,
+      timeouts and 5xx answers, with an exponential backoff
+
+    Authentication works the same as with R2labApiProxy
+    """
+
+    def __init__(self, url, admin_token=None, *,
+                 timeout=None, retries=None, pool_size=None):
+        # do not import at toplevel to avoid import loop
+        from .config import Config
+        the_config = Config()
+        self.url = url.rstrip('/')
+        self.timeout = float(
+            timeout if timeout is not None
+            else the_config.value('r2labapi', 'timeout'))
+        self.retries = int(
+            retries if retries is not None
+            else the_config.value('r2labapi', 'retries'))
+        self.pool_size = int(
+            pool_size if pool_size is not None
+            else the_config.value('r2labapi', 'pool_size'))
+        self.headers = {'Accept': 'application/json'}
+        if admin_token:
+            self.headers['Authorization'] = f'Bearer {admin_token}'
+        self._session = None
+
+    def __str__(self):
+        return f"AsyncR2labApiProxy@{self.url}"
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def is_authenticated(self):
+        return 'Authorization' in self.headers
+
+    async def login(self, email, password):
+        """Authenticate with email/password, store JWT."""
+        _, data, _ = await self._request(
+            'POST', '/auth/login',
+            json={'email': email, 'password': password})
+        self.headers['Authorization'] = f'Bearer {data["access_token"]}'
+
+    async def ensure_authenticated(self):
+        """Prompt for credentials if not already authenticated."""
+        if self.is_authenticated:
+            return
+        email = (os.environ.get("R2LABAPI_EMAIL")
+                 or input("Enter r2labapi email (login): "))
+        password = (os.environ.get("R2LABAPI_PASSWORD")
+                    or getpass.getpass(
+                        f"Enter r2labapi password for {email}: "))
+        await self.login(email, password)
+
+    # ---- low-level HTTP verbs ----
+
+    async def _request(self, method, path, *,           # pylint: disable=r0913
+                       params=None, json=None, headers=None):
+        """
+        returns a tuple (status, data, headers)
+        data is None for 204 and 304 answers
+        raises aiohttp.ClientResponseError on http errors
+        """
+        url = f'{self.url}{path}'
+        all_headers = dict(self.headers)
+        all_headers.update(headers or {})
+        # only retry idempotent requests
+        attempts = 1 + (self.retries if method in ('GET', 'DELETE') else 0)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                async with self.session().request(
+                        method, url, params=params, json=json,
+                        headers=all_headers) as response:
+                    if response.status >= 500 and not last:
+                        logger.info(f"{method} {url} -> {response.status}"
+                                    f" - retrying")
+                    else:
+                        response.raise_for_status()
+                        data = (None if response.status in (204, 304)
+                                else await response.json())
+                        return response.status, data, response.headers
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as exc:
+                if last:
+                    raise
+                logger.info(f"{method} {url} failed ({exc!r}) - retrying")
+            await asyncio.sleep(0.5 * 2**attempt)
+        # not reached
+        return None
+
+    async def _get(self, path, params=None):
+        _, data, _ = await self._request('GET', path, params=params)
+        return data
+
+    async def _get_conditional(self, path, params=None,
+                               etag=None, last_modified=None):
+        """
+        same as R2labApiProxy._get_conditional
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        _, data, response_headers = await self._request(
+            'GET', path, params=params, headers=headers)
+        return (data,
+                response_headers.get('ETag', etag),
+                response_headers.get('Last-Modified', last_modified))
+
+    async def _post(self, path, json=None):
+        await self.ensure_authenticated()
+        _, data, _ = await self._request('POST', path, json=json)
+        return data
+
+    async def _patch(self, path, json=None):
+        await self.ensure_authenticated()
+        _, data, _ = await self._request('PATCH', path, json=json)
+        return data
+
+    async def _delete(self, path):
+        await self.ensure_authenticated()
+        await self._request('DELETE', path)
+
+    # ---- slices ----
+
+    async def get_slices(self):
+        return await self._get('/slices')
+
+    async def get_slice_keys(self, slicename):
+        return await self._get(f'/slices/by-name/{slicename}/keys')
+
+    # ---- leases ----
+
+    async def get_leases(self, **params):
+        return await self._get('/leases', params=params or None)
+
+    async def get_leases_conditional(self, etag=None, last_modified=None,
+                                     **params):
+        return await self._get_conditional(
+            '/leases', params=params or None,
+            etag=etag, last_modified=last_modified)
+
+    async def get_current_leases(self):
+        now = int(time.time())
+        return await self._get('/leases', params={'alive': now})
+
+    async def create_lease(self, body):
+        return await self._post('/leases', json=body)
+
+    async def update_lease(self, lease_id, body):
+        return await self._patch(f'/leases/{lease_id}', json=body)
+
+    async def delete_lease(self, lease_id):
+        await self._delete(f'/leases/{lease_id}')
+
+    # ---- resources ----
+
+    async def get_resource_by_name(self, name):
+        return await self._get(f'/resources/by-name/{name}')
+
+
+def r2labapi_proxy(url, admin_token=None, pool_size=None):
+    """
+    a synchroneous proxy for that url; a fake://... url
+    selects a FakeR2labApi, for tests and benchmarks
+    """
+    if url.startswith('fake:'):
+        # do not import at toplevel to avoid import loop
+        from .fakeapi import FakeR2labApi
+        return FakeR2labApi.from_url(url)
+    return R2labApiProxy(url, admin_token, pool_size=pool_size)
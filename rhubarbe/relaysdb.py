@@ -0,0 +1,210 @@
+"""
+Time-series storage for the relays readings (temperatures for now)
+
+readings go in a sqlite database, indexed on time, so that the cost
+of a query depends on the requested window and not on the history
+length; in addition
+* rollups (averages per ROLLUP_PERIODS) are maintained as readings
+  come in, so that downsampled queries do not scan the raw samples
+* raw samples older than the retention period get pruned
+
+this replaces the former temperatures.csv, that gets imported
+when the database is first created
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation
+
+import csv
+import time
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from .config import Config
+from .logger import logger
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    ts INTEGER NOT NULL,
+    relay TEXT NOT NULL,
+    temperature REAL,
+    UNIQUE (relay, ts)
+);
+CREATE INDEX IF NOT EXISTS samples_by_ts ON samples (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    period INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    relay TEXT NOT NULL,
+    temperature REAL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (period, ts, relay)
+);
+"""
+
+# in seconds
+ROLLUP_PERIODS = (300, 3600)
+
+
+def iso_to_epoch(iso):
+    """
+    as found in the legacy csv, e.g. 2024-05-01T12:00:00Z
+    """
+    return int(datetime.fromisoformat(iso.replace('Z', '+00:00')).timestamp())
+
+
+class RelaysDatabase:
+
+    def __init__(self, folder=None):
+        the_config = Config()
+        if folder is None:
+            folder = the_config.value('testbed', 'relays_database_folder')
+        self.folder = Path(folder)
+        self.path = self.folder / "temperatures.db"
+        self.retention = float(
+            the_config.value('testbed', 'relays_retention_days')) * 86400
+        self._connection = None
+
+    def __repr__(self):
+        return f"<RelaysDatabase {self.path}>"
+
+    def connection(self):
+        if self._connection is None:
+            if not self.folder.is_dir():
+                print(f"Creating folder {self.folder}")
+                self.folder.mkdir(parents=True, exist_ok=True)
+            is_new = not self.path.exists()
+            self._connection = sqlite3.connect(self.path)
+            # readers (the API) do not block the writer (the collector)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            legacy = self.folder / "temperatures.csv"
+            if is_new and legacy.exists():
+                self.import_csv(legacy)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    ##########
+    def insert(self, readings):
+        """
+        readings is an iterable of (epoch, relay, temperature) tuples
+        all readings are written in a single transaction
+        returns the number of new samples
+        """
+        connection = self.connection()
+        inserted = 0
+        with connection:
+            for epoch, relay, temperature in readings:
+                epoch = int(epoch)
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO samples (ts, relay, temperature)"
+                    " VALUES (?, ?, ?)", (epoch, relay, temperature))
+                # duplicates must not be accounted for twice
+                if cursor.rowcount != 1 or temperature is None:
+                    continue
+                inserted += 1
+                for period in ROLLUP_PERIODS:
+                    connection.execute(
+                        "INSERT INTO rollups"
+                        " (period, ts, relay, temperature, count)"
+                        " VALUES (?, ?, ?, ?, 1)"
+                        " ON CONFLICT (period, ts, relay) DO UPDATE SET"
+                        " temperature = (temperature * count"
+                        "                + excluded.temperature) / (count + 1),"
+                        " count = count + 1",
+                        (period, epoch // period * period, relay, temperature))
+        return inserted
+
+    def prune(self, now=None):
+        """
+        remove the raw samples older than the retention period
+        the rollups are kept
+        """
+        if self.retention <= 0:
+            return 0
+        now = time.time() if now is None else now
+        connection = self.connection()
+        with connection:
+            cursor = connection.execute(
+                "DELETE FROM samples WHERE ts < ?",
+                (int(now - self.retention),))
+        if cursor.rowcount:
+            logger.info(f"pruned {cursor.rowcount} old relay samples")
+        return cursor.rowcount
+
+    def import_csv(self, path):
+        """
+        import the legacy csv file: timestamp,relay,temperature
+        """
+        def readings():
+            with Path(path).open(encoding='utf-8') as reader:
+                for line in csv.reader(reader):
+                    try:
+                        timestamp, relay, temperature = line
+                        yield iso_to_epoch(timestamp), relay, float(temperature)
+                    except ValueError:
+                        logger.warning(f"{path}: ignoring line {line}")
+        inserted = self.insert(readings())
+        logger.info(f"imported {inserted} samples from {path}")
+        print(f"imported {inserted} samples from {path} into {self.path}")
+        return inserted
+
+    ##########
+    def data_version(self):
+        """
+        changes each time another connection commits to the database
+        """
+        return self.connection().execute("PRAGMA data_version").fetchone()[0]
+
+    def tail(self, after_rowid, since=None):
+        """
+        the samples added after that rowid, as a list of
+        (rowid, epoch, relay, temperature) tuples
+        optionally restricted to the ones from since (an epoch) onwards
+        """
+        since = 0 if since is None else int(since)
+        return self.connection().execute(
+            "SELECT rowid, ts, relay, temperature FROM samples"
+            " WHERE rowid > ? AND ts >= ? ORDER BY rowid",
+            (after_rowid, since)).fetchall()
+
+    ##########
+    def query(self, *, since=None, period=None):
+        """
+        the readings from since (an epoch) onwards, as a list of
+        (epoch, relay, temperature) tuples sorted by relay and time
+
+        if period (in seconds) is set, readings are averaged over buckets
+        of that duration - aligned on the epoch - and the epoch is the
+        start of the bucket
+        """
+        since = 0 if since is None else int(since)
+        connection = self.connection()
+        if period is None:
+            return connection.execute(
+                "SELECT ts, relay, temperature FROM samples"
+                " WHERE ts >= ? ORDER BY relay, ts", (since,)).fetchall()
+        period = int(period)
+        # use the largest rollup that the period is a multiple of
+        bases = [base for base in ROLLUP_PERIODS if period % base == 0]
+        if bases:
+            base = max(bases)
+            return connection.execute(
+                "SELECT ts / ? * ? AS bucket, relay,"
+                " SUM(temperature * count) / SUM(count)"
+                " FROM rollups WHERE period = ? AND ts >= ?"
+                " GROUP BY relay, bucket ORDER BY relay, bucket",
+                (period, period, base, since // base * base)).fetchall()
+        return connection.execute(
+            "SELECT ts / ? * ? AS bucket, relay, AVG(temperature)"
+            " FROM samples WHERE ts >= ?"
+            " GROUP BY relay, bucket ORDER BY relay, bucket",
+            (period, period, since)).fetchall()
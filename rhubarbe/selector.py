@@ -2,6 +2,19 @@
 
 """
 Shared commodities for conveniently selecting a set of nodes.
+
+a selection is stored as a bitset - a python int where bit i
+stands for node i - so that building and combining selections
+is cheap, even with thousands of nodes; selectors support the
+usual set operators | & - ^, and ~ for the complement against all_scope
+
+besides ranges, nodes can be designated by group, like in @usrp;
+groups are defined in the [groups] section of the config, and
+@all is the same as all_scope; groups are computed once per config
+
+on the command line, --where further restricts the selection
+to the nodes whose inventory or monitor state match a query,
+see InventoryNodes.where()
 """
 
 # c0111 no docstrings yet
@@ -11,8 +24,15 @@ Shared commodities for conveniently selecting a set of nodes.
 # pylint: disable=c0111
 
 import os
+import re
+import weakref
 
 from rhubarbe.config import Config
+from rhubarbe.inventorynodes import InventoryNodes
+
+
+# config -> {group name -> bits}
+_GROUPS = weakref.WeakKeyDictionary()
 
 
 class MisformedRange(Exception):
@@ -25,15 +45,34 @@ class MisformedRange(Exception):
         return f"Misformed node range '{self.rangetext}'"
 
 
+def range_bits(lower, upper, step=1):
+    """
+    the bits for lower..upper (inclusive) by step
+    """
+    if upper < lower:
+        return 0
+    if step == 1:
+        return ((1 << (upper - lower + 1)) - 1) << lower
+    # build the pattern as a string, shifting big ints in a loop is quadratic
+    count = (upper - lower) // step + 1
+    pattern = (('1' + (step-1) * '0') * count)[:(count-1) * step + 1]
+    return int(pattern[::-1], 2) << lower
+
+
 class Selector:
 
     # typically regularname='fit' and rebootname='reboot'
     # so that fit01 and reboot01 are names that resolve
-    def __init__(self):
+    def __init__(self, bits=0):
         the_config = Config()
         self.regularname = the_config.value('testbed', 'regularname')
         self.rebootname = the_config.value('testbed', 'rebootname')
-        self.set = set()
+        self.prefixes = re.compile(
+            "|".join(re.escape(name)
+                     for name in (self.regularname, self.rebootname)
+                     if name))
+        self._bits = 0
+        self.bits = bits
 
     def __repr__(self):
         return "<Selector " + " ".join(self.node_names()) + ">"
@@ -41,24 +80,50 @@ class Selector:
     def __str__(self):
         return "Selected nodes: " + " ".join(self.node_names())
 
+    @property
+    def bits(self):
+        return self._bits
+
+    @bits.setter
+    def bits(self, bits):
+        self._bits = bits
+        # cached views
+        self._indices = None
+        self._node_names = None
+        self._cmc_names = None
+
+    def indices(self):
+        """
+        the selected node numbers, in increasing order
+        """
+        if self._indices is None:
+            # lowest bit first
+            binary = bin(self._bits)[:1:-1]
+            self._indices = tuple(i for i, bit in enumerate(binary)
+                                  if bit == '1')
+        return self._indices
+
     def add_or_delete(self, index, add_if_true):
         if add_if_true:
-            self.set.add(index)
-        # set.remove triggers KeyError
-        elif index in self.set:
-            self.set.remove(index)
+            self.bits = self._bits | (1 << index)
+        else:
+            self.bits = self._bits & ~(1 << index)
 
-    # range is a shell arg, like fit01, fit1, 1, 1-12, ~25
+    # range is a shell arg, like fit01, fit1, 1, 1-12, ~25, @usrp
     def add_range(self, range_spec):
-        range_spec = (range_spec
-                      .replace(self.regularname, "")
-                      .replace(self.rebootname, ""))
-        commas = range_spec.split(',')
-        for comma in commas:
+        self.bits = self._apply(self._bits, range_spec, ())
+
+    def _apply(self, bits, range_spec, visiting):
+        for comma in range_spec.split(','):
             adding = True
             if comma.startswith('~'):
                 adding = False
                 comma = comma[1:]
+            if comma.startswith('@'):
+                items = self.group_bits(comma[1:], visiting)
+                bits = (bits | items) if adding else (bits & ~items)
+                continue
+            comma = self.prefixes.sub("", comma)
             try:
                 items = [int(x) for x in comma.split('-')]
             except Exception:
@@ -71,34 +136,89 @@ class Selector:
             if len(items) >= 4:
                 print(f"Ignored arg {comma}")
                 continue
-            elif len(items) == 3:
-                lower, upper, step = items
-                for i in range(lower, upper+1, step):
-                    self.add_or_delete(i, adding)
-            elif len(items) == 2:
-                lower, upper = items
-                for i in range(lower, upper+1):
-                    self.add_or_delete(i, adding)
-            else:
-                i = items[0]
-                self.add_or_delete(i, adding)
+            if len(items) == 3 and items[2] <= 0:
+                raise MisformedRange(comma)
+            if len(items) == 1:
+                items.append(items[0])
+            items = range_bits(*items)
+            bits = (bits | items) if adding else (bits & ~items)
+        return bits
+
+    def group_bits(self, name, visiting=()):
+        """
+        the bits for a named group; 'all' is the all_scope
+        """
+        the_config = Config()
+        groups = _GROUPS.setdefault(the_config, {})
+        if name in groups:
+            return groups[name]
+        if name in visiting:
+            raise MisformedRange(f"@{name} (recursive group)")
+        if name == 'all':
+            definition = the_config.value('testbed', 'all_scope')
+        else:
+            definitions = the_config.resolved.get('groups', {})
+            if name not in definitions:
+                raise MisformedRange(f"@{name} (unknown group)")
+            definition = definitions[name]
+        bits = 0
+        for range_spec in definition.split():
+            bits = self._apply(bits, range_spec, visiting + (name,))
+        groups[name] = bits
+        return bits
 
     # generators
     def node_names(self):
-        return (f"{self.regularname}{i:02}" for i in sorted(self.set))
+        if self._node_names is None:
+            self._node_names = tuple(f"{self.regularname}{i:02}"
+                                     for i in self.indices())
+        return iter(self._node_names)
 
     def cmc_names(self):
-        return (f"{self.rebootname}{i:02}" for i in sorted(self.set))
+        if self._cmc_names is None:
+            self._cmc_names = tuple(f"{self.rebootname}{i:02}"
+                                    for i in self.indices())
+        return iter(self._cmc_names)
 
     def __len__(self):
-        return len(self.set)
+        return self._bits.bit_count()
+
+    def __iter__(self):
+        return iter(self.indices())
+
+    def __contains__(self, index):
+        return bool(self._bits >> index & 1)
+
+    def __eq__(self, other):
+        return isinstance(other, Selector) and self._bits == other.bits
+
+    def __hash__(self):
+        return hash(self._bits)
 
     def is_empty(self):
-        return not self.set
+        return not self._bits
 
     def use_all_scope(self):
-        the_config = Config()
-        self.add_range(the_config.value('testbed', 'all_scope'))
+        self.bits = self._bits | self.group_bits('all')
+
+    # set algebra, the result is a new selector
+    def __or__(self, other):
+        return Selector(self._bits | other.bits)
+
+    def __and__(self, other):
+        return Selector(self._bits & other.bits)
+
+    def __sub__(self, other):
+        return Selector(self._bits & ~other.bits)
+
+    def __xor__(self, other):
+        return Selector(self._bits ^ other.bits)
+
+    def __invert__(self):
+        """
+        the complement against the all_scope
+        """
+        return Selector(self.group_bits('all') & ~self._bits)
 
 ####################
 # convenience tools shared by all commands that need this sort of selection
@@ -120,7 +240,9 @@ def add_selector_arguments(arg_parser):
         or by range (inclusive) like: 2-12, fit4-reboot12;
         or by range+step like:
         4-16-2 which would be all even numbers from 4 to 16;
-        ranges can also be excluded with '~', so ~1-4 means remove 1,2,3,4
+        ranges can also be excluded with '~', so ~1-4 means remove 1,2,3,4;
+        groups defined in the [groups] config section can be used
+        with '@', like @usrp or ~@usrp; @all is the all_scope
 
         ex:  1-4 7-25-2 ~11-19-4
 
@@ -128,6 +250,18 @@ def add_selector_arguments(arg_parser):
 
         1 2 3 4 7 9 13 17 21 23 25
         """)
+    arg_parser.add_argument(
+        "-w", "--where", action='append', default=[],
+        help="""
+        keep only the nodes whose attributes match, like e.g.
+        usrp_on_off=on or os_release~ubuntu or control.mac!~^00:03;
+        attributes are the inventory fields, and the last known state
+        as written by monitornodes (os_release, image_radical,
+        usrp_on_off, cmc_on_off, ...);
+        several queries - or comma-separated ones - must all match;
+        applies to the nodes selected otherwise, i.e. to $NODES
+        without ranges nor -a; use -a to search the whole testbed
+        """)
 
 
 def selected_selector(parser_args, defaults_to_all=False):
@@ -156,4 +290,7 @@ def selected_selector(parser_args, defaults_to_all=False):
         for range1 in ranges:
             selector.add_range(range1)
 
+    if parser_args.where:
+        selector.bits &= InventoryNodes().where(*parser_args.where)
+
     return selector
@@ -17,6 +17,7 @@ import asyncio
 import asyncssh
 
 from .logger import monitor_logger as logger
+from .timing import Timings
 
 DEBUG = False
 # DEBUG = True
@@ -78,6 +79,8 @@ class SshProxy:
         #
         self.hostname = self.node.control_hostname()
         self.status = None
+        # of the last command run
+        self.exit_status = None
         self.conn, self.client = None, None
 
     def __repr__(self):
@@ -124,7 +127,8 @@ class SshProxy:
 
     async def run(self, command):
         """
-        Run a command
+        Run a command, return its output, or None if it could not run
+        its exit status is then available in self.exit_status
         """
         class ClientsessionClosure(MySSHClientSession):
             def __init__(ssh_client_session,            # pylint: disable=e0213
@@ -140,9 +144,11 @@ class SshProxy:
                 ClientsessionClosure, command)
             await chan.wait_closed()
             output = session.data
+            self.exit_status = chan.get_exit_status()
         except Exception as exc:
             logger.info(f"failed to SSH run {self.hostname} - {type(exc)=} {exc=}")
             output = None
+            self.exit_status = None
         finally:
             end = time.time()
             logger.info(f"SSH run {self.hostname} took {end-begin:.3f}s")
@@ -156,28 +162,36 @@ class SshProxy:
             await self.conn.wait_closed()
         self.conn = None
 
-    async def wait_for(self, backoff, timeout=5.):
+    async def wait_for(self, backoff, timeout=5., keep_open=False):
         """
         Wait until the ssh service is usable
+        with keep_open, the connection is left open for running commands
+        and it is then up to the caller to close it
         """
         self.status = False
-        while True:
-            if self.verbose:
-                await self.node.feedback('ssh_status', "trying to connect")
-            self.status = await self.connect(timeout)
-            if self.status:
+        with Timings().phase('ssh_ready',
+                             self.node.control_ip_address()) as record:
+            attempts = 0
+            while True:
+                attempts += 1
+                record.details['attempts'] = attempts
                 if self.verbose:
-                    await self.node.feedback('ssh_status', "connection OK")
-                await self.close()
-                return self.status
-            # random.random() is between 0. and 1.
-            # and so as we need something between 0.5 and 1.5
-            random_backoff = (0.5 + random.random()) * backoff
-            if self.verbose:
-                await self.node.feedback(
-                    'ssh_status',
-                    f"cannot connect, backing off for {random_backoff:.3}s")
-            await asyncio.sleep(random_backoff)
+                    await self.node.feedback('ssh_status', "trying to connect")
+                self.status = await self.connect(timeout)
+                if self.status:
+                    if self.verbose:
+                        await self.node.feedback('ssh_status', "connection OK")
+                    if not keep_open:
+                        await self.close()
+                    return self.status
+                # random.random() is between 0. and 1.
+                # and so as we need something between 0.5 and 1.5
+                random_backoff = (0.5 + random.random()) * backoff
+                if self.verbose:
+                    await self.node.feedback(
+                        'ssh_status',
+                        f"cannot connect, backing off for {random_backoff:.3}s")
+                await asyncio.sleep(random_backoff)
 
 
 # mostly test-oriented
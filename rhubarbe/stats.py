@@ -0,0 +1,258 @@
+"""
+Historical performance database for load and save
+
+Every load and save appends a record - built from the run's Timings -
+to a local sqlite database; this is used to
+* report throughput trends, the slowest nodes, and regressions
+* predict the duration of a new load, and thus a sensible timeout
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation
+
+import time
+import sqlite3
+from pathlib import Path
+from statistics import median
+
+from rhubarbe.logger import logger
+from rhubarbe.config import Config
+from rhubarbe.timing import Timings, percentile
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL,
+    image TEXT,
+    image_size INTEGER,
+    nb_nodes INTEGER,
+    bandwidth INTEGER,
+    -- the median duration of the transfer phase (frisbee or imagezip)
+    transfer REAL,
+    success INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_by_command ON runs (command, started);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    hostname TEXT,
+    phase TEXT NOT NULL,
+    duration REAL,
+    ok INTEGER
+);
+CREATE INDEX IF NOT EXISTS phases_by_run ON phases (run_id);
+CREATE INDEX IF NOT EXISTS phases_by_phase ON phases (phase, hostname);
+"""
+
+TRANSFER_PHASES = {'load': 'frisbee', 'save': 'imagezip'}
+
+MEBI = 2**20
+
+
+class StatsDatabase:
+
+    def __init__(self, path=None):
+        if path is None:
+            path = Config().value('reports', 'database')
+        self.path = Path(path).expanduser()
+        self._connection = None
+
+    def connection(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    ##########
+    def record_run(self, command, *,                    # pylint: disable=r0913
+                   image=None, image_size=None, nb_nodes=None,
+                   bandwidth=None, success=None, timings=None):
+        """
+        store the phases recorded in timings (default is the Timings
+        singleton), together with the run metadata
+        returns the new run id
+        """
+        # do not import at toplevel to avoid import loop
+        from rhubarbe.inventorynodes import InventoryNodes
+        the_inventory = InventoryNodes()
+        timings = timings or Timings()
+        transfer_phase = TRANSFER_PHASES.get(command)
+        transfers = [record.duration for record in timings.records
+                     if record.phase == transfer_phase
+                     and record.ok and record.end is not None]
+        connection = self.connection()
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (command, started, duration, image,"
+                " image_size, nb_nodes, bandwidth, transfer, success)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (command, timings.wall_origin,
+                 time.monotonic() - timings.origin,
+                 None if image is None else str(image),
+                 image_size, nb_nodes, bandwidth,
+                 median(transfers) if transfers else None,
+                 None if success is None else int(bool(success))))
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO phases (run_id, hostname, phase, duration, ok)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(run_id,
+                  (the_inventory.control_hostname_from_any_ip(record.ip)
+                   if record.ip else None),
+                  record.phase, record.duration, int(bool(record.ok)))
+                 for record in timings.records if record.end is not None])
+        logger.info(f"run {run_id} recorded in {self.path}")
+        return run_id
+
+    ##########
+    def trends(self, command, days):
+        """
+        one row per week: week, runs, failures, average throughput in MiB/s
+        """
+        since = time.time() - days * 24 * 3600
+        return self.connection().execute(
+            "SELECT strftime('%Y-w%W', started, 'unixepoch', 'localtime'),"
+            " COUNT(*),"
+            " SUM(CASE WHEN success = 0 THEN 1 ELSE 0 END),"
+            " AVG(CASE WHEN transfer > 0"
+            "     THEN image_size / transfer / ? END)"
+            " FROM runs WHERE command = ? AND started >= ?"
+            " GROUP BY 1 ORDER BY 1",
+            (MEBI, command, since)).fetchall()
+
+    def slowest_nodes(self, command, days, limit):
+        """
+        the nodes with the largest average transfer time
+        rows are hostname, count, average duration, failures
+        """
+        since = time.time() - days * 24 * 3600
+        return self.connection().execute(
+            "SELECT phases.hostname, COUNT(*), AVG(phases.duration),"
+            " SUM(CASE WHEN phases.ok = 0 THEN 1 ELSE 0 END)"
+            " FROM phases JOIN runs ON phases.run_id = runs.id"
+            " WHERE runs.command = ? AND runs.started >= ?"
+            " AND phases.phase = ? AND phases.hostname IS NOT NULL"
+            " GROUP BY phases.hostname"
+            " ORDER BY 3 DESC LIMIT ?",
+            (command, since, TRANSFER_PHASES[command], limit)).fetchall()
+
+    def _recent_runs(self, command, limit, offset=0):
+        return [row[0] for row in self.connection().execute(
+            "SELECT id FROM runs WHERE command = ?"
+            " ORDER BY started DESC LIMIT ? OFFSET ?",
+            (command, limit, offset))]
+
+    def _phase_medians(self, run_ids):
+        """
+        a dict phase -> median duration over these runs
+        """
+        if not run_ids:
+            return {}
+        placeholders = ",".join("?" * len(run_ids))
+        by_phase = {}
+        for phase, duration in self.connection().execute(
+                f"SELECT phase, duration FROM phases"
+                f" WHERE run_id IN ({placeholders}) AND ok = 1",
+                run_ids):
+            by_phase.setdefault(phase, []).append(duration)
+        return {phase: median(durations)
+                for phase, durations in by_phase.items()}
+
+    def regressions(self, command, window, threshold):
+        """
+        compare, for each phase, the median over the last <window> runs
+        with the median over the <window> runs before that
+        rows are phase, before, after, ratio - for ratios above threshold
+        """
+        after = self._phase_medians(self._recent_runs(command, window))
+        before = self._phase_medians(
+            self._recent_runs(command, window, offset=window))
+        result = []
+        for phase, now in after.items():
+            then = before.get(phase)
+            if not then:
+                continue
+            ratio = now / then
+            if ratio >= threshold:
+                result.append((phase, then, now, ratio))
+        return result
+
+    ##########
+    def predict_load(self, image_size, bandwidth,
+                     window=20, ratio=.95):
+        """
+        predicted duration in seconds for loading an image of that size
+        based on the last <window> successful loads;
+        returns None if there is not enough history
+
+        a load lasts as long as its slowest node, retries included,
+        so this is based on the wall time of each past run, where the
+        transfer time gets scaled to the new image size; the result
+        is the <ratio> percentile of these
+        """
+        rows = self.connection().execute(
+            "SELECT duration, image_size, transfer FROM runs"
+            " WHERE command = 'load' AND success = 1 AND duration > 0"
+            " AND transfer > 0 AND image_size > 0"
+            " ORDER BY started DESC LIMIT ?", (window,)).fetchall()
+        if not rows:
+            return None
+        predictions = []
+        for duration, size, transfer in rows:
+            # in bytes per second
+            throughput = size / transfer
+            if bandwidth:
+                throughput = min(throughput, bandwidth * MEBI / 8)
+            predictions.append(
+                duration - transfer + image_size / throughput)
+        return percentile(predictions, ratio)
+
+    def load_timeout(self, image_size, bandwidth, fallback):
+        """
+        the timeout to use for a load of that image, given the history
+        fallback is used when no prediction is available
+        """
+        try:
+            predicted = self.predict_load(image_size, bandwidth)
+        except sqlite3.Error as exc:
+            logger.error(f"cannot predict load duration: {exc}")
+            predicted = None
+        if predicted is None:
+            return fallback
+        margin = float(Config().value('reports', 'timeout_margin'))
+        return predicted * margin
+
+    ##########
+    def display(self, command, *, days, limit, window, threshold):
+        print(10*'=', f"{command} trends over the last {days} days")
+        for week, runs, failures, throughput in self.trends(command, days):
+            throughput = (f"{throughput:8.2f} MiB/s"
+                          if throughput is not None else f"{'n/a':>14}")
+            print(f"{week} {runs:4} runs {failures or 0:3} failed"
+                  f" {throughput}")
+        print(10*'=', f"{limit} slowest nodes"
+              f" ({TRANSFER_PHASES[command]} phase)")
+        for hostname, count, average, failures in self.slowest_nodes(
+                command, days, limit):
+            print(f"{hostname:>8} {count:4} runs avg={average:8.2f}s"
+                  f" {failures or 0:3} failed")
+        print(10*'=', f"regressions (last {window} runs vs previous"
+              f" {window}, ratio >= {threshold})")
+        regressions = self.regressions(command, window, threshold)
+        if not regressions:
+            print("none")
+        for phase, before, after, ratio in regressions:
+            print(f"{phase:>14}: {before:8.2f}s -> {after:8.2f}s"
+                  f" (x{ratio:.2f})")
@@ -24,9 +24,22 @@ import telnetlib3
 
 from rhubarbe.logger import logger
 from rhubarbe.config import Config
+from rhubarbe.timing import Timings
 
 MAX_BUF = 16 * 1024
 
+# bounds the number of telnetlib3 negotiations in flight, across all nodes
+# created lazily as it needs to belong in the running loop
+_HANDSHAKES = {}
+
+
+def handshakes_semaphore(limit):
+    loop = asyncio.get_running_loop()
+    if loop not in _HANDSHAKES:
+        _HANDSHAKES.clear()
+        _HANDSHAKES[loop] = asyncio.Semaphore(limit)
+    return _HANDSHAKES[loop]
+
 
 class TelnetClient(telnetlib3.TelnetClient):
     """
@@ -51,12 +64,15 @@ class TelnetProxy:
         self.control_ip = control_ip
         self.message_bus = message_bus
         # config
-        the_config = Config()
-        self.port = int(the_config.value('networking', 'telnet_port'))
-        self.backoff = float(the_config.value('networking', 'telnet_backoff'))
-        self.connect_timeout = float(the_config.value('networking', 'telnet_timeout'))
-        self.connect_minwait = float(the_config.value('networking', 'telnet_connect_minwait'))
-        self.connect_maxwait = float(the_config.value('networking', 'telnet_connect_maxwait'))
+        networking = Config().snapshot.networking
+        self.port = networking.telnet_port
+        self.backoff = networking.telnet_backoff
+        self.backoff_min = networking.telnet_backoff_min
+        self.probe_timeout = networking.telnet_probe_timeout
+        self.max_handshakes = networking.telnet_max_handshakes
+        self.connect_timeout = networking.telnet_timeout
+        self.connect_minwait = networking.telnet_connect_minwait
+        self.connect_maxwait = networking.telnet_connect_maxwait
         # internals
         self.running = False
         self._reader = None
@@ -82,7 +98,7 @@ class TelnetProxy:
         try:
             self._reader, self._writer = await asyncio.wait_for(
                 telnetlib3.open_connection(
-                    self.control_ip, 23, shell=None,
+                    self.control_ip, self.port, shell=None,
                     connect_minwait=self.connect_minwait,
                     connect_maxwait=self.connect_maxwait),
                 timeout = self.connect_timeout)
@@ -92,20 +108,56 @@ class TelnetProxy:
             logger.exception(f"telnet connect: unexpected exception {exc}")
 
 
+    async def probe_port(self):
+        """
+        a cheap check that the telnet port accepts connections;
+        no telnet negotiation takes place
+        """
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.control_ip, self.port),
+                timeout=self.probe_timeout)
+        except (asyncio.TimeoutError, OSError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+
     async def wait_until_connect(self):
         """
         wait for the telnet server to come up
         this has no native timeout mechanism
+
+        the port is first probed with a plain TCP connect, with a capped
+        exponential backoff between telnet_backoff_min and telnet_backoff;
+        the full telnet negotiation is attempted only once the port
+        accepts connections, with at most telnet_max_handshakes
+        negotiations in flight across all nodes
         """
-        while True:
-            await self.try_to_connect()
-            if self.is_ready():
-                return True
-            else:
-                backoff = self.backoff*(0.5 + random.random())
+        with Timings().phase('pxe_boot', self.control_ip) as record:
+            attempts = 0
+            backoff = self.backoff_min
+            while True:
+                attempts += 1
+                record.details['attempts'] = attempts
+                if await self.probe_port():
+                    async with handshakes_semaphore(self.max_handshakes):
+                        await self.try_to_connect()
+                    if self.is_ready():
+                        return True
+                    # the port is open, so the shell is about to come up
+                    backoff = self.backoff_min
+                # random.random() is between 0. and 1.
+                # and so as we need something between 0.5 and 1.5
+                delay = backoff*(0.5 + random.random())
                 await self.feedback('frisbee_status',
-                                    f"backing off for {backoff:.3}s")
-                await asyncio.sleep(backoff)
+                                    f"backing off for {delay:.3}s")
+                await asyncio.sleep(delay)
+                backoff = min(2 * backoff, self.backoff)
 
 
     def line_callback(self, line):
@@ -0,0 +1,208 @@
+"""
+Per-phase timing instrumentation for load, save and wait
+
+Each phase of interest (CMC reset, PXE boot until telnet is ready,
+frisbee transfer, final reset, ssh readiness, ...) gets recorded
+with monotonic timestamps, keyed on the node's control ip - i.e.
+the same key as the one used on the message bus
+
+At the end of a run the recorded phases can be
+* written as a JSON-lines run report
+* summarized as p50/p95 per phase
+"""
+
+# c0111 no docstrings yet
+# w1202 logger & format
+# w0703 catch Exception
+# r1705 else after return
+# pylint: disable=c0111, w1202, r1705
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import json
+import math
+import time
+from pathlib import Path
+from contextlib import contextmanager
+
+from rhubarbe.singleton import Singleton
+from rhubarbe.logger import logger
+from rhubarbe.config import Config
+
+
+def percentile(values, ratio):
+    """
+    nearest-rank percentile; ratio is between 0. and 1.
+    values need not be sorted
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(ratio * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class PhaseRecord:                                      # pylint: disable=r0903
+    """
+    one occurrence of a phase, for one node (or globally when ip is None)
+    """
+    def __init__(self, phase, ip, start):               # pylint: disable=c0103
+        self.phase = phase
+        self.ip = ip                                    # pylint: disable=c0103
+        self.start = start
+        self.end = None
+        # can be set by the code being timed, e.g. to False on failure
+        self.ok = True                                  # pylint: disable=c0103
+        self.details = {}
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def as_dict(self, origin):
+        result = {
+            'ip': self.ip,
+            'phase': self.phase,
+            'start': round(self.start - origin, 3),
+            'end': (round(self.end - origin, 3)
+                    if self.end is not None else None),
+            'duration': (round(self.duration, 3)
+                         if self.end is not None else None),
+            'ok': self.ok,
+        }
+        result.update(self.details)
+        return result
+
+
+class Timings(metaclass=Singleton):
+    """
+    the process-wide collection of phase records
+    """
+
+    def __init__(self):
+        self.records = []
+        # monotonic origin, and the corresponding wall clock
+        self.origin = time.monotonic()
+        self.wall_origin = time.time()
+
+    def reset(self):
+        """
+        start over, for when several commands run in the same process
+        """
+        self.__init__()                                 # pylint: disable=c2801
+
+    @contextmanager
+    def phase(self, phase, ip=None):                    # pylint: disable=c0103
+        """
+        a context manager that times its body; typical use is
+
+            with Timings().phase('frisbee', ip) as record:
+                result = await ...
+                record.ok = bool(result)
+
+        an exception escaping the body marks the phase as failed
+        """
+        record = PhaseRecord(phase, ip, time.monotonic())
+        self.records.append(record)
+        try:
+            yield record
+        except BaseException:
+            record.ok = False
+            raise
+        finally:
+            record.end = time.monotonic()
+            logger.debug(f"timing: {ip} {phase} took {record.duration:.3f}s")
+
+    def durations(self):
+        """
+        a dict phase -> list of durations, only for completed phases
+        phases are listed in order of first occurrence
+        """
+        result = {}
+        for record in self.records:
+            if record.end is None:
+                continue
+            result.setdefault(record.phase, []).append(record.duration)
+        return result
+
+    def summary(self):
+        """
+        a list of text lines with p50/p95 per phase
+        """
+        lines = []
+        for phase, durations in self.durations().items():
+            lines.append(
+                f"{phase:>14}: n={len(durations):<3}"
+                f" p50={percentile(durations, .5):8.2f}s"
+                f" p95={percentile(durations, .95):8.2f}s"
+                f" max={max(durations):8.2f}s")
+        return lines
+
+    def print_summary(self):
+        lines = self.summary()
+        if not lines:
+            return
+        print(10*'=', "timings")
+        for line in lines:
+            print(line)
+
+    def write_report(self, command, **extras):
+        """
+        write a JSON-lines report in the configured reports directory
+        first line is a header that describes the run,
+        then one line per phase record
+        only the reports_keep most recent reports are kept
+
+        returns the path of the report, or None if it could not
+        be written, or if reports are disabled (empty reports_dir)
+        """
+        the_config = Config()
+        reports_dir = the_config.value('reports', 'reports_dir')
+        if not reports_dir:
+            return None
+        reports_dir = Path(reports_dir).expanduser()
+        stamp = time.strftime("%Y-%m-%d@%H-%M-%S",
+                              time.localtime(self.wall_origin))
+        path = reports_dir / f"{command}-{stamp}-{os.getpid()}.jsonl"
+        header = {
+            'command': command,
+            'started': self.wall_origin,
+            'duration': round(time.monotonic() - self.origin, 3),
+        }
+        header.update(extras)
+        try:
+            reports_dir.mkdir(parents=True, exist_ok=True)
+            with path.open('w', encoding='utf-8') as writer:
+                print(json.dumps(header), file=writer)
+                for record in self.records:
+                    print(json.dumps(record.as_dict(self.origin)),
+                          file=writer)
+            logger.info(f"run report written in {path}")
+        except OSError as exc:
+            logger.error(f"could not write run report {path}: {exc}")
+            return None
+        self.prune_reports(
+            reports_dir, int(the_config.value('reports', 'reports_keep')))
+        return path
+
+    @staticmethod
+    def prune_reports(reports_dir, keep):
+        """
+        remove all but the <keep> most recent reports; 0 means keep all
+        """
+        if keep <= 0:
+            return
+        reports = []
+        for report in reports_dir.glob("*.jsonl"):
+            try:
+                reports.append((report.stat().st_mtime, report))
+            except OSError:
+                pass
+        reports.sort(reverse=True)
+        for _, report in reports[keep:]:
+            try:
+                report.unlink()
+            except OSError as exc:
+                logger.warning(f"could not remove old report {report}: {exc}")
@@ -0,0 +1,64 @@
+"""
+frisbeed must get restarted when it dies in the middle of a load
+
+a fake frisbeed - that just sleeps - is used, so this runs anywhere
+"""
+
+# pylint: disable=missing-function-docstring, redefined-outer-name
+# pylint: disable=protected-access
+
+import asyncio
+
+import pytest
+
+from rhubarbe.singleton import Singleton
+from rhubarbe.imageloader import ImageLoader
+
+
+@pytest.fixture
+def fake_frisbeed(tmp_path, monkeypatch):
+    server = tmp_path / "frisbeed"
+    server.write_text("#!/bin/sh\nexec sleep 60\n")
+    server.chmod(0o755)
+    # ./rhubarbe.conf is the last config file to be loaded
+    (tmp_path / "rhubarbe.conf").write_text(
+        f"[frisbee]\n"
+        f"server = {server}\n"
+        f"server_options =\n"
+        f"[networking]\n"
+        f"local_control_ip = 127.0.0.1\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RHUBARBE_CONFIG_CACHE", "")
+    Singleton._instances.clear()
+    yield server
+    Singleton._instances.clear()
+
+
+def test_frisbeed_restarts(fake_frisbeed):             # pylint: disable=w0613
+
+    async def scenario():
+        loader = ImageLoader([], "image.ndz", 500, asyncio.Queue(),
+                             display=None)
+        await loader.start_frisbeed()
+        first = loader.frisbeed
+        assert first.is_running()
+        # frisbeed dies in the middle of the load
+        first.subprocess.kill()
+        await first.subprocess.wait()
+        assert not first.is_running()
+        # this is what each node does before (re)trying to write the image
+        address = await loader.frisbeed_address()
+        second = loader.frisbeed
+        assert second is not first
+        assert second.is_running()
+        assert address == (second.multicast_group, second.multicast_port)
+        # as done at the end of stage2 and in cleanup(),
+        # once frisbeed has died again
+        process = second.subprocess
+        process.kill()
+        await process.wait()
+        second.stop_nowait()
+        second.stop_nowait()
+        assert second.subprocess is None
+
+    asyncio.run(scenario())